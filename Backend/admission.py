@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Admission control for download requests: per-client rate limit, load shedding, concurrency cap.
+
+Refusals raise ``Rejected`` with a ``Retry-After`` estimate. Requests wait for a
+slot on the event loop (``acquire``/``slot``); jobs and batch items take one with
+``hold`` on their own thread. Both share one bounded FIFO queue.
+
+    ADMISSION_MAX_ACTIVE     - concurrent downloads (default: 2x DOWNLOAD_WORKERS)
+    ADMISSION_QUEUE_SIZE     - requests waiting for a slot (default 32)
+    ADMISSION_QUEUE_TIMEOUT  - seconds a request may wait for a slot (default 30)
+    ADMISSION_MAX_LOAD       - load average per CPU above which new work is shed (default 2.0, 0 = off)
+    RATE_LIMIT_PER_MINUTE    - requests a client may start per minute (default 30, 0 = off)
+    RATE_LIMIT_BURST         - requests a client may start at once (default 10)
+    ADMISSION_TRUST_PROXY    - key clients by the first X-Forwarded-For address (default 0)
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import math
+import os
+import threading
+import time
+
+from executors import DOWNLOAD_WORKERS
+from metrics import record_wait
+
+ADMISSION_MAX_ACTIVE = int(os.environ.get("ADMISSION_MAX_ACTIVE", 2 * DOWNLOAD_WORKERS))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 32))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 30))
+ADMISSION_MAX_LOAD = float(os.environ.get("ADMISSION_MAX_LOAD", 2.0))
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", 30))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 10))
+ADMISSION_TRUST_PROXY = os.environ.get("ADMISSION_TRUST_PROXY", "0") == "1"
+# Buckets kept before idle (full) ones are dropped
+MAX_BUCKETS = 10000
+# Weight of a new service time in the moving average
+SERVICE_ALPHA = 0.2
+
+class Rejected(Exception):
+    """A request refused by admission control, with its HTTP status and Retry-After seconds"""
+
+    def __init__(self, status, message, retry_after, reason):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+class TokenBucket:
+    """``burst`` tokens, refilled at ``rate`` tokens per second"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Take a token; returns 0, or the seconds until one is available"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self):
+        self._refill()
+        return self.tokens >= self.burst
+
+def client_key(request):
+    """Rate-limit key of a request: the peer address, or the forwarded client address behind a proxy"""
+    if ADMISSION_TRUST_PROXY:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+def cpu_pressure():
+    """1-minute load average per CPU (0 where the platform has no load average)"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return 0.0
+
+class AdmissionController:
+    """Token buckets, load shedding and a bounded FIFO queue in front of a concurrency cap"""
+
+    def __init__(self, max_active=ADMISSION_MAX_ACTIVE, queue_size=ADMISSION_QUEUE_SIZE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, max_load=ADMISSION_MAX_LOAD,
+                 rate_per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST, pressure=cpu_pressure):
+        self.max_active = max(1, max_active)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.max_load = max_load
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.pressure = pressure
+
+        self._buckets = {}
+        # Guards the slot counts and the queue, which threads use too
+        self._lock = threading.Lock()
+        # concurrent.futures.Future per waiter, oldest first; a slot is handed to the head directly
+        self._waiters = collections.deque()
+        self.active = 0
+        self.service_seconds = None
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = collections.Counter()
+
+    # ---- public API ----
+    def check_rate(self, client):
+        """Spend one of ``client``'s tokens or raise ``Rejected`` (429)"""
+        if self.rate <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune()
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+        wait = bucket.take()
+        if wait:
+            self._reject(429, f"Rate limit exceeded for {client}", wait, "rate_limited")
+
+    async def acquire(self, client, rate_limit=True):
+        """Wait for a download slot (rate limit and load checks first); returns the admission time"""
+        if rate_limit:
+            self.check_rate(client)
+        if self.active and self.max_load > 0:
+            load = self.pressure()
+            if load > self.max_load:
+                self._reject(503, f"Server is overloaded (load {load:.2f} per CPU)", self._drain_estimate(),
+                             "overloaded")
+
+        queued_at = time.monotonic()
+        waiter = self._take_or_wait(self.queue_size)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(waiter)), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._abandon(waiter)
+                self._reject(503, f"No download slot within {self.queue_timeout:.0f}s",
+                             self._drain_estimate(), "queue_timeout")
+            except asyncio.CancelledError:
+                # Client went away while waiting
+                self._abandon(waiter)
+                raise
+
+        return self._admitted(queued_at)
+
+    def hold_slot(self):
+        """Blocking ``acquire`` for worker threads: no rate limit or shedding, no queue limit or timeout"""
+        queued_at = time.monotonic()
+        waiter = self._take_or_wait(None)
+        if waiter is not None:
+            try:
+                waiter.result()
+            except BaseException:
+                self._abandon(waiter)
+                raise
+        return self._admitted(queued_at)
+
+    @contextlib.contextmanager
+    def hold(self):
+        """Hold a download slot in a worker thread for the duration of the block"""
+        admitted_at = self.hold_slot()
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
+
+    def has_room(self):
+        """True while a new request would get a slot at once and load is under the limit"""
+        with self._lock:
+            if self.active >= self.max_active or self._waiters:
+                return False
+            active = self.active
+        return not (active and self.max_load > 0 and self.pressure() > self.max_load)
+
+    def release(self, admitted_at=None):
+        """Give a slot back (from any thread); it goes straight to the oldest waiter if there is one"""
+        with self._lock:
+            if admitted_at is not None:
+                seconds = time.monotonic() - admitted_at
+                if self.service_seconds is None:
+                    self.service_seconds = seconds
+                else:
+                    self.service_seconds += SERVICE_ALPHA * (seconds - self.service_seconds)
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                # False if the waiter gave up (timeout, disconnect) meanwhile
+                if waiter.set_running_or_notify_cancel():
+                    break
+            else:
+                self.active = max(self.active - 1, 0)
+                return
+        # The slot moves to the waiter; ``active`` stays the same
+        waiter.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, client):
+        """Hold a download slot for the duration of the block"""
+        admitted_at = await self.acquire(client)
+        try:
+            yield
+        finally:
+            self.release(admitted_at)
+
+    def stats(self):
+        with self._lock:
+            active, waiting = self.active, len(self._waiters)
+        return {
+            "active": active,
+            "max_active": self.max_active,
+            "waiting": waiting,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": sum(self.rejected.values()),
+            "rejected_by_reason": dict(self.rejected),
+            "service_seconds": round(self.service_seconds, 3) if self.service_seconds is not None else None,
+            "load_per_cpu": round(self.pressure(), 2),
+            "clients": len(self._buckets),
+        }
+
+    # ---- internals ----
+    def _reject(self, status, message, retry_after, reason):
+        self.rejected[reason] += 1
+        raise Rejected(status, message, max(1, math.ceil(retry_after)), reason)
+
+    def _take_or_wait(self, queue_size):
+        """Take a free slot (returns None), or queue a Future that resolves once one is handed over"""
+        with self._lock:
+            if self.active < self.max_active and not self._waiters:
+                self.active += 1
+                return None
+            if queue_size is not None and len(self._waiters) >= queue_size:
+                waiting = len(self._waiters)
+            else:
+                waiter = concurrent.futures.Future()
+                self._waiters.append(waiter)
+                self.queued += 1
+                return waiter
+        self._reject(503, f"Too many requests waiting ({waiting} queued)", self._drain_estimate(), "queue_full")
+
+    def _admitted(self, queued_at):
+        with self._lock:
+            self.admitted += 1
+        record_wait("admission", time.monotonic() - queued_at)
+        return time.monotonic()
+
+    def _abandon(self, waiter):
+        """Take a waiter out of the queue; if it was handed a slot meanwhile, pass the slot on"""
+        if not waiter.cancel():
+            # Already running: release() handed it a slot
+            self.release()
+            return
+        with self._lock, contextlib.suppress(ValueError):
+            self._waiters.remove(waiter)
+
+    def _drain_estimate(self):
+        """Seconds until the requests ahead are likely done, from the average service time"""
+        per_request = self.service_seconds or self.queue_timeout
+        return per_request * (len(self._waiters) + 1) / self.max_active
+
+    def _prune(self):
+        """Drop buckets of clients that have been idle long enough to refill"""
+        for client in [client for client, bucket in self._buckets.items() if bucket.full()]:
+            del self._buckets[client]
+
+admission = AdmissionController()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Bandwidth estimate shared by all worker processes through a small JSON file.
+
+Reads never block: a stale value is returned and refreshed in the background.
+
+    BANDWIDTH_MODE - speedtest (default) | passive (yt-dlp speeds only) | offline (BANDWIDTH_MBPS)
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from metrics import span
+
+# -------------------------
+# CONFIGURATION
+# -------------------------
+BANDWIDTH_MODE = os.environ.get("BANDWIDTH_MODE", "speedtest").lower()
+BANDWIDTH_CACHE_FILE = Path(
+    os.environ.get("BANDWIDTH_CACHE_FILE", Path(tempfile.gettempdir()) / "yt_audio_bandwidth.json")
+)
+BANDWIDTH_TTL = float(os.environ.get("BANDWIDTH_TTL", 1800))
+BANDWIDTH_MBPS = float(os.environ.get("BANDWIDTH_MBPS", 0))
+
+# Weight of a new passive sample in the moving average
+PASSIVE_ALPHA = 0.3
+# Minimum seconds between cache file writes caused by passive samples
+PASSIVE_WRITE_INTERVAL = 5.0
+# A refresh lock older than this is considered abandoned
+REFRESH_LOCK_TIMEOUT = 120.0
+
+def measure_download_speed():
+    """Run a full speedtest and return the download speed in Mbps"""
+    # Imported here so offline mode works without speedtest-cli installed
+    import speedtest
+
+    st = speedtest.Speedtest()
+    st.get_best_server()
+    st.download(threads=None)
+    dl_bps = st.results.dict().get("download", 0)
+    return dl_bps / 1_000_000.0
+
+class BandwidthEstimator:
+    """TTL-cached bandwidth estimate backed by a shared JSON file"""
+
+    def __init__(self, cache_file=BANDWIDTH_CACHE_FILE, ttl=BANDWIDTH_TTL,
+                 mode=BANDWIDTH_MODE, measure=None):
+        self.cache_file = Path(cache_file)
+        self.ttl = ttl
+        self.mode = mode
+        self.measure = measure
+
+        self._lock = threading.Lock()
+        self._state = {"mbps": 0.0, "updated_at": 0.0, "source": None}
+        self._loaded_mtime = None
+        self._last_write = 0.0
+        self._refreshing = False
+
+    # ---- cache file ----
+    def _load(self):
+        """Reload the shared cache if another process has updated it"""
+        try:
+            mtime = self.cache_file.stat().st_mtime
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        try:
+            data = json.loads(self.cache_file.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("updated_at", 0) >= self._state["updated_at"]:
+            self._state = {
+                "mbps": float(data.get("mbps", 0.0)),
+                "updated_at": float(data.get("updated_at", 0.0)),
+                "source": data.get("source"),
+            }
+        self._loaded_mtime = mtime
+
+    def _save(self):
+        """Atomically publish the current state to the shared cache"""
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_file.parent, prefix=".bandwidth-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._state, f)
+            os.replace(tmp, self.cache_file)
+            self._loaded_mtime = self.cache_file.stat().st_mtime
+            self._last_write = time.time()
+        except OSError as e:
+            print(f"Could not write bandwidth cache: {e}")
+
+    # ---- public API ----
+    def current_mbps(self, default=0.0):
+        """Return the latest estimate without blocking, refreshing it in the background if stale"""
+        if self.mode == "offline":
+            return BANDWIDTH_MBPS or default
+
+        with self._lock:
+            self._load()
+            state = dict(self._state)
+
+        if time.time() - state["updated_at"] > self.ttl:
+            self.refresh_async()
+
+        return state["mbps"] or default
+
+    def observe(self, bytes_per_sec):
+        """Fold an observed transfer speed (bytes/s) into the estimate"""
+        if self.mode == "offline" or not bytes_per_sec:
+            return
+        sample = bytes_per_sec * 8 / 1_000_000.0
+        now = time.time()
+        with self._lock:
+            self._load()
+            previous = self._state["mbps"]
+            mbps = sample if not previous else previous + PASSIVE_ALPHA * (sample - previous)
+            self._state = {"mbps": mbps, "updated_at": now, "source": "passive"}
+            if now - self._last_write >= PASSIVE_WRITE_INTERVAL:
+                self._save()
+
+    def progress_hook(self, progress):
+        """yt-dlp progress hook that feeds observed speeds into the estimate"""
+        if progress.get("status") == "downloading":
+            self.observe(progress.get("speed"))
+
+    def refresh(self):
+        """Measure bandwidth now (blocking) and publish the result"""
+        with span("speedtest"):
+            # Looked up at call time, so the module function can be replaced
+            mbps = (self.measure or measure_download_speed)()
+        with self._lock:
+            self._state = {"mbps": mbps, "updated_at": time.time(), "source": "speedtest"}
+            self._save()
+        return mbps
+
+    def refresh_async(self):
+        """Start a background refresh unless one is already running anywhere"""
+        if self.mode != "speedtest":
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_worker, daemon=True).start()
+
+    def _refresh_worker(self):
+        lock_path = self.cache_file.with_suffix(".lock")
+        try:
+            if not self._acquire_refresh_lock(lock_path):
+                return
+            try:
+                mbps = self.refresh()
+                print(f"Bandwidth estimate refreshed: {mbps:.2f} Mbps")
+            except Exception as e:
+                print(f"Background speed test failed: {e}")
+                # Back off for a full TTL instead of retrying on every request
+                with self._lock:
+                    self._state["updated_at"] = time.time()
+                    self._save()
+            finally:
+                try:
+                    lock_path.unlink()
+                except OSError:
+                    pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    @staticmethod
+    def _acquire_refresh_lock(lock_path):
+        """Cross-process guard so only one worker runs a speedtest at a time"""
+        try:
+            lock_path.parent.mkdir(parents=True, exist_ok=True)
+            if lock_path.exists() and time.time() - lock_path.stat().st_mtime > REFRESH_LOCK_TIMEOUT:
+                lock_path.unlink()
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            return True
+        except OSError:
+            return False
+
+class StaticEstimator:
+    """Estimator with a fixed value; never touches the network (for tests and offline use)"""
+
+    def __init__(self, mbps=0.0):
+        self.mbps = mbps
+        self.samples = []
+
+    def current_mbps(self, default=0.0):
+        return self.mbps or default
+
+    def observe(self, bytes_per_sec):
+        if bytes_per_sec:
+            self.samples.append(bytes_per_sec)
+
+    def progress_hook(self, progress):
+        if progress.get("status") == "downloading":
+            self.observe(progress.get("speed"))
+
+    def refresh(self):
+        return self.mbps
+
+    def refresh_async(self):
+        pass
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+def get_estimator():
+    """Return the process-wide estimator, creating it on first use"""
+    global _estimator
+    with _estimator_lock:
+        if _estimator is None:
+            _estimator = BandwidthEstimator()
+        return _estimator
+
+def set_estimator(estimator):
+    """Replace the process-wide estimator (e.g. with a StaticEstimator in tests)"""
+    global _estimator
+    with _estimator_lock:
+        _estimator = estimator
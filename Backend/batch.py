@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Batch and playlist downloads, streamed back as a ZIP while later items still download.
+"""
+
+import concurrent.futures
+import json
+import os
+import zipfile
+from urllib.parse import parse_qs, urlparse
+
+from executors import StreamBuffer
+from metrics import BYTES_TRANSFERRED
+from ydl_pool import ydl_pool
+
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", 3))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 200))
+# ZIP chunks buffered per client before the writer (and downloads) pause
+ZIP_BUFFER_CHUNKS = 64
+
+COLLECTION_PATH_PREFIXES = ("/playlist", "/channel/", "/c/", "/user/", "/@")
+
+def is_collection_url(url):
+    """True for playlist/channel URLs that should be expanded into items
+
+    A video watched inside a playlist (``watch?v=...&list=...``) is just that video.
+    """
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    if "list" in query and "v" not in query:
+        return True
+    return parsed.path.startswith(COLLECTION_PATH_PREFIXES)
+
+def _iter_entries(entries):
+    for entry in entries or []:
+        if not entry:
+            continue
+        if entry.get("_type") == "playlist":
+            # Channels nest their tabs as playlists
+            yield from _iter_entries(entry.get("entries"))
+            continue
+        url = entry.get("webpage_url") or entry.get("url")
+        if url:
+            yield url
+
+def expand_urls(urls, max_items=BATCH_MAX_ITEMS):
+    """Yield individual video URLs, expanding playlists and channels lazily"""
+    seen = set()
+    ydl_opts = {
+        "extract_flat": "in_playlist",
+        "lazy_playlist": True,
+        "quiet": True,
+        "no_warnings": True,
+    }
+    with ydl_pool.lease(ydl_opts) as ydl:
+        for url in urls:
+            if is_collection_url(url):
+                # One flat metadata pass; entries are produced as pages are fetched
+                info = ydl.extract_info(url, download=False, process=False)
+                items = _iter_entries(info.get("entries")) if info.get("_type") == "playlist" else [url]
+            else:
+                items = [url]
+
+            for item in items:
+                if item in seen:
+                    continue
+                seen.add(item)
+                yield item
+                if len(seen) >= max_items:
+                    return
+
+def run_batch(urls, produce, workers=BATCH_WORKERS, cancelled=None):
+    """Run ``produce(url)`` for each URL on a bounded pool, yielding results as they complete.
+
+    Yields ``(index, url, result, error)``. URLs are pulled from the (possibly
+    lazy) iterable only as workers free up, so expansion overlaps downloading.
+    Setting ``cancelled`` (a ``threading.Event``) or closing the generator
+    cancels the items not started yet and returns without waiting for the
+    running ones.
+    """
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    pending = {}
+    try:
+        items = enumerate(urls)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < workers:
+                try:
+                    index, url = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(produce, url)] = (index, url)
+
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(pending, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+            if cancelled is not None and cancelled.is_set():
+                return
+            for future in done:
+                index, url = pending.pop(future)
+                try:
+                    yield index, url, future.result(), None
+                except Exception as e:
+                    yield index, url, None, e
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        # Stops a lazy playlist expansion (and returns its pooled YoutubeDL)
+        if hasattr(urls, "close"):
+            urls.close()
+
+class _QueueWriter:
+    """Write-only, non-seekable file object that hands chunks to a bounded queue"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        if not self.chunks.put(data):
+            raise BrokenPipeError("Client disconnected")
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+class ZipStream:
+    """Builds a ZIP of batch results in a worker thread and exposes it as an async byte stream.
+
+    ``produce(url)`` must return a dict with a ``path`` to the finished file,
+    and may add a ``cleanup`` callable to run once the file is in the archive.
+    A ``manifest.json`` listing every item and its outcome is added last.
+    """
+
+    _EOF = object()
+
+    def __init__(self, urls, produce, workers=BATCH_WORKERS):
+        self.urls = urls
+        self.produce = produce
+        self.workers = workers
+        self.chunks = StreamBuffer(ZIP_BUFFER_CHUNKS)
+
+    def run(self):
+        """Blocking body, meant for an executor thread"""
+        writer = _QueueWriter(self.chunks)
+        manifest = []
+        results = run_batch(self.urls, self.produce, self.workers, cancelled=self.chunks.closed)
+        try:
+            with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+                for index, url, result, error in results:
+                    if self.chunks.closed.is_set():
+                        break
+                    if error is not None:
+                        print(f"Batch item failed: {url}: {error}")
+                        manifest.append({"index": index, "url": url, "status": "error", "error": str(error)})
+                        continue
+                    arcname = f"{index + 1:03d} - {result['path'].name}"
+                    try:
+                        archive.write(result["path"], arcname)
+                    finally:
+                        if result.get("cleanup"):
+                            result["cleanup"]()
+                    manifest.append({"index": index, "url": url, "status": "success", "file": arcname})
+                archive.writestr("manifest.json", json.dumps(sorted(manifest, key=lambda m: m["index"]), indent=2))
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            print(f"Batch failed: {e}")
+        finally:
+            # Cancels the items not started yet instead of downloading them for nobody
+            results.close()
+            self.chunks.put(self._EOF)
+
+    async def iter_chunks(self):
+        """Async iterator over ZIP bytes; stops the batch if the consumer goes away"""
+        try:
+            while True:
+                item = await self.chunks.get(default=self._EOF)
+                if item is self._EOF:
+                    break
+                BYTES_TRANSFERRED.inc(len(item), direction="served")
+                yield item
+        finally:
+            self.chunks.close()
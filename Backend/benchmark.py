@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""Benchmark the download + transcode pipeline against local fixtures.
+
+    python benchmark.py --levels 1,4,16,64 --output bench.json
+    python benchmark.py --scenario core --lengths 30 --compare bench.json
+    python benchmark.py --scenario startup --max-startup-seconds 2
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+FIXTURE_DIR = Path(tempfile.gettempdir()) / "yt_audio_bench_fixtures"
+BACKEND_DIR = Path(__file__).resolve().parent
+
+# Imported on first use; importing the API must not load them
+LAZY_MODULES = ("yt_dlp", "segmented", "speedtest")
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+print(json.dumps({"seconds": time.perf_counter() - started, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+# Source codecs as YouTube serves them: (file extension, ffmpeg encoder args)
+SOURCE_CODECS = {
+    "opus": ("webm", ["-c:a", "libopus", "-b:a", "160k"]),
+    # moov up front, like YouTube's m4a, so it can be piped into ffmpeg
+    "aac": ("m4a", ["-c:a", "aac", "-b:a", "128k", "-movflags", "+faststart"]),
+    "mp3": ("mp3", ["-c:a", "libmp3lame", "-b:a", "192k"]),
+}
+
+# ---- fixtures ----
+def make_fixtures(directory, lengths, codecs):
+    """Generate (or reuse) one fixture per length and codec; returns their file names"""
+    directory.mkdir(parents=True, exist_ok=True)
+    names = []
+    for seconds in lengths:
+        for codec in codecs:
+            ext, args = SOURCE_CODECS[codec]
+            name = f"fixture_{seconds}s_{codec}.{ext}"
+            path = directory / name
+            if not path.exists():
+                print(f"Generating fixture {name}...")
+                # Two detuned tones plus a little noise, so encoders have something to work on
+                tmp = path.with_suffix(".tmp" + path.suffix)
+                subprocess.run([
+                    "ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-f", "lavfi", "-i", f"sine=frequency=554:duration={seconds}",
+                    "-f", "lavfi", "-i", f"anoisesrc=amplitude=0.05:duration={seconds}",
+                    "-filter_complex", "amix=inputs=3,aformat=channel_layouts=stereo",
+                    "-ar", "48000", *args, str(tmp)
+                ], check=True)
+                os.replace(tmp, path)
+            names.append(name)
+    return names
+
+# ---- measurement ----
+def percentile(values, p):
+    """Linear-interpolated percentile of a list, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def _rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No procfs: fall back to the high-water mark (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+class ResourceSampler:
+    """Samples RSS in a background thread and measures CPU time (ours and ffmpeg's) over a run"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._times = os.times()
+        self.peak_rss = _rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        end = os.times()
+        self.cpu_self = (end.user - self._times.user) + (end.system - self._times.system)
+        self.cpu_children = (
+            (end.children_user - self._times.children_user) + (end.children_system - self._times.children_system)
+        )
+        # Largest child (ffmpeg) so far; a process-lifetime high-water mark
+        child_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        self.peak_child_rss = child_peak if sys.platform == "darwin" else child_peak * 1024
+
+# ---- scenarios ----
+class CoreScenario:
+    """``download_audio_from_youtube`` in a thread per job"""
+
+    name = "core"
+
+    def __init__(self, target, workdir):
+        from downloader_core import download_audio_from_youtube
+        self.download = download_audio_from_youtube
+        self.target = target
+        self.workdir = workdir
+
+    def run_job(self, url, index):
+        output_dir = self.workdir / f"core_{index}"
+        try:
+            result = self.download(url, output_dir=str(output_dir), keep_original=False, output_format=self.target)
+            return sum(
+                (output_dir / f["name"]).stat().st_size
+                for f in result["files"] if (output_dir / f["name"]).exists()
+            )
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    def close(self):
+        pass
+
+class ApiScenario:
+    """``POST /download-file`` over HTTP against the app running in uvicorn"""
+
+    name = "api"
+
+    def __init__(self, target, workdir):
+        import uvicorn
+        import main
+
+        self.target = target
+        config = uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("uvicorn failed to start")
+            time.sleep(0.05)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    def run_job(self, url, index):
+        body = json.dumps({
+            "url": url,
+            "convert_mp3": self.target == "mp3",
+            "keep_original": False,
+            "output_format": self.target,
+        }).encode()
+        request = urllib.request.Request(
+            self.base_url + "/download-file", data=body, headers={"Content-Type": "application/json"}
+        )
+        received = 0
+        with urllib.request.urlopen(request, timeout=600) as response:
+            while True:
+                chunk = response.read(256 * 1024)
+                if not chunk:
+                    break
+                received += len(chunk)
+        return received
+
+    def close(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+SCENARIOS = {"core": CoreScenario, "api": ApiScenario}
+
+# ---- startup ----
+def _backend_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(BACKEND_DIR), env.get("PYTHONPATH")]))
+    return env
+
+def _spread(values):
+    return {"median": _round(percentile(values, 50)), "min": _round(min(values)), "max": _round(max(values))}
+
+def measure_import(workdir, runs):
+    """Seconds to ``import main`` in a fresh interpreter, plus lazy modules it loaded anyway"""
+    times = []
+    loaded = set()
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_PROBE % (LAZY_MODULES,)],
+            cwd=workdir, env=_backend_env(), capture_output=True, text=True, check=True
+        )
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(probe["seconds"])
+        loaded.update(probe["loaded"])
+    return times, sorted(loaded)
+
+def measure_cold_start(workdir, runs, timeout=60):
+    """Seconds from launching uvicorn to the first successful ``GET /health``"""
+    times = []
+    for _ in range(runs):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        started = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=workdir, env=_backend_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with status {proc.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise RuntimeError(f"no healthy response within {timeout}s")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(0.01)
+            times.append(time.perf_counter() - started)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    return times
+
+def run_startup(workdir, runs):
+    import_times, loaded = measure_import(workdir, runs)
+    return {
+        "scenario": "startup",
+        "runs": runs,
+        "import_seconds": _spread(import_times),
+        "cold_start_seconds": _spread(measure_cold_start(workdir, runs)),
+        "lazy_modules_loaded": loaded,
+    }
+
+def run_level(scenario, server, fixtures, concurrency, jobs, run_id):
+    """Run ``jobs`` jobs with ``concurrency`` in flight; returns the level's results"""
+    sizes = {name: (FIXTURE_DIR / name).stat().st_size for name in fixtures}
+    work = [
+        # Unique query string per job: distinct cache keys, same file on the server
+        (
+            i, fixtures[i % len(fixtures)],
+            server.url(fixtures[i % len(fixtures)]) + f"?bench={run_id}-{scenario.name}-{concurrency}-{i}"
+        )
+        for i in range(jobs)
+    ]
+    latencies = []
+    errors = []
+    source_bytes = 0
+    output_bytes = 0
+
+    def timed(index, url):
+        start = time.perf_counter()
+        produced = scenario.run_job(url, index)
+        return time.perf_counter() - start, produced
+
+    with ResourceSampler() as sampler:
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(timed, i, url): name for i, name, url in work}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    latency, produced = future.result()
+                except Exception as e:
+                    errors.append(f"{futures[future]}: {e}")
+                    continue
+                latencies.append(latency)
+                source_bytes += sizes[futures[future]]
+                output_bytes += produced
+        wall = time.perf_counter() - started
+
+    completed = len(latencies)
+    return {
+        "scenario": scenario.name,
+        "concurrency": concurrency,
+        "jobs": jobs,
+        "completed": completed,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "wall_seconds": round(wall, 3),
+        "jobs_per_second": round(completed / wall, 3) if wall else None,
+        "source_mb_per_second": round(source_bytes / wall / 1e6, 3) if wall else None,
+        "output_mb_per_second": round(output_bytes / wall / 1e6, 3) if wall else None,
+        "latency_seconds": {
+            "p50": _round(percentile(latencies, 50)),
+            "p90": _round(percentile(latencies, 90)),
+            "p99": _round(percentile(latencies, 99)),
+            "max": _round(max(latencies) if latencies else None),
+        },
+        "cpu_seconds_per_job": {
+            "python": _round(sampler.cpu_self / completed if completed else None),
+            "ffmpeg": _round(sampler.cpu_children / completed if completed else None),
+        },
+        "peak_rss_mb": round(sampler.peak_rss / 1e6, 1),
+        "peak_child_rss_mb": round(sampler.peak_child_rss / 1e6, 1),
+    }
+
+def _round(value, digits=3):
+    return None if value is None else round(value, digits)
+
+# ---- reporting ----
+def print_level(result):
+    latency = result["latency_seconds"]
+    cpu = result["cpu_seconds_per_job"]
+    print(
+        f"{result['scenario']:>4} c={result['concurrency']:<3} "
+        f"{result['completed']}/{result['jobs']} ok  "
+        f"{result['jobs_per_second']:.2f} jobs/s  {result['source_mb_per_second']:.1f} MB/s in  "
+        f"p50 {_fmt(latency['p50'])}  p90 {_fmt(latency['p90'])}  p99 {_fmt(latency['p99'])}  "
+        f"cpu/job {_fmt(cpu['python'])}+{_fmt(cpu['ffmpeg'])}s  rss {result['peak_rss_mb']:.0f} MB"
+    )
+
+def print_startup(result):
+    imports, cold = result["import_seconds"], result["cold_start_seconds"]
+    print(
+        f"startup import main {imports['median']:.3f}s (min {imports['min']:.3f})  "
+        f"cold start to /health {cold['median']:.3f}s (min {cold['min']:.3f})  "
+        f"eagerly loaded: {', '.join(result['lazy_modules_loaded']) or 'none'}"
+    )
+
+def startup_regressions(result, max_import, max_startup):
+    """Reasons the startup result fails the given limits"""
+    problems = []
+    if result["lazy_modules_loaded"]:
+        problems.append(f"importing main loads {', '.join(result['lazy_modules_loaded'])}")
+    if max_import is not None and result["import_seconds"]["median"] > max_import:
+        problems.append(f"import takes {result['import_seconds']['median']:.3f}s (limit {max_import}s)")
+    if max_startup is not None and result["cold_start_seconds"]["median"] > max_startup:
+        problems.append(f"cold start takes {result['cold_start_seconds']['median']:.3f}s (limit {max_startup}s)")
+    return problems
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.2f}"
+
+def compare(baseline, current):
+    """Print the change in throughput and median latency per scenario and level"""
+    old = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nCompared with {baseline.get('started_at_iso', 'baseline')}:")
+    changed = [
+        key for key in ("fixtures", "target", "rate", "mbps", "env")
+        if baseline["config"].get(key) != current["config"].get(key)
+    ]
+    if changed or baseline["host"] != current["host"]:
+        print(f"  note: runs differ in {', '.join(changed + (['host'] if baseline['host'] != current['host'] else []))}")
+    if baseline.get("startup") and current.get("startup"):
+        before, after = baseline["startup"], current["startup"]
+        print(
+            f"startup import {_change(before['import_seconds']['median'], after['import_seconds']['median'])}  "
+            f"cold start {_change(before['cold_start_seconds']['median'], after['cold_start_seconds']['median'])}"
+        )
+    for result in current["results"]:
+        previous = old.get((result["scenario"], result["concurrency"]))
+        if previous is None:
+            continue
+        print(
+            f"{result['scenario']:>4} c={result['concurrency']:<3} "
+            f"jobs/s {_change(previous['jobs_per_second'], result['jobs_per_second'])}  "
+            f"p50 {_change(previous['latency_seconds']['p50'], result['latency_seconds']['p50'])}  "
+            f"p99 {_change(previous['latency_seconds']['p99'], result['latency_seconds']['p99'])}"
+        )
+
+def _change(old, new):
+    if not old or new is None:
+        return "n/a"
+    return f"{new:.2f} ({(new - old) / old * 100:+.1f}%)"
+
+# ---- main ----
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", choices=["core", "api", "startup", "all"], default="all")
+    parser.add_argument("--levels", default="1,4,16,64", help="comma-separated concurrency levels")
+    parser.add_argument("--jobs", type=int, default=8, help="minimum jobs per level (at least the level itself)")
+    parser.add_argument("--lengths", default="30,180", help="fixture lengths in seconds")
+    parser.add_argument("--codecs", default="opus,aac", help=f"fixture codecs ({', '.join(SOURCE_CODECS)})")
+    parser.add_argument("--target", default="mp3", help="output format requested per job")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="per-connection throttle of the local server in bytes/s (default: unthrottled)")
+    parser.add_argument("--mbps", type=float, default=100.0, help="bandwidth reported by the stubbed speedtest")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh imports and cold starts to time")
+    parser.add_argument("--max-import-seconds", type=float, help="fail if importing main takes longer (median)")
+    parser.add_argument("--max-startup-seconds", type=float, help="fail if a cold start takes longer (median)")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    levels = [int(level) for level in args.levels.split(",")]
+    lengths = [int(length) for length in args.lengths.split(",")]
+    codecs = args.codecs.split(",")
+    scenarios = ["startup", "core", "api"] if args.scenario == "all" else [args.scenario]
+    load_scenarios = [name for name in scenarios if name in SCENARIOS]
+    output = Path(args.output).resolve() if args.output else None
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    fixtures = make_fixtures(FIXTURE_DIR, lengths, codecs) if load_scenarios else []
+
+    # Scratch working directory: the app's temp, cache, job and partial files land here
+    workdir = Path(tempfile.mkdtemp(prefix="yt_audio_bench_"))
+    os.chdir(workdir)
+    os.environ["BANDWIDTH_MODE"] = "offline"
+    # As in the tests: no preset profiling or warm-up competing with the measured jobs
+    os.environ["PRESET_PROFILE"] = "0"
+    os.environ["WARMUP"] = "0"
+    for name, default in (("TEMP_DOWNLOAD_DIR", "temp_downloads"), ("RESULT_CACHE_DIR", "result_cache"),
+                          ("JOBS_DIR", "jobs"), ("PRESET_CHOICES_FILE", "presets.json")):
+        os.environ.setdefault(name, str(workdir / default))
+    # Every job comes from one client address; the concurrency cap and queue still apply
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    os.environ.setdefault("CONNECTION_STATS_FILE", str(workdir / "connections.json"))
+
+    from bandwidth import StaticEstimator, set_estimator
+    from local_server import LocalMediaServer
+
+    # No speedtest: a fixed estimate drives the connection count
+    set_estimator(StaticEstimator(args.mbps))
+
+    report = {
+        "started_at": time.time(),
+        "started_at_iso": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {
+            "levels": levels,
+            "min_jobs": args.jobs,
+            "fixtures": fixtures,
+            "target": args.target,
+            "rate": args.rate,
+            "mbps": args.mbps,
+            "env": {
+                key: os.environ[key]
+                for key in ("DOWNLOAD_WORKERS", "TRANSCODE_WORKERS", "STREAM_TRANSCODE", "ADAPTIVE_CONNECTIONS",
+                            "ADMISSION_MAX_ACTIVE", "ADMISSION_QUEUE_SIZE", "RATE_LIMIT_PER_MINUTE")
+                if key in os.environ
+            },
+        },
+        "results": [],
+    }
+
+    run_id = int(report["started_at"])
+    problems = []
+    try:
+        if "startup" in scenarios:
+            # Own directory, so the cold start does not index the load scenarios' files
+            startup_dir = workdir / "startup"
+            startup_dir.mkdir()
+            report["startup"] = run_startup(startup_dir, args.startup_runs)
+            print_startup(report["startup"])
+            problems = startup_regressions(report["startup"], args.max_import_seconds, args.max_startup_seconds)
+        if load_scenarios:
+            with LocalMediaServer(FIXTURE_DIR, per_connection_bps=args.rate) as server:
+                for name in load_scenarios:
+                    scenario = SCENARIOS[name](args.target, workdir)
+                    try:
+                        for level in levels:
+                            result = run_level(scenario, server, fixtures, level, max(args.jobs, level), run_id)
+                            report["results"].append(result)
+                            print_level(result)
+                    finally:
+                        scenario.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report["regressions"] = problems
+    if output:
+        output.write_text(json.dumps(report, indent=2))
+        print(f"Results written to {output}")
+    if baseline:
+        compare(baseline, report)
+    for problem in problems:
+        print(f"STARTUP REGRESSION: {problem}")
+    return report
+
+if __name__ == "__main__":
+    sys.exit(1 if main()["regressions"] else 0)
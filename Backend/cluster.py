@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""Optional cluster mode: each video is downloaded and cached by one owner node, picked by a consistent-hash ring.
+
+Requests are forwarded to the owner or redirected to it. Forwarded requests carry
+``X-Cluster-Forwarded`` with ``CLUSTER_SECRET`` and are never routed again.
+
+    CLUSTER_NODES           - base URLs of all nodes, comma-separated, or @path to a file with one per line
+                              (re-read every health check); empty = cluster mode off
+    CLUSTER_SELF            - this node's base URL, as written in CLUSTER_NODES
+    CLUSTER_MODE            - forward | redirect (default forward)
+    CLUSTER_VNODES          - ring points per node (default 160)
+    CLUSTER_HEALTH_INTERVAL - seconds between peer health checks (default 5)
+    CLUSTER_FORWARD_TIMEOUT - socket timeout of a forwarded request (default 600)
+    CLUSTER_SECRET          - shared secret sent in X-Cluster-Forwarded (required in cluster mode)
+"""
+
+import asyncio
+import bisect
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.request
+from urllib.parse import urlencode, urlsplit
+
+from starlette.background import BackgroundTask
+from starlette.responses import RedirectResponse, StreamingResponse
+
+CLUSTER_NODES = os.environ.get("CLUSTER_NODES", "")
+CLUSTER_SELF = os.environ.get("CLUSTER_SELF", "").rstrip("/")
+CLUSTER_MODE = os.environ.get("CLUSTER_MODE", "forward")
+CLUSTER_VNODES = int(os.environ.get("CLUSTER_VNODES", 160))
+CLUSTER_HEALTH_INTERVAL = float(os.environ.get("CLUSTER_HEALTH_INTERVAL", 5))
+CLUSTER_FORWARD_TIMEOUT = float(os.environ.get("CLUSTER_FORWARD_TIMEOUT", 600))
+CLUSTER_SECRET = os.environ.get("CLUSTER_SECRET", "")
+
+FORWARDED_HEADER = "x-cluster-forwarded"
+ROUTED_PARAM = "cluster_routed"
+# Per-connection headers that are not passed through a forward
+HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+               "transfer-encoding", "upgrade", "host", "content-length"}
+# Set again by this node's server on a forwarded response
+SERVER_HEADERS = {"date", "server"}
+FORWARD_CHUNK = 64 * 1024
+HEALTH_TIMEOUT = 2
+
+def ring_hash(key):
+    """Position of ``key`` on the ring (64 bits)"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+def parse_nodes(spec):
+    """Node URLs from a comma-separated list, or from a file when ``spec`` is @path"""
+    if spec.startswith("@"):
+        try:
+            with open(spec[1:]) as f:
+                spec = f.read()
+        except OSError as e:
+            print(f"Cluster membership file unreadable: {e}")
+            return []
+    nodes = []
+    for node in spec.replace(",", "\n").splitlines():
+        node = node.strip().rstrip("/")
+        if node and not node.startswith("#") and node not in nodes:
+            nodes.append(node)
+    return nodes
+
+class HashRing:
+    """Consistent-hash ring with ``vnodes`` points per node"""
+
+    def __init__(self, nodes=(), vnodes=CLUSTER_VNODES):
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+        self.nodes = sorted(set(nodes))
+
+    def owner(self, key):
+        """The node owning ``key``: the first point clockwise from its hash"""
+        if not self._nodes:
+            return None
+        return self._nodes[bisect.bisect(self._hashes, ring_hash(key)) % len(self._nodes)]
+
+    def shares(self):
+        """Fraction of the hash space owned by each node"""
+        shares = dict.fromkeys(self.nodes, 0.0)
+        for i, node in enumerate(self._nodes):
+            # A point owns the arc from the previous point up to itself
+            previous = self._hashes[i - 1] if i else self._hashes[-1] - 2 ** 64
+            shares[node] += (self._hashes[i] - previous) / 2 ** 64
+        return shares
+
+class ClusterRouter:
+    """Membership, peer health and routing of video IDs to their owner node"""
+
+    def __init__(self, nodes=CLUSTER_NODES, self_url=CLUSTER_SELF, mode=CLUSTER_MODE,
+                 vnodes=CLUSTER_VNODES, interval=CLUSTER_HEALTH_INTERVAL, secret=CLUSTER_SECRET):
+        self.spec = nodes
+        self.self_url = self_url
+        self.mode = mode
+        self.vnodes = vnodes
+        self.interval = interval
+        self.secret = secret
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.members = parse_nodes(nodes) if nodes else []
+        self.enabled = bool(self.members)
+        if self.enabled and self_url not in self.members:
+            print(f"Cluster mode off: CLUSTER_SELF {self_url or '(unset)'} is not in CLUSTER_NODES")
+            self.enabled = False
+        if self.enabled and mode not in ("forward", "redirect"):
+            raise ValueError(f"Unknown CLUSTER_MODE: {mode} (expected forward or redirect)")
+        if self.enabled and not secret:
+            raise ValueError("CLUSTER_SECRET must be set in cluster mode")
+        # Peers are assumed up until a health check says otherwise
+        self._down = {}
+        self.ring = HashRing(self.members, vnodes)
+
+        self.local = 0
+        self.forwarded = 0
+        self.redirected = 0
+        self.failovers = 0
+
+    # ---- routing ----
+    def owner(self, video_id):
+        """Owner node of ``video_id``, or None when this node serves it (or cluster mode is off)"""
+        if not self.enabled:
+            return None
+        owner = self.ring.owner(video_id)
+        return None if owner in (None, self.self_url) else owner
+
+    def is_routed(self, request):
+        """True for requests another node already routed here"""
+        return self.is_forwarded(request) or ROUTED_PARAM in request.query_params
+
+    def is_forwarded(self, request):
+        """True for requests forwarded by a member (already rate limited there)"""
+        if not (self.enabled and self.secret):
+            return False
+        value = request.headers.get(FORWARDED_HEADER)
+        return value is not None and hmac.compare_digest(value.encode(), self.secret.encode())
+
+    async def route(self, request, video_id):
+        """Response from (or redirect to) the owner of ``video_id``; None to serve the request here"""
+        owner = None if self.is_routed(request) else self.owner(video_id)
+        if owner is None:
+            self.local += 1
+            return None
+        if self.mode == "redirect":
+            self.redirected += 1
+            return RedirectResponse(self.location(owner, request), status_code=307,
+                                    headers={"X-Cluster-Owner": owner})
+        try:
+            response = await self.forward(owner, request)
+        except OSError as e:
+            # Owner unreachable: take it off the ring until the health check sees it again
+            print(f"Forward to {owner} failed, serving {video_id} locally: {e}")
+            self.mark_down(owner)
+            self.failovers += 1
+            return None
+        self.forwarded += 1
+        return response
+
+    def location(self, owner, request):
+        """The request's URL on ``owner``, marked as routed"""
+        query = [*request.query_params.multi_items(), (ROUTED_PARAM, "1")]
+        return f"{owner}{request.url.path}?{urlencode(query)}"
+
+    async def forward(self, owner, request):
+        """Proxy ``request`` to ``owner``; the response body is streamed back as it arrives"""
+        body = await request.body()
+        headers = {name: value for name, value in request.headers.items() if name not in HOP_HEADERS}
+        headers[FORWARDED_HEADER] = self.secret
+        if request.client:
+            previous = request.headers.get("x-forwarded-for")
+            headers["x-forwarded-for"] = f"{previous}, {request.client.host}" if previous else request.client.host
+        path = request.url.path + (f"?{request.url.query}" if request.url.query else "")
+
+        # Connecting and waiting for the response headers happen off the event loop
+        conn, upstream = await asyncio.get_running_loop().run_in_executor(
+            None, open_upstream, owner, request.method, path, headers, body
+        )
+
+        def relay():
+            while True:
+                chunk = upstream.read1(FORWARD_CHUNK)
+                if not chunk:
+                    return
+                yield chunk
+
+        response_headers = {name: value for name, value in upstream.getheaders()
+                            if name.lower() not in HOP_HEADERS | SERVER_HEADERS}
+        response_headers["X-Cluster-Owner"] = owner
+        if upstream.getheader("content-length"):
+            response_headers["content-length"] = upstream.getheader("content-length")
+        return StreamingResponse(relay(), status_code=upstream.status, headers=response_headers,
+                                 background=BackgroundTask(conn.close))
+
+    def send(self, owner, method, path, payload):
+        """Blocking JSON request to ``owner``, marked as forwarded; returns the connection and its response
+
+        For work this node splits up itself (the items of a batch). A node that
+        cannot be reached is marked down and ``OSError`` raised, so the caller
+        can serve the item locally.
+        """
+        headers = {"content-type": "application/json", FORWARDED_HEADER: self.secret}
+        try:
+            connection = open_upstream(owner, method, path, headers, json.dumps(payload).encode())
+        except OSError as e:
+            print(f"Request to {owner} failed: {e}")
+            self.mark_down(owner)
+            self.failovers += 1
+            raise
+        self.forwarded += 1
+        return connection
+
+    # ---- membership ----
+    def start(self):
+        """Start checking peer health in the background"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._monitor, name="cluster-health", daemon=True)
+        self._thread.start()
+        print(f"Cluster mode ({self.mode}): {self.self_url} of {len(self.members)} nodes")
+
+    def stop(self):
+        self._stopping.set()
+
+    def mark_down(self, node):
+        with self._lock:
+            if node in self._down:
+                return
+            self._down[node] = time.time()
+            self._rebuild()
+        print(f"Cluster node down: {node}")
+
+    def mark_up(self, node):
+        with self._lock:
+            if self._down.pop(node, None) is None:
+                return
+            self._rebuild()
+        print(f"Cluster node up: {node}")
+
+    def check(self):
+        """Reload the membership list if it is a file, then probe every peer once"""
+        if self.spec.startswith("@"):
+            members = parse_nodes(self.spec)
+            if members and self.self_url in members and members != self.members:
+                with self._lock:
+                    print(f"Cluster membership changed: {self.members} -> {members}")
+                    self.members = members
+                    self._down = {node: since for node, since in self._down.items() if node in members}
+                    self._rebuild()
+        for node in list(self.members):
+            if node == self.self_url:
+                continue
+            if node_healthy(node):
+                self.mark_up(node)
+            else:
+                self.mark_down(node)
+
+    def stats(self):
+        with self._lock:
+            down = dict(self._down)
+            shares = self.ring.shares()
+        return {
+            "enabled": self.enabled,
+            "self": self.self_url or None,
+            "mode": self.mode,
+            "nodes": {
+                node: {"up": node not in down, "down_since": down.get(node), "share": round(shares.get(node, 0), 4)}
+                for node in self.members
+            },
+            "members": len(self.members),
+            "live": len(self.members) - len(down),
+            "local": self.local,
+            "forwarded": self.forwarded,
+            "redirected": self.redirected,
+            "failovers": self.failovers,
+        }
+
+    # ---- internals ----
+    def _rebuild(self):
+        """New ring from the live members (caller holds the lock)"""
+        self.ring = HashRing([node for node in self.members if node not in self._down], self.vnodes)
+
+    def _monitor(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Cluster health check failed: {e}")
+
+def open_upstream(node, method, path, headers, body):
+    """Send a request to ``node`` and return the connection and its response (headers read)"""
+    parsed = urlsplit(node)
+    connection = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+    conn = connection(parsed.netloc, timeout=CLUSTER_FORWARD_TIMEOUT)
+    try:
+        conn.request(method, parsed.path.rstrip("/") + path, body=body or None, headers=headers)
+        return conn, conn.getresponse()
+    except Exception:
+        conn.close()
+        raise
+
+def node_healthy(node):
+    try:
+        with urllib.request.urlopen(f"{node}/health", timeout=HEALTH_TIMEOUT) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+cluster = ClusterRouter()
+
+if __name__ == "__main__":
+    # Spread and rebalancing on a synthetic key set: python cluster.py
+    keys = [f"video-{i:05d}" for i in range(20000)]
+    nodes = [f"http://10.0.0.{i}:8000" for i in range(1, 5)]
+    ring = HashRing(nodes)
+    before = {key: ring.owner(key) for key in keys}
+    print(f"{len(nodes)} nodes, {CLUSTER_VNODES} points each:")
+    for node, share in ring.shares().items():
+        print(f"  {node}  ring {share:6.1%}  keys {sum(o == node for o in before.values()) / len(keys):6.1%}")
+
+    joined = HashRing(nodes + ["http://10.0.0.5:8000"])
+    moved = [key for key in keys if joined.owner(key) != before[key]]
+    assert all(joined.owner(key) == "http://10.0.0.5:8000" for key in moved)
+    print(f"node 5 joins: {len(moved) / len(keys):.1%} of keys move, all to the new node (ideal 20.0%)")
+
+    left = HashRing(nodes[1:])
+    moved = [key for key in keys if left.owner(key) != before[key]]
+    assert all(before[key] == nodes[0] for key in moved)
+    print(f"node 1 leaves: {len(moved) / len(keys):.1%} of keys move, only its own (ideal 25.0%)")
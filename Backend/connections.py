@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Adaptive connection count for segmented downloads (AIMD on measured goodput).
+
+The best count found per CDN host is kept in a shared JSON file for the next transfer.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+ADAPTIVE_CONNECTIONS = os.environ.get("ADAPTIVE_CONNECTIONS", "1") == "1"
+MAX_CONNECTIONS = int(os.environ.get("MAX_CONNECTIONS", 16))
+CONNECTION_STATS_FILE = Path(
+    os.environ.get("CONNECTION_STATS_FILE", Path(tempfile.gettempdir()) / "yt_audio_connections.json")
+)
+# Learned settings older than this are ignored
+HOST_MEMORY_TTL = float(os.environ.get("HOST_MEMORY_TTL", 7 * 24 * 3600))
+
+# Seconds of transfer per measurement window
+CONTROL_INTERVAL = 1.0
+# Relative goodput gain needed to keep adding connections
+GAIN_THRESHOLD = 0.05
+# Windows to stay at the best count before probing upwards again
+HOLD_WINDOWS = 5
+
+def host_key(url):
+    """CDN host a learned setting applies to: the registrable part of the hostname.
+
+    YouTube media comes from many ``rrN---sn-xxxx.googlevideo.com`` edges that
+    share one throttling policy, so they share one entry.
+    """
+    host = (urlparse(url).hostname or "").lower()
+    labels = host.split(".")
+    if len(labels) <= 2 or host.replace(".", "").isdigit():
+        return host
+    return ".".join(labels[-2:])
+
+class AIMDController:
+    """Goodput-driven connection count for one transfer"""
+
+    def __init__(self, initial, minimum=1, maximum=MAX_CONNECTIONS, interval=CONTROL_INTERVAL):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = interval
+        self.target = max(minimum, min(initial, maximum))
+        self.best_connections = None
+        self.best_throughput = 0.0
+        self.history = []
+
+        self._window_start = None
+        self._window_bytes = 0
+        self._window_errors = 0
+        self._warmup = True
+        self._hold = 0
+        self._slow_start = True
+
+    def update(self, now, downloaded, errors=0):
+        """Feed the transfer's byte and error counters; returns the connection count to use"""
+        if self._window_start is None:
+            self._window_start, self._window_bytes, self._window_errors = now, downloaded, errors
+            return self.target
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return self.target
+
+        throughput = (downloaded - self._window_bytes) / elapsed
+        new_errors = errors - self._window_errors
+        self._window_start, self._window_bytes, self._window_errors = now, downloaded, errors
+        if self._warmup:
+            # The window right after a change mixes old and new counts
+            self._warmup = False
+            return self.target
+        self.history.append((self.target, throughput))
+
+        previous = self.target
+        if new_errors:
+            self.target = max(self.minimum, self.target // 2)
+            self._hold = HOLD_WINDOWS
+            self._slow_start = False
+        elif self.best_connections is None or throughput > self.best_throughput * (1 + GAIN_THRESHOLD):
+            self.best_connections, self.best_throughput = self.target, throughput
+            step = self.target if self._slow_start else 1
+            self.target = min(self.target + step, self.maximum)
+        elif self.target != self.best_connections:
+            # The last step did not pay off
+            self.target = self.best_connections
+            self._hold = HOLD_WINDOWS
+            self._slow_start = False
+        else:
+            # Holding at the best count; keep its goodput current, then probe again
+            self.best_throughput = throughput
+            self._hold -= 1
+            if self._hold <= 0 and self.target < self.maximum:
+                self.target += 1
+
+        if self.target != previous:
+            self._warmup = True
+        return self.target
+
+class HostSettings:
+    """Best connection count learned per CDN host, shared through a JSON file"""
+
+    def __init__(self, path=CONNECTION_STATS_FILE, ttl=HOST_MEMORY_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, url):
+        """Learned connection count for the host serving ``url``, or None"""
+        with self._lock:
+            entry = self._load().get(host_key(url))
+        if not entry or time.time() - entry.get("updated_at", 0) > self.ttl:
+            return None
+        return entry.get("connections")
+
+    def record(self, url, connections, throughput):
+        """Remember the best count found for a host"""
+        with self._lock:
+            data = self._load()
+            data[host_key(url)] = {
+                "connections": connections,
+                "throughput": throughput,
+                "updated_at": time.time(),
+            }
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=".connections-")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Could not write connection stats: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            return self._load()
+
+host_settings = HostSettings()
@@ -1,16 +1,45 @@
 #!/usr/bin/env python3
 
+import hashlib
+import os
+import re
 import shutil
-import subprocess
+import time
 from pathlib import Path
-from yt_dlp import YoutubeDL
-import speedtest
+from urllib.parse import urlparse, parse_qs
+from bandwidth import get_estimator
+from executors import run_transcode
+from pipeline import TranscodeError, is_streamable, transcode_stream
+from formats import (PRESETS, TARGETS, FormatNegotiator, audio_candidates, encoder_args, ffmpeg_args,
+                     plan_conversion, record_conversion, summarize)
+from metadata import PROBE_OPTS, MetadataCache, estimated_size
+from ydl_pool import ydl_pool
+from partials import partial_index
+from metrics import make_byte_counter, record_transcode, span, trace
+from parallel_mp3 import ParallelEncodeError, encode_parallel, worth_splitting
+from presets import preset_profiler
 
 # -------------------------
 # GLOBAL CONSTANTS
 # -------------------------
 DOWNLOADS_DIR = Path("downloads")
 
+# Feed downloaded bytes straight into ffmpeg when the original file is not kept
+STREAM_TRANSCODE = os.environ.get("STREAM_TRANSCODE", "1") == "1"
+
+# Load yt-dlp in the background after startup instead of on the first request
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+
+MP3_CODEC_ARGS = encoder_args("mp3")
+
+LIVE_OPTS = {
+    "format": "bestaudio/best",
+    "outtmpl": "%(title).200s.%(ext)s",
+    "noplaylist": True,
+    "quiet": True,
+    "no_warnings": True,
+}
+
 CONNECTION_THRESHOLDS = [
     (100, 16),
     (50, 8),
@@ -34,13 +63,6 @@ def human_readable_speed(mbps):
         return f"{mbps/1000:.2f} Gbps"
     return f"{mbps:.2f} Mbps"
 
-def measure_download_speed():
-    st = speedtest.Speedtest()
-    st.get_best_server()
-    st.download(threads=None)
-    dl_bps = st.results.dict().get("download", 0)
-    return dl_bps / 1_000_000.0
-
 def choose_connections(mbps):
     for threshold, conns in CONNECTION_THRESHOLDS:
         if mbps >= threshold:
@@ -50,15 +72,156 @@ def choose_connections(mbps):
 def check_tool_exists(tool_name):
     return shutil.which(tool_name) is not None
 
+YOUTUBE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+def extract_video_id(url):
+    """Return the canonical YouTube video ID for a URL, or a stable hash for other URLs"""
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+    candidate = None
+    if host.endswith("youtu.be"):
+        candidate = parsed.path.lstrip("/").split("/")[0]
+    elif host.endswith("youtube.com") or host.endswith("youtube-nocookie.com"):
+        query_id = parse_qs(parsed.query).get("v")
+        if query_id:
+            candidate = query_id[0]
+        else:
+            parts = [p for p in parsed.path.split("/") if p]
+            if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                candidate = parts[1]
+    if candidate and YOUTUBE_ID_RE.match(candidate):
+        return candidate
+    return "url-" + hashlib.sha256(url.strip().encode()).hexdigest()[:16]
+
+# Raw extraction results shared by /info and the downloads that follow it
+metadata_cache = MetadataCache(extract_video_id)
+
+def probe(url):
+    """Title, duration and audio formats of ``url``, plus the expected size per output format"""
+    info = metadata_cache.info(url)
+    if info.get("_type") not in (None, "video"):
+        raise ValueError("URL does not point to a single video")
+
+    duration = info.get("duration")
+    formats = info.get("formats") or [info]
+    audio_formats = [
+        {
+            "format_id": fmt.get("format_id"),
+            "ext": fmt.get("ext"),
+            "acodec": fmt.get("acodec"),
+            "abr": fmt.get("abr"),
+            "filesize": estimated_size(fmt, duration),
+        }
+        for fmt in audio_candidates(formats)
+    ]
+
+    # What each output format (with its default preset) and each preset would cost:
+    # served as-is, remuxed or transcoded
+    def output(target, preset=None):
+        plan = plan_conversion(formats, target, preset)
+        if plan is None:
+            return None
+        bitrate = PRESETS[plan["preset"]]["kbps"] if plan["action"] == "transcode" else None
+        return {
+            "action": plan["action"],
+            "preset": plan["preset"],
+            "source_format": plan["format"].get("format_id"),
+            "filesize": estimated_size(plan["format"], duration, bitrate),
+        }
+
+    outputs = {target: output(target) for target in TARGETS}
+    presets = {name: output(spec["target"], name) for name, spec in PRESETS.items()}
+
+    return {
+        "id": info.get("id"),
+        "title": info.get("title"),
+        "duration": duration,
+        "uploader": info.get("uploader"),
+        "thumbnail": info.get("thumbnail"),
+        "audio_formats": audio_formats,
+        "outputs": {target: value for target, value in outputs.items() if value},
+        "presets": {name: value for name, value in presets.items() if value},
+    }
+
 def safe_outtmpl(output_dir):
     # Create the output directory if it doesn't exist
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     return str(Path(output_dir) / "%(title).200s.%(ext)s")
 
+def stream_convert(ydl, info, output_path, target, progress_hooks, preset=None):
+    """Download and encode to ``target`` in one pass, without an intermediate file"""
+    spec = TARGETS[target]
+    out_path = output_path / (Path(ydl.prepare_filename(info)).stem + "." + spec["ext"])
+    if out_path.exists():
+        out_path.unlink()
+        print(f"Removed existing {target.upper()} file to prevent duplicates")
+
+    print("Streaming download into ffmpeg...")
+    with span("stream") as record:
+        transcode_stream(ydl, info, out_path, encoder_args(target, preset), progress_hooks)
+    record_transcode(info.get("duration"), record["seconds"], "stream")
+    print(f"{target.upper()} saved:", out_path)
+
+    return {
+        "title": info.get("title", "Unknown Title"),
+        "status": "success",
+        "files": [{
+            "name": out_path.name,
+            "type": target,
+            "size": human_readable_size(out_path.stat().st_size),
+            "format": spec["ext"].upper()
+        }]
+    }
+
+def warm_up():
+    """Import yt-dlp and pool a YoutubeDL for metadata extraction, so the first request pays for neither"""
+    with span("warmup"):
+        ydl_pool.release(ydl_pool.acquire(PROBE_OPTS))
+
+def resolve_live_stream(url):
+    """Extract ``url`` for live MP3 streaming.
+
+    Returns a ``(ydl, info)`` pair whose pooled YoutubeDL the caller must hand
+    back with ``ydl_pool.release``, or ``(None, info)`` when the selected format cannot be streamed.
+    """
+    if not check_tool_exists("ffmpeg"):
+        raise RuntimeError("ffmpeg not found")
+
+    ydl = ydl_pool.acquire(LIVE_OPTS)
+    try:
+        info = ydl.process_ie_result(metadata_cache.info(url), download=False)
+    except Exception as e:
+        ydl_pool.release(ydl, discard=True)
+        raise RuntimeError(f"yt-dlp failed: {e}")
+
+    if not is_streamable(info):
+        ydl_pool.release(ydl)
+        return None, info
+    return ydl, info
+
 # -----------------------------------------------------------
 # MAIN FUNCTION - Prevent duplicate downloads
 # -----------------------------------------------------------
-def download_audio_from_youtube(url, output_dir=None, convert_to_mp3=False, keep_original=True, progress_hook=None):
+def download_audio_from_youtube(url, output_dir=None, convert_to_mp3=False, keep_original=True, progress_hook=None,
+                                output_format=None, preset=None):
+    """Download (and convert) ``url``; per-stage timings are added to the result as ``timings``
+
+    ``preset`` names an entry of ``formats.PRESETS`` (default: the target's default preset) and
+    implies its target when ``output_format`` is not given.
+    """
+    with trace(f"download {extract_video_id(url)}") as job_trace:
+        results = _download_audio(url, output_dir, convert_to_mp3, keep_original, progress_hook, output_format, preset)
+    results["timings"] = job_trace.summary()["stages"]
+    return results
+
+def _download_audio(url, output_dir, convert_to_mp3, keep_original, progress_hook, output_format, preset):
+    # output_format: "mp3", "m4a", "opus" or "native"; convert_to_mp3 is shorthand for "mp3"
+    if preset and preset not in PRESETS:
+        raise ValueError(f"Unknown preset: {preset}")
+    target = output_format or (PRESETS[preset]["target"] if preset else None) or ("mp3" if convert_to_mp3 else None)
+    if target == "native":
+        target = None
+
     # Backward compatibility: if output_dir not provided, use old default
     if output_dir is None:
         output_dir = DOWNLOADS_DIR
@@ -67,25 +230,33 @@ def download_audio_from_youtube(url, output_dir=None, convert_to_mp3=False, keep
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
 
-    print("Measuring internet download speed...")
-    try:
-        mbps = measure_download_speed()
-        print(f"Speed: {human_readable_speed(mbps)}")
+    # Partials are tracked per video and format so a retry in the same directory resumes
+    video_id = extract_video_id(url)
+    negotiator = FormatNegotiator(
+        target,
+        on_select=lambda fmt: partial_index.select(output_path, video_id, fmt.get("format_id") or "default"),
+        preset=preset
+    )
+
+    # Cached estimate - never blocks; stale values are refreshed in the background
+    estimator = get_estimator()
+    mbps = estimator.current_mbps()
+    if mbps:
+        print(f"Estimated speed: {human_readable_speed(mbps)}")
         connections = choose_connections(mbps)
         print(f"Using {connections} connections")
-    except Exception:
-        mbps = 0
+    else:
         connections = 1
-        print("Speed test failed, using default connection")
+        print("No bandwidth estimate yet, using default connection")
 
+    # aria2c when installed, otherwise the built-in segmented downloader (SegmentedFD)
     use_aria2 = check_tool_exists("aria2c") and connections > 1
 
     external_downloader = "aria2c" if use_aria2 else None
     external_downloader_args = ["-x", str(connections), "-s", str(connections), "-k", "1M"] if use_aria2 else []
 
+    # Base options select the pooled instance; per-job settings are applied to the lease
     ytdlp_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": safe_outtmpl(output_dir),
         "noplaylist": True,
         "quiet": False,
         "no_warnings": True,
@@ -94,17 +265,58 @@ def download_audio_from_youtube(url, output_dir=None, convert_to_mp3=False, keep
         "skip_download": False,
         "external_downloader": external_downloader,
         "external_downloader_args": external_downloader_args,
+        "concurrent_fragment_downloads": connections,
         "writeinfojson": False,
         # Prevent duplicate downloads by overwriting existing files
         "overwrites": True,
     }
 
+    # Observed transfer speeds keep the bandwidth estimate current
+    progress_hooks = [
+        estimator.progress_hook,
+        partial_index.make_progress_hook(output_path, video_id),
+        make_byte_counter()
+    ]
     if progress_hook:
-        ytdlp_opts["progress_hooks"] = [progress_hook]
+        progress_hooks.append(progress_hook)
+
+    # A streamed transcode leaves nothing to resume, so retries of an interrupted
+    # download go through the file path
+    stream = (
+        target and not keep_original and STREAM_TRANSCODE and check_tool_exists("ffmpeg")
+        and not partial_index.pending(output_path, video_id)
+    )
 
     try:
-        with YoutubeDL(ytdlp_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
+        # Extract up front (or hit the cache) so the download span only covers the transfer
+        metadata_cache.info(url)
+        with ydl_pool.lease(
+            ytdlp_opts,
+            outtmpl=safe_outtmpl(output_dir),
+            # Picks the source that needs the cheapest conversion to the target
+            format=negotiator,
+            progress_hooks=progress_hooks
+        ) as ydl:
+            # Reuse the cached extraction (e.g. from a preceding /info call)
+            if stream:
+                info = metadata_cache.process(ydl, url, download=False)
+                # Long MP3 encodes go through a file so they can be split across cores
+                if (negotiator.plan and negotiator.plan["action"] == "transcode" and is_streamable(info)
+                        and not worth_splitting(target, info.get("duration"))):
+                    try:
+                        results = stream_convert(ydl, info, output_path, target, progress_hooks, negotiator.preset)
+                        record_conversion(negotiator.plan)
+                        results["conversion"] = summarize(negotiator.plan)
+                        partial_index.complete(output_path, video_id)
+                        return results
+                    except TranscodeError as e:
+                        # e.g. a container ffmpeg cannot read from a pipe
+                        print(f"Streaming transcode failed, falling back to file download: {e}")
+                with span("download"):
+                    info = ydl.process_ie_result(info, download=True)
+            else:
+                with span("download"):
+                    info = metadata_cache.process(ydl, url, download=True)
     except Exception as e:
         raise RuntimeError(f"yt-dlp failed: {e}")
 
@@ -151,44 +363,78 @@ def download_audio_from_youtube(url, output_dir=None, convert_to_mp3=False, keep
             "format": downloaded_file.suffix.replace('.', '').upper()
         })
 
-    # ---- MP3 conversion ----
-    if convert_to_mp3:
-        if not check_tool_exists("ffmpeg"):
-            raise RuntimeError("ffmpeg not found")
-
-        mp3_path = output_path / (downloaded_file.stem + ".mp3")
-        
-        # Remove existing MP3 file if it exists (prevent duplicates)
-        if mp3_path.exists():
-            mp3_path.unlink()
-            print("Removed existing MP3 file to prevent duplicates")
-
-        cmd = [
-            "ffmpeg", "-y",  # -y to overwrite output file
-            "-i", str(downloaded_file),
-            "-vn",
-            "-codec:a", "libmp3lame",
-            "-b:a", "320k",
-            str(mp3_path)
-        ]
-
-        print("Converting to MP3...")
-        subprocess.run(cmd, check=True, capture_output=True)
-        print("MP3 saved:", mp3_path)
-        
-        # Add MP3 file info
-        if mp3_path.exists():
-            results["files"].append({
-                "name": mp3_path.name,
-                "type": "mp3",
-                "size": human_readable_size(mp3_path.stat().st_size),
-                "format": "MP3"
-            })
-
-        if not keep_original and downloaded_file.exists():
-            downloaded_file.unlink()
-            # Remove original from results if deleted
-            results["files"] = [f for f in results["files"] if f["type"] != "original"]
-            print("Original file removed as requested")
+    # ---- Conversion ----
+    plan = negotiator.plan
+    if target and plan:
+        spec = TARGETS[target]
+        record_conversion(plan)
+        results["conversion"] = summarize(plan)
+
+        if plan["action"] == "none":
+            # The downloaded file already is what was asked for
+            print(f"Source already {target.upper()}, no conversion needed")
+            for file_info in results["files"]:
+                file_info["type"] = target
+        else:
+            if not check_tool_exists("ffmpeg"):
+                raise RuntimeError("ffmpeg not found")
+
+            out_path = output_path / (downloaded_file.stem + "." + spec["ext"])
+            if out_path == downloaded_file:
+                # Same extension but a different codec - move the source out of the way
+                downloaded_file = downloaded_file.rename(
+                    downloaded_file.with_name(downloaded_file.stem + ".source" + downloaded_file.suffix)
+                )
+                results["files"][0]["name"] = downloaded_file.name
+            
+            # Remove existing output file if it exists (prevent duplicates)
+            if out_path.exists():
+                out_path.unlink()
+                print(f"Removed existing {target.upper()} file to prevent duplicates")
+
+            cmd = [
+                "ffmpeg", "-y",  # -y to overwrite output file
+                "-i", str(downloaded_file),
+                "-vn",
+                *ffmpeg_args(plan),
+                str(out_path)
+            ]
+
+            if plan["action"] == "copy":
+                print(f"Remuxing to {target.upper()} (stream copy)...")
+                run_transcode(cmd, media_seconds=info.get("duration"))
+            else:
+                print(f"Converting to {target.upper()}...")
+                encoded = False
+                if worth_splitting(target, info.get("duration")):
+                    try:
+                        encode_parallel(downloaded_file, out_path, ffmpeg_args(plan), media_seconds=info.get("duration"))
+                        encoded = True
+                    except ParallelEncodeError as e:
+                        print(f"Parallel encode failed, encoding in one pass: {e}")
+                if not encoded:
+                    started = time.perf_counter()
+                    run_transcode(cmd, media_seconds=info.get("duration"))
+                    # Real encodes keep the preset cost estimates current
+                    preset_profiler.observe(
+                        plan["preset"], info.get("duration"), time.perf_counter() - started, out_path.stat().st_size
+                    )
+            print(f"{target.upper()} saved:", out_path)
+            
+            # Add converted file info
+            if out_path.exists():
+                results["files"].append({
+                    "name": out_path.name,
+                    "type": target,
+                    "size": human_readable_size(out_path.stat().st_size),
+                    "format": spec["ext"].upper()
+                })
+
+            if not keep_original and downloaded_file.exists():
+                downloaded_file.unlink()
+                # Remove original from results if deleted
+                results["files"] = [f for f in results["files"] if f["type"] != "original"]
+                print("Original file removed as requested")
 
+    partial_index.complete(output_path, video_id)
     return results
\ No newline at end of file
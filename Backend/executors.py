@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Bounded executors for blocking work: downloads, ffmpeg slots, live streams and ZIP batches.
+
+    DOWNLOAD_WORKERS   - concurrent yt-dlp downloads (default 4)
+    TRANSCODE_WORKERS  - concurrent ffmpeg processes (default: CPU count)
+    STREAM_WORKERS     - concurrent live streams and ZIP batches (default: 2x DOWNLOAD_WORKERS)
+"""
+
+import asyncio
+import contextlib
+import functools
+import os
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import POOL_TASKS, record_transcode, record_wait, span
+
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 4))
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", os.cpu_count() or 1))
+STREAM_WORKERS = int(os.environ.get("STREAM_WORKERS", 2 * DOWNLOAD_WORKERS))
+
+class _InstrumentedPool(ThreadPoolExecutor):
+    """Thread pool that reports queue wait and waiting/running task gauges"""
+
+    def __init__(self, name, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+
+    def submit(self, fn, /, *args, **kwargs):
+        queued = time.monotonic()
+        POOL_TASKS.inc(pool=self.name, state="waiting")
+
+        def run():
+            POOL_TASKS.dec(pool=self.name, state="waiting")
+            record_wait(self.name, time.monotonic() - queued)
+            POOL_TASKS.inc(pool=self.name, state="running")
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                POOL_TASKS.dec(pool=self.name, state="running")
+
+        return super().submit(run)
+
+_download_pool = None
+_stream_pool = None
+_pool_lock = threading.Lock()
+_transcode_slots = threading.BoundedSemaphore(TRANSCODE_WORKERS)
+
+def download_executor():
+    """Return the shared thread pool used for yt-dlp downloads"""
+    global _download_pool
+    with _pool_lock:
+        if _download_pool is None:
+            _download_pool = _InstrumentedPool(
+                "downloads",
+                max_workers=DOWNLOAD_WORKERS,
+                thread_name_prefix="download"
+            )
+        return _download_pool
+
+def stream_executor():
+    """Return the shared thread pool for responses produced while they are sent"""
+    global _stream_pool
+    with _pool_lock:
+        if _stream_pool is None:
+            _stream_pool = _InstrumentedPool(
+                "streams",
+                max_workers=STREAM_WORKERS,
+                thread_name_prefix="stream"
+            )
+        return _stream_pool
+
+async def run_download(func, *args, **kwargs):
+    """Run a blocking download function on the download pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(download_executor(), functools.partial(func, *args, **kwargs))
+
+@contextlib.contextmanager
+def transcode_slot():
+    """Hold one of the TRANSCODE_WORKERS slots, for ffmpeg processes managed by the caller"""
+    queued = time.monotonic()
+    POOL_TASKS.inc(pool="transcode", state="waiting")
+    try:
+        _transcode_slots.acquire()
+    finally:
+        POOL_TASKS.dec(pool="transcode", state="waiting")
+    record_wait("transcode", time.monotonic() - queued)
+    POOL_TASKS.inc(pool="transcode", state="running")
+    try:
+        yield
+    finally:
+        POOL_TASKS.dec(pool="transcode", state="running")
+        _transcode_slots.release()
+
+def run_transcode(cmd, media_seconds=None, **kwargs):
+    """Run an ffmpeg command once a transcode slot is free (blocking).
+
+    ``media_seconds`` (the input duration) feeds the real-time factor metric.
+    """
+    kwargs.setdefault("check", True)
+    kwargs.setdefault("capture_output", True)
+    with transcode_slot():
+        with span("transcode") as record:
+            result = subprocess.run(cmd, **kwargs)
+    record_transcode(media_seconds, record["seconds"], "file")
+    return result
+
+class StreamBuffer:
+    """Bounded hand-off of chunks from a producer thread to an async consumer.
+
+    The producer blocks while the buffer is full (backpressure) and gives up
+    once the stream is closed. The consumer awaits a future that the producer
+    resolves with ``call_soon_threadsafe``, so waiting takes no thread.
+    """
+
+    def __init__(self, maxsize):
+        self.items = queue.Queue(maxsize=maxsize)
+        self.closed = threading.Event()
+        self._lock = threading.Lock()
+        self._waiter = None
+
+    def put(self, item):
+        """Blocking put; False if the stream was closed first"""
+        while not self.closed.is_set():
+            try:
+                self.items.put(item, timeout=0.5)
+            except queue.Full:
+                continue
+            self._wake()
+            return True
+        return False
+
+    def close(self):
+        """Stop the stream: the producer's puts fail, a waiting consumer returns"""
+        self.closed.set()
+        self._wake()
+
+    def _wake(self):
+        with self._lock:
+            waiter, self._waiter = self._waiter, None
+        if waiter is not None:
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+    async def get(self, default=None):
+        """Next item, or ``default`` once the stream is closed and drained"""
+        while True:
+            try:
+                return self.items.get_nowait()
+            except queue.Empty:
+                pass
+            if self.closed.is_set():
+                return default
+            waiter = asyncio.get_running_loop().create_future()
+            with self._lock:
+                self._waiter = waiter
+            # An item (or close) may have arrived before the waiter was registered
+            if self.items.empty() and not self.closed.is_set():
+                await waiter
+
+def _resolve(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+def shutdown(wait=False):
+    """Stop accepting new downloads and streams; running ones finish in the background unless ``wait``"""
+    global _download_pool, _stream_pool
+    with _pool_lock:
+        for pool in (_download_pool, _stream_pool):
+            if pool is not None:
+                pool.shutdown(wait=wait, cancel_futures=True)
+        _download_pool = _stream_pool = None
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Format negotiation: pick the source format that needs the least work for the requested output.
+
+    none      - the source already is the target codec in the target container
+    copy      - same codec, different container: remux with ``-c:a copy``
+    transcode - no compatible source: full re-encode of the best audio
+"""
+
+import collections
+import threading
+
+# Output targets: acceptable source codecs, output extension, encoder and default preset
+TARGETS = {
+    "mp3": {"codecs": ("mp3",), "ext": "mp3", "encoder": "libmp3lame", "preset": "mp3-320"},
+    "m4a": {"codecs": ("mp4a", "aac"), "ext": "m4a", "encoder": "aac", "preset": "aac-192"},
+    "opus": {"codecs": ("opus",), "ext": "opus", "encoder": "libopus", "preset": "opus-160"},
+}
+
+# Quality tiers, best first
+QUALITIES = ("high", "standard", "mobile")
+
+# Encoder settings per target and tier. ``kbps`` is the nominal output bitrate:
+# the size estimate before a preset is measured, and (with some headroom) the
+# highest source bitrate that is still served without re-encoding.
+PRESETS = {
+    "mp3-320": {"target": "mp3", "quality": "high", "args": ["-b:a", "320k"], "kbps": 320,
+                "description": "MP3 320 kbps CBR"},
+    "mp3-v0": {"target": "mp3", "quality": "high", "args": ["-q:a", "0"], "kbps": 245,
+               "description": "MP3 VBR V0 (~245 kbps)"},
+    "mp3-v2": {"target": "mp3", "quality": "standard", "args": ["-q:a", "2"], "kbps": 190,
+               "description": "MP3 VBR V2 (~190 kbps)"},
+    "mp3-128": {"target": "mp3", "quality": "mobile", "args": ["-b:a", "128k"], "kbps": 128,
+                "description": "MP3 128 kbps CBR"},
+    "aac-192": {"target": "m4a", "quality": "high", "args": ["-b:a", "192k"], "kbps": 192,
+                "description": "AAC 192 kbps in M4A"},
+    "aac-128": {"target": "m4a", "quality": "standard", "args": ["-b:a", "128k"], "kbps": 128,
+                "description": "AAC 128 kbps in M4A"},
+    "aac-96": {"target": "m4a", "quality": "mobile", "args": ["-b:a", "96k"], "kbps": 96,
+               "description": "AAC 96 kbps in M4A"},
+    "opus-160": {"target": "opus", "quality": "high", "args": ["-b:a", "160k"], "kbps": 160,
+                 "description": "Opus 160 kbps"},
+    "opus-96": {"target": "opus", "quality": "standard", "args": ["-b:a", "96k"], "kbps": 96,
+                "description": "Opus 96 kbps"},
+    "opus-64": {"target": "opus", "quality": "mobile", "args": ["-b:a", "64k"], "kbps": 64,
+                "description": "Opus 64 kbps"},
+}
+# Sources up to this factor above a preset's bitrate are served without re-encoding
+SOURCE_HEADROOM = 1.25
+
+CONVERSION_COUNTS = collections.Counter()
+_counts_lock = threading.Lock()
+
+# Containers that pin down the codec, for extractors that do not report acodec
+EXT_CODECS = {"mp3": "mp3", "m4a": "mp4a", "aac": "aac", "opus": "opus"}
+
+def codec_family(acodec, ext=None):
+    """Normalize a yt-dlp acodec string ("mp4a.40.2", "opus", ...) to its family"""
+    if not acodec:
+        return EXT_CODECS.get(ext)
+    if acodec == "none":
+        return None
+    return acodec.split(".")[0].lower()
+
+def audio_quality(fmt):
+    """Sort key for "best" audio: bitrate first, then size"""
+    return (fmt.get("abr") or fmt.get("tbr") or 0, fmt.get("filesize") or fmt.get("filesize_approx") or 0)
+
+def audio_candidates(formats):
+    """Audio-only formats if there are any, otherwise anything that carries audio"""
+    audio_only = [
+        f for f in formats
+        if f.get("acodec") != "none" and f.get("vcodec") in (None, "none")
+    ]
+    if audio_only:
+        return audio_only
+    with_audio = [f for f in formats if f.get("acodec") != "none"]
+    return with_audio or list(formats)
+
+def resolve_preset(target, preset=None):
+    """The preset to encode ``target`` with (the target's default if ``preset`` is None)"""
+    preset = preset or TARGETS[target]["preset"]
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown preset: {preset}")
+    if PRESETS[preset]["target"] != target:
+        raise ValueError(f"Preset {preset} produces {PRESETS[preset]['target']}, not {target}")
+    return preset
+
+def plan_conversion(formats, target, preset=None):
+    """Choose a source format and conversion path for ``target`` (None = keep native)"""
+    candidates = audio_candidates(formats)
+    if not candidates:
+        return None
+    best = max(candidates, key=audio_quality)
+
+    if target is None:
+        return {"format": best, "action": "none", "target": None, "preset": None}
+
+    spec = TARGETS[target]
+    preset = resolve_preset(target, preset)
+    # A compatible source is kept as-is only if it is not much larger than the preset's output
+    max_kbps = PRESETS[preset]["kbps"] * SOURCE_HEADROOM
+    compatible = [
+        f for f in candidates
+        if codec_family(f.get("acodec"), f.get("ext")) in spec["codecs"] and (f.get("abr") or 0) <= max_kbps
+    ]
+    if compatible:
+        source = max(compatible, key=audio_quality)
+        action = "none" if source.get("ext") == spec["ext"] else "copy"
+        return {"format": source, "action": action, "target": target, "preset": preset}
+
+    return {"format": best, "action": "transcode", "target": target, "preset": preset}
+
+def encoder_args(target, preset=None):
+    """ffmpeg arguments for a full encode to ``target`` with ``preset`` (default: the target's)"""
+    preset = resolve_preset(target, preset)
+    return ["-codec:a", TARGETS[target]["encoder"], *PRESETS[preset]["args"]]
+
+def ffmpeg_args(plan):
+    """Codec arguments for the conversion step of a plan"""
+    if plan["action"] == "copy":
+        return ["-codec:a", "copy"]
+    return encoder_args(plan["target"], plan.get("preset"))
+
+def record_conversion(plan):
+    with _counts_lock:
+        CONVERSION_COUNTS[plan["action"]] += 1
+
+def summarize(plan):
+    """JSON-friendly description of the path taken, for results and metrics"""
+    fmt = plan["format"]
+    return {
+        "action": plan["action"],
+        "target": plan["target"],
+        "preset": plan.get("preset") if plan["action"] == "transcode" else None,
+        "source_format": fmt.get("format_id"),
+        "source_codec": fmt.get("acodec"),
+        "source_ext": fmt.get("ext"),
+    }
+
+class FormatNegotiator:
+    """Callable yt-dlp format selector that remembers the plan it chose"""
+
+    def __init__(self, target=None, on_select=None, preset=None):
+        if target is not None and target not in TARGETS:
+            raise ValueError(f"Unsupported output format: {target}")
+        self.target = target
+        self.preset = resolve_preset(target, preset) if target else None
+        # Called with the chosen format before yt-dlp starts downloading it
+        self.on_select = on_select
+        self.plan = None
+
+    def __call__(self, ctx):
+        plan = plan_conversion(ctx.get("formats") or [], self.target, self.preset)
+        if plan is None:
+            return
+        self.plan = plan
+        if self.on_select:
+            self.on_select(plan["format"])
+        yield plan["format"]
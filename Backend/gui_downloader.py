@@ -1,16 +1,46 @@
+"""Tk desktop client: a queue of downloads run by a few worker threads.
+
+    GUI_WORKERS - downloads running at the same time (default 3)
+    GUI_FPS     - UI refreshes per second (default 20)
+"""
+
+import collections
+import itertools
+import queue
+import re
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from downloader_core import download_audio_from_youtube
+from downloader_core import download_audio_from_youtube, human_readable_size
+from formats import PRESETS, TARGETS
 import os
 from tkinter import font as tkfont
 
+GUI_WORKERS = int(os.environ.get("GUI_WORKERS", 3))
+GUI_FPS = int(os.environ.get("GUI_FPS", 20))
+# Upper bound of the "Parallel downloads" control
+MAX_GUI_WORKERS = 8
+# Events handled per frame, so a flood of log lines cannot stall a frame
+MAX_EVENTS_PER_FRAME = 500
+# Several URLs may be pasted at once, separated by whitespace or commas
+URL_SEPARATORS = re.compile(r"[\s,]+")
+LOG_COLORS = {
+    "info": "black",
+    "success": "green",
+    "warning": "orange",
+    "error": "red",
+    "progress": "blue"
+}
+
 class YouTubeAudioDownloaderGUI:
+    ORIGINAL_AUDIO = "Original audio (no conversion)"
+    # Queue row states
+    QUEUED, RUNNING, DONE, FAILED = "Queued", "Downloading", "Done", "Failed"
 
     def __init__(self, root):
         self.root = root
         self.root.title("YouTube Audio Downloader Pro")
-        self.root.geometry("700x600")
+        self.root.geometry("760x720")
         self.root.configure(bg='#f0f0f0')
         self.root.resizable(True, True)
         
@@ -26,11 +56,22 @@ class YouTubeAudioDownloaderGUI:
         self.warning_color = "#ffc107"
         self.danger_color = "#dc3545"
         
-        # Remove the default download directory - user will choose each time
-        self.is_downloading = False
-        self.current_progress = 0
+        # Download queue: item id -> item, plus the ids still waiting for a worker
+        self.items = {}
+        self.pending = collections.deque()
+        self.running = 0
+        self.item_ids = itertools.count(1)
+        self.last_download_path = None
+
+        # Worker threads -> UI thread. Discrete events (done, error, log) are queued
+        # in order; progress only keeps the newest tick per item.
+        self.events = queue.Queue()
+        self.latest_progress = {}
+        self.progress_lock = threading.Lock()
+        self.frame_ms = max(1, 1000 // max(1, GUI_FPS))
 
         self.setup_ui()
+        self.root.after(self.frame_ms, self.process_events)
 
     def setup_ui(self):
         # Main container with padding
@@ -65,7 +106,8 @@ class YouTubeAudioDownloaderGUI:
         url_frame = ttk.Frame(input_frame)
         url_frame.pack(fill=tk.X, pady=(0, 10))
         
-        ttk.Label(url_frame, text="YouTube URL:", font=self.label_font).pack(anchor=tk.W)
+        ttk.Label(url_frame, text="YouTube URL(s) - separate several with spaces or commas:",
+                  font=self.label_font).pack(anchor=tk.W)
         
         self.url_var = tk.StringVar()
         self.url_entry = ttk.Entry(
@@ -75,7 +117,7 @@ class YouTubeAudioDownloaderGUI:
             font=self.label_font
         )
         self.url_entry.pack(fill=tk.X, pady=(5, 0))
-        self.url_entry.bind('<Return>', lambda e: self.start_download())
+        self.url_entry.bind('<Return>', lambda e: self.add_to_queue())
 
         # Options Frame
         options_frame = ttk.Frame(input_frame)
@@ -85,13 +127,19 @@ class YouTubeAudioDownloaderGUI:
         left_options = ttk.Frame(options_frame)
         left_options.pack(side=tk.LEFT, fill=tk.X, expand=True)
         
-        self.mp3_var = tk.BooleanVar(value=True)
-        mp3_check = ttk.Checkbutton(
-            left_options, 
-            text="Convert to MP3 (320kbps High Quality)", 
-            variable=self.mp3_var
+        # Output preset by description; "original" skips conversion
+        self.preset_choices = {spec["description"]: name for name, spec in PRESETS.items()}
+        self.preset_choices[self.ORIGINAL_AUDIO] = None
+        ttk.Label(left_options, text="Output format:", font=self.label_font).pack(anchor=tk.W)
+        self.preset_var = tk.StringVar(value=PRESETS[TARGETS["mp3"]["preset"]]["description"])
+        preset_combo = ttk.Combobox(
+            left_options,
+            textvariable=self.preset_var,
+            values=list(self.preset_choices),
+            state="readonly",
+            width=32
         )
-        mp3_check.pack(anchor=tk.W)
+        preset_combo.pack(anchor=tk.W, pady=(5, 0))
         
         # Right options
         right_options = ttk.Frame(options_frame)
@@ -105,11 +153,50 @@ class YouTubeAudioDownloaderGUI:
         )
         keep_original_check.pack(anchor=tk.W)
 
-        # Progress Section
-        progress_frame = ttk.LabelFrame(main_frame, text="Download Progress", padding="15")
-        progress_frame.pack(fill=tk.X, pady=(0, 15))
+        workers_frame = ttk.Frame(right_options)
+        workers_frame.pack(anchor=tk.W, pady=(5, 0))
+        ttk.Label(workers_frame, text="Parallel downloads:", font=self.label_font).pack(side=tk.LEFT)
+        self.workers_var = tk.IntVar(value=min(max(GUI_WORKERS, 1), MAX_GUI_WORKERS))
+        workers_spin = ttk.Spinbox(
+            workers_frame,
+            from_=1,
+            to=MAX_GUI_WORKERS,
+            textvariable=self.workers_var,
+            width=4,
+            state="readonly",
+            command=self.dispatch
+        )
+        workers_spin.pack(side=tk.LEFT, padx=(5, 0))
 
-        # Progress bar
+        # Queue Section
+        progress_frame = ttk.LabelFrame(main_frame, text="Download Queue", padding="15")
+        progress_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 15))
+
+        # One row per item
+        queue_frame = ttk.Frame(progress_frame)
+        queue_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 10))
+
+        queue_scrollbar = ttk.Scrollbar(queue_frame)
+        queue_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.queue_view = ttk.Treeview(
+            queue_frame,
+            columns=("status", "progress", "detail"),
+            height=6,
+            yscrollcommand=queue_scrollbar.set
+        )
+        self.queue_view.heading("#0", text="Video", anchor=tk.W)
+        self.queue_view.heading("status", text="Status", anchor=tk.W)
+        self.queue_view.heading("progress", text="Progress", anchor=tk.W)
+        self.queue_view.heading("detail", text="Speed / Size", anchor=tk.W)
+        self.queue_view.column("#0", width=320, stretch=True)
+        self.queue_view.column("status", width=100, stretch=False)
+        self.queue_view.column("progress", width=80, stretch=False)
+        self.queue_view.column("detail", width=150, stretch=False)
+        self.queue_view.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        queue_scrollbar.config(command=self.queue_view.yview)
+
+        # Overall progress bar
         self.progress_var = tk.DoubleVar()
         self.progress_bar = ttk.Progressbar(
             progress_frame, 
@@ -119,7 +206,7 @@ class YouTubeAudioDownloaderGUI:
         self.progress_bar.pack(fill=tk.X, pady=(0, 10))
 
         # Progress labels
-        self.progress_text = tk.StringVar(value="Ready to download")
+        self.progress_text = tk.StringVar(value="Queue is empty")
         progress_label = ttk.Label(
             progress_frame, 
             textvariable=self.progress_text,
@@ -130,8 +217,8 @@ class YouTubeAudioDownloaderGUI:
         # Download Button
         self.download_btn = ttk.Button(
             main_frame,
-            text="🚀 Download Audio",
-            command=self.start_download
+            text="🚀 Add to Queue",
+            command=self.add_to_queue
         )
         self.download_btn.pack(fill=tk.X, pady=(0, 15))
 
@@ -149,7 +236,7 @@ class YouTubeAudioDownloaderGUI:
 
         self.log_box = tk.Text(
             log_frame,
-            height=12,
+            height=8,
             wrap=tk.WORD,
             yscrollcommand=scrollbar.set,
             font=("Consolas", 9),
@@ -160,6 +247,8 @@ class YouTubeAudioDownloaderGUI:
         )
         self.log_box.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.config(command=self.log_box.yview)
+        for msg_type, color in LOG_COLORS.items():
+            self.log_box.tag_configure(msg_type, foreground=color)
 
         # Action buttons frame
         action_frame = ttk.Frame(results_frame)
@@ -173,6 +262,13 @@ class YouTubeAudioDownloaderGUI:
         )
         self.open_file_btn.pack(side=tk.LEFT, padx=(0, 10))
 
+        self.clear_finished_btn = ttk.Button(
+            action_frame,
+            text="🧹 Clear Finished",
+            command=self.clear_finished
+        )
+        self.clear_finished_btn.pack(side=tk.LEFT, padx=(0, 10))
+
         self.clear_log_btn = ttk.Button(
             action_frame,
             text="🗑️ Clear Log",
@@ -213,7 +309,7 @@ class YouTubeAudioDownloaderGUI:
         return download_dir
 
     def open_download_location(self):
-        if hasattr(self, 'last_download_path') and self.last_download_path:
+        if self.last_download_path:
             folder_path = os.path.dirname(self.last_download_path)
             if os.path.exists(folder_path):
                 os.startfile(folder_path)
@@ -227,28 +323,9 @@ class YouTubeAudioDownloaderGUI:
         self.write_log("Log cleared. Ready for new download.", "info")
 
     def write_log(self, msg, msg_type="info"):
-        """Write message to log with colored formatting"""
-        colors = {
-            "info": "black",
-            "success": "green",
-            "warning": "orange",
-            "error": "red",
-            "progress": "blue"
-        }
-        
-        color = colors.get(msg_type, "black")
-        
+        """Write message to log with colored formatting (UI thread only; redrawn on the next frame)"""
         self.log_box.insert(tk.END, msg + "\n", msg_type)
-        self.log_box.tag_configure(msg_type, foreground=color)
         self.log_box.see(tk.END)
-        self.root.update_idletasks()
-
-    def update_progress(self, percent, status_text):
-        """Update progress bar and status text"""
-        self.progress_var.set(percent)
-        self.progress_text.set(status_text)
-        self.status_var.set(f"Downloading... {percent}%")
-        self.root.update_idletasks()
 
     def display_results(self, result, download_dir):
         """Display download results in user-friendly format"""
@@ -264,14 +341,14 @@ class YouTubeAudioDownloaderGUI:
             # Show file information
             files = result.get("files", [])
             for file_info in files:
-                emoji = "🎵" if file_info['type'] == 'mp3' else "📄"
+                emoji = "🎵" if file_info['type'] != 'original' else "📄"
                 self.write_log(f"{emoji} {file_info['type'].upper()}: {file_info['name']}", "success")
                 self.write_log(f"   📏 Size: {file_info['size']}", "info")
                 self.write_log(f"   🏷️  Format: {file_info['format']}", "info")
                 self.write_log("", "info")
                 
                 # Store the last downloaded file path
-                if file_info['type'] in ['mp3', 'original']:
+                if file_info['type'] in [*TARGETS, 'original']:
                     self.last_download_path = os.path.join(download_dir, file_info['name'])
             
             # Enable the open file button
@@ -280,118 +357,182 @@ class YouTubeAudioDownloaderGUI:
         else:
             self.write_log("❌ Download failed", "error")
 
-    def start_download(self):
-        # Prevent multiple simultaneous downloads
-        if self.is_downloading:
-            messagebox.showwarning("Warning", "A download is already in progress.")
-            return
-            
-        url = self.url_var.get().strip()
+    # ---- queue ----
+    def add_to_queue(self):
+        urls = [url for url in URL_SEPARATORS.split(self.url_var.get().strip()) if url]
 
-        if not url:
+        if not urls:
             messagebox.showerror("Error", "Please enter a YouTube URL.")
             self.url_entry.focus()
             return
 
         # Validate URL format
-        if "youtube.com" not in url and "youtu.be" not in url:
-            if messagebox.askyesno("Confirm", "This doesn't look like a YouTube URL. Continue anyway?"):
-                pass
-            else:
+        suspicious = [url for url in urls if "youtube.com" not in url and "youtu.be" not in url]
+        if suspicious:
+            if not messagebox.askyesno(
+                "Confirm",
+                f"{len(suspicious)} of these don't look like YouTube URLs. Continue anyway?"
+            ):
                 return
 
-        # Ask user where to save the file
+        # Ask once where this batch goes
         download_dir = self.choose_download_location()
         if not download_dir:
             # User cancelled the folder selection
             self.write_log("❌ Download cancelled - no location selected", "warning")
             return
 
-        # Set downloading state
-        self.is_downloading = True
-        
-        # Reset UI state
-        self.download_btn.config(state=tk.DISABLED, text="⏳ Downloading...")
-        self.open_file_btn.config(state=tk.DISABLED)
-        self.progress_var.set(0)
-        self.progress_text.set("Starting download...")
-        self.status_var.set("Downloading...")
-        self.last_download_path = None
-        
-        self.write_log("\n🔄 Starting download process...", "progress")
+        # Settings are read here, on the UI thread; workers only see the item
+        preset = self.preset_choices.get(self.preset_var.get())
+        keep_original = self.keep_original_var.get()
+        for url in urls:
+            item_id = str(next(self.item_ids))
+            self.items[item_id] = {
+                "url": url,
+                "dir": download_dir,
+                "preset": preset,
+                "keep_original": keep_original,
+                "status": self.QUEUED,
+                "percent": 0.0,
+            }
+            self.queue_view.insert("", tk.END, iid=item_id, text=url, values=(self.QUEUED, "0%", ""))
+            self.pending.append(item_id)
+
+        self.url_var.set("")
+        self.write_log(f"\n➕ Queued {len(urls)} download(s)", "progress")
         self.write_log(f"📁 Download location: {download_dir}", "info")
-        self.write_log(f"🔧 MP3 Conversion: {'Yes' if self.mp3_var.get() else 'No'}", "info")
-        self.write_log(f"💾 Keep Original: {'Yes' if self.keep_original_var.get() else 'No'}", "info")
-
-        # Start download in separate thread
-        t = threading.Thread(
-            target=self.download_thread,
-            args=(url, download_dir),
-            daemon=True
-        )
-        t.start()
+        self.write_log(f"🔧 Output: {self.preset_var.get()}", "info")
+        self.write_log(f"💾 Keep Original: {'Yes' if keep_original else 'No'}", "info")
+
+        self.dispatch()
+        self.update_overview()
+
+    def dispatch(self):
+        """Start queued items while fewer than the chosen number of workers are running"""
+        while self.pending and self.running < self.workers_var.get():
+            item_id = self.pending.popleft()
+            if item_id not in self.items:
+                continue
+            item = self.items[item_id]
+            item["status"] = self.RUNNING
+            self.queue_view.set(item_id, "status", self.RUNNING)
+            self.running += 1
+            threading.Thread(target=self.download_thread, args=(item_id, item), daemon=True).start()
+        self.update_overview()
+
+    def download_thread(self, item_id, item):
+        """Worker: runs one download and reports back through the event queue only"""
+        def progress_callback(progress_data):
+            if progress_data.get("status") != "downloading":
+                return
+            downloaded = progress_data.get("downloaded_bytes") or 0
+            total = progress_data.get("total_bytes") or progress_data.get("total_bytes_estimate")
+            speed = progress_data.get("speed")
+            with self.progress_lock:
+                self.latest_progress[item_id] = (
+                    min(downloaded * 100 / total, 100.0) if total else None,
+                    f"{human_readable_size(speed)}/s" if speed else human_readable_size(downloaded)
+                )
 
-    def download_thread(self, url, download_dir):
         try:
-            # Simulate progress updates (you can replace this with actual progress from yt-dlp)
-            def progress_callback(progress_data):
-                if progress_data.get("status") == "downloading":
-                    percent = progress_data.get("_percent_str", "0%").replace("%", "")
-                    try:
-                        percent_value = float(percent)
-                        self.root.after(0, self.update_progress, percent_value, f"Downloading... {percent}%")
-                    except:
-                        pass
-
             result = download_audio_from_youtube(
-                url,
-                output_dir=download_dir,
-                convert_to_mp3=self.mp3_var.get(),
-                keep_original=self.keep_original_var.get(),
-                progress_hook=progress_callback
+                item["url"],
+                output_dir=item["dir"],
+                keep_original=item["keep_original"],
+                progress_hook=progress_callback,
+                output_format=PRESETS[item["preset"]]["target"] if item["preset"] else "native",
+                preset=item["preset"]
             )
-            
-            # Update UI in main thread
-            self.root.after(0, self.on_download_complete, result, url, download_dir)
-            
+            self.events.put(("done", item_id, result))
         except Exception as e:
-            # Update UI in main thread
-            self.root.after(0, self.on_download_error, str(e))
-
-    def on_download_complete(self, result, original_url, download_dir):
-        """Called in main thread when download completes successfully"""
-        self.progress_var.set(100)
-        self.progress_text.set("Download completed!")
-        self.status_var.set("Download completed successfully")
-        
-        self.display_results(result, download_dir)
-        
-        # Clear the URL input field
-        self.url_var.set("")
-        
-        # Reset download state
-        self.is_downloading = False
-        self.download_btn.config(state=tk.NORMAL, text="🚀 Download Audio")
-        
-        self.write_log("✅ URL field cleared. Ready for next download.", "success")
-        self.write_log("💡 Tip: Paste a new YouTube URL and click Download Audio to start another download.", "info")
-
-    def on_download_error(self, error_message):
-        """Called in main thread when download fails"""
-        self.progress_var.set(0)
-        self.progress_text.set("Download failed")
-        self.status_var.set("Download failed")
-        
-        self.write_log(f"❌ Error: {error_message}", "error")
-        
-        # Reset download state but don't clear URL (user might want to retry)
-        self.is_downloading = False
-        self.download_btn.config(state=tk.NORMAL, text="🚀 Download Audio")
-        
+            self.events.put(("error", item_id, str(e)))
+
+    def process_events(self):
+        """Once per frame: apply the newest progress per item and the queued events"""
+        with self.progress_lock:
+            progress, self.latest_progress = self.latest_progress, {}
+        for item_id, (percent, detail) in progress.items():
+            item = self.items.get(item_id)
+            if item is None or item["status"] != self.RUNNING:
+                continue
+            if percent is not None:
+                item["percent"] = percent
+            self.queue_view.item(item_id, values=(self.RUNNING, f"{item['percent']:.0f}%", detail))
+
+        handled = 0
+        while handled < MAX_EVENTS_PER_FRAME:
+            try:
+                kind, item_id, payload = self.events.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            if kind == "done":
+                self.on_download_complete(item_id, payload)
+            elif kind == "error":
+                self.on_download_error(item_id, payload)
+
+        if progress or handled:
+            self.dispatch()
+        self.root.after(self.frame_ms, self.process_events)
+
+    def on_download_complete(self, item_id, result):
+        """Called in main thread when an item's download completes"""
+        self.running -= 1
+        item = self.items.get(item_id)
+        if item is None:
+            return
+        succeeded = result.get("status") == "success"
+        item["status"] = self.DONE if succeeded else self.FAILED
+        item["percent"] = 100.0
+        size = next((f["size"] for f in result.get("files", []) if f["type"] != "original"), "")
+        self.queue_view.item(
+            item_id,
+            text=result.get("title") or item["url"],
+            values=(item["status"], "100%" if succeeded else "", size)
+        )
+        self.display_results(result, item["dir"])
+
+    def on_download_error(self, item_id, error_message):
+        """Called in main thread when an item's download fails"""
+        self.running -= 1
+        item = self.items.get(item_id)
+        if item is None:
+            return
+        item["status"] = self.FAILED
+        self.queue_view.item(item_id, values=(self.FAILED, "", ""))
+        self.write_log(f"❌ Error ({item['url']}): {error_message}", "error")
         self.write_log("🔧 Please check the URL and try again.", "warning")
 
+    def clear_finished(self):
+        """Remove done and failed rows from the queue"""
+        for item_id, item in list(self.items.items()):
+            if item["status"] in (self.DONE, self.FAILED):
+                self.queue_view.delete(item_id)
+                del self.items[item_id]
+        self.update_overview()
+
+    def update_overview(self):
+        """Overall progress bar and the running / queued / done counts"""
+        counts = collections.Counter(item["status"] for item in self.items.values())
+        finished = counts[self.DONE] + counts[self.FAILED]
+        if self.items:
+            total = sum(100.0 if item["status"] in (self.DONE, self.FAILED) else item["percent"]
+                        for item in self.items.values())
+            self.progress_var.set(total / len(self.items))
+        else:
+            self.progress_var.set(0)
+
+        summary = (f"{counts[self.RUNNING]} running, {counts[self.QUEUED]} queued, "
+                   f"{counts[self.DONE]} done" + (f", {counts[self.FAILED]} failed" if counts[self.FAILED] else ""))
+        self.progress_text.set(summary if self.items else "Queue is empty")
+        if counts[self.RUNNING] or counts[self.QUEUED]:
+            self.status_var.set(f"Downloading... {summary}")
+        elif finished:
+            self.status_var.set(f"All downloads finished: {summary}")
+        else:
+            self.status_var.set("Ready")
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = YouTubeAudioDownloaderGUI(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
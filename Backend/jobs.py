@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""Persistent download job queue backed by SQLite, with leases, retries and recovery after restarts.
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from metrics import record_wait, trace
+
+JOBS_DIR = Path(os.environ.get("JOBS_DIR", "jobs"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_BACKOFF_BASE = float(os.environ.get("JOB_BACKOFF_BASE", 5))
+# How long a claimed job stays owned without a heartbeat
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 120))
+# Finished jobs are removed after this many seconds
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    options TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    lease_until REAL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority DESC, created_at);
+"""
+
+class JobQueue:
+    """SQLite-backed priority queue with a pool of worker threads"""
+
+    def __init__(self, runner, jobs_dir=JOBS_DIR, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS,
+                 backoff_base=JOB_BACKOFF_BASE, lease_seconds=JOB_LEASE_SECONDS,
+                 retention=JOB_RETENTION, admit=None):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.jobs_dir / "jobs.sqlite3"
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.lease_seconds = lease_seconds
+        self.retention = retention
+        # Called as runner(url, options, progress_hook); returns the job result
+        self.runner = runner
+        # Callable returning False while there is no room for another download (backpressure)
+        self.admit = admit or (lambda: True)
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._last_prune = 0.0
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # ---- public API ----
+    def submit(self, url, options=None, priority=0, id_prefix=None):
+        """Queue a job and return its id immediately (``id_prefix.<uuid>`` with a prefix)"""
+        job_id = uuid.uuid4().hex
+        if id_prefix:
+            job_id = f"{id_prefix}.{job_id}"
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, url, options, priority, status, next_run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, url, json.dumps(options or {}), priority, now, now, now)
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Return a job as a dict, or None if it does not exist"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("options", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def start(self):
+        """Start the worker threads"""
+        self._stopping.clear()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        """Ask workers to exit; running jobs keep their lease and are recovered on restart"""
+        self._stopping.set()
+        self._wakeup.set()
+        self._threads = []
+
+    # ---- worker internals ----
+    def _claim(self):
+        """Atomically take the highest-priority runnable job, including ones with expired leases"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute(
+                    "SELECT id, status, attempts FROM jobs "
+                    "WHERE (status = 'queued' AND next_run_at <= ?) "
+                    "   OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY priority DESC, created_at LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["status"] == "queued" or row["attempts"] < self.max_attempts:
+                    break
+                # Its worker died on the last attempt: reclaiming it would run one attempt too many
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                    (f"Worker lost on attempt {row['attempts']} of {self.max_attempts}", now, row["id"])
+                )
+                print(f"Job {row['id']} failed permanently: worker lost on its last attempt")
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                "WHERE id = ?",
+                (now + self.lease_seconds, now, row["id"])
+            )
+            conn.execute("COMMIT")
+        return self.get(row["id"])
+
+    def _heartbeat(self, job_id, progress):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ?, progress = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                (now + self.lease_seconds, json.dumps(progress), now, job_id)
+            )
+
+    def _make_progress_hook(self, job_id):
+        state = {"last": 0.0}
+
+        def progress_hook(progress):
+            now = time.time()
+            status = progress.get("status")
+            # Throttle database writes to about one per second
+            if status == "downloading" and now - state["last"] < 1.0:
+                return
+            state["last"] = now
+            self._heartbeat(job_id, {
+                "status": status,
+                "downloaded_bytes": progress.get("downloaded_bytes"),
+                "total_bytes": progress.get("total_bytes") or progress.get("total_bytes_estimate"),
+                "speed": progress.get("speed"),
+                "eta": progress.get("eta"),
+            })
+
+        return progress_hook
+
+    def _finish(self, job_id, result):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'completed', result = ?, error = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (json.dumps(result), now, job_id)
+            )
+
+    def _fail(self, job, error):
+        now = time.time()
+        if job["attempts"] < self.max_attempts:
+            delay = self.backoff_base * (2 ** (job["attempts"] - 1))
+            status, next_run_at = "queued", now + delay
+            print(f"Job {job['id']} failed (attempt {job['attempts']}), retrying in {delay:.0f}s: {error}")
+        else:
+            status, next_run_at = "failed", job["next_run_at"]
+            print(f"Job {job['id']} failed permanently: {error}")
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, next_run_at = ?, lease_until = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (status, str(error), next_run_at, now, job["id"])
+            )
+
+    def _keep_alive(self, job_id, done):
+        """Renew the lease while a job runs, including long ffmpeg phases without progress ticks"""
+        while not done.wait(self.lease_seconds / 3):
+            now = time.time()
+            try:
+                with self._connect() as conn:
+                    conn.execute(
+                        "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+                        (now + self.lease_seconds, job_id)
+                    )
+            except sqlite3.Error as e:
+                print(f"Could not renew lease for job {job_id}: {e}")
+
+    def _run(self, job):
+        done = threading.Event()
+        threading.Thread(target=self._keep_alive, args=(job["id"], done), daemon=True).start()
+        try:
+            with trace(f"job {job['id']}"):
+                record_wait("jobs", time.time() - job["next_run_at"])
+                result = self.runner(job["url"], job["options"], self._make_progress_hook(job["id"]))
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self._finish(job["id"], result)
+        finally:
+            done.set()
+
+    def counts(self):
+        """Number of jobs per status"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def prune(self):
+        """Delete finished jobs older than the retention period (their files belong to the result cache)"""
+        cutoff = time.time() - self.retention
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                (cutoff,)
+            )
+        self._last_prune = time.time()
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            try:
+                if time.time() - self._last_prune > 60:
+                    self.prune()
+                # Leave jobs queued until storage frees up
+                job = self._claim() if self.admit() else None
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(timeout=1.0)
+                self._wakeup.clear()
+                continue
+            print(f"Running job {job['id']} (attempt {job['attempts']}): {job['url']}")
+            self._run(job)
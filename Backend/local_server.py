@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Local stand-in for a media CDN (Range, per-connection throttling, 429), for tests and benchmarks.
+
+    with LocalMediaServer("/tmp/media", per_connection_bps=2_000_000) as server:
+        url = server.url("song.mp3")
+"""
+
+import http.server
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _serve(self, send_body):
+        path = self.translate_path(self.path.split("?")[0])
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if match and self.server.ranges:
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        if not self.server.begin_transfer():
+            self.send_response(429)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            self._send_file(path, status, start, end, size, send_body)
+        finally:
+            self.server.end_transfer()
+
+    def _send_file(self, path, status, start, end, size, send_body):
+        self.send_response(status)
+        self.send_header("Content-Type", self.guess_type(path))
+        self.send_header("Content-Length", str(end - start + 1))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if send_body:
+            with open(path, "rb") as f:
+                f.seek(start)
+                self._send_body(f, end - start + 1)
+
+    def _send_body(self, f, remaining):
+        rate = self.server.per_connection_bps
+        block = 64 * 1024
+        started = time.time()
+        sent = 0
+        try:
+            while remaining > 0:
+                data = f.read(min(block, remaining))
+                if not data:
+                    break
+                self.wfile.write(data)
+                sent += len(data)
+                remaining -= len(data)
+                if rate:
+                    # Sleep until this connection is back under its rate
+                    ahead = sent / rate - (time.time() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class LocalMediaServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server on 127.0.0.1 with Range support and optional throttling / concurrency limit"""
+
+    daemon_threads = True
+
+    def __init__(self, directory, per_connection_bps=None, ranges=True, max_concurrent=None, port=0):
+        self.directory = str(directory)
+        self.per_connection_bps = per_connection_bps
+        self.ranges = ranges
+        self.max_concurrent = max_concurrent
+        self.requests = 0
+        self.rejected = 0
+        self._transfers = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+        super().__init__(
+            ("127.0.0.1", port),
+            lambda *args: _Handler(*args, directory=self.directory)
+        )
+
+    def begin_transfer(self):
+        """Count a request; False if it is over the concurrency limit and should get a 429"""
+        with self._count_lock:
+            self.requests += 1
+            if self.max_concurrent and self._transfers >= self.max_concurrent:
+                self.rejected += 1
+                return False
+            self._transfers += 1
+            return True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections mid-transfer are expected (probes, cancelled streams)
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+    def end_transfer(self):
+        with self._count_lock:
+            self._transfers -= 1
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.server_address[1]}/{name}"
+
+    def add_file(self, src, name=None):
+        """Copy ``src`` into the served directory and return its URL"""
+        name = name or os.path.basename(src)
+        shutil.copyfile(src, os.path.join(self.directory, name))
+        return self.url(name)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
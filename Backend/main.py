@@ -1,14 +1,35 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from downloader_core import download_audio_from_youtube
+from typing import List, Optional
+from downloader_core import (WARMUP, download_audio_from_youtube, extract_video_id, metadata_cache, probe,
+                             resolve_live_stream, warm_up)
+from bandwidth import get_estimator
+from pipeline import LiveTranscode, TranscodeError
+from formats import CONVERSION_COUNTS, PRESETS, QUALITIES, TARGETS, encoder_args
+from presets import default_preset, preset_profiler
 from progress import stream_download
-from fastapi import BackgroundTasks
+from executors import download_executor, run_download, shutdown as shutdown_executors, stream_executor
+from jobs import JobQueue
+from result_cache import ResultCache, cache_key
+from singleflight import flight
+from ydl_pool import ydl_pool
+from partials import partial_index
+from batch import ZipStream, expand_urls
+from storage import TEMP_DOWNLOAD_DIR, StorageManager, StorageFull
+from metrics import BYTES_TRANSFERRED, RequestMetricsMiddleware, registry, span, stats_samples
+from admission import Rejected, admission, client_key
+from cluster import cluster
+from serving import SERVE_GRACE_SECONDS, RangeFileResponse
 from pathlib import Path
-import shutil
+import json
+import re
 import time
 import os
+import uuid
+from urllib.parse import quote, unquote
 
 app = FastAPI()
 
@@ -19,138 +40,686 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestMetricsMiddleware)
 
 class DownloadRequest(BaseModel):
     url: str
     convert_mp3: bool
     keep_original: bool
+    # "mp3", "m4a", "opus" or "native"; overrides convert_mp3 when set
+    output_format: Optional[str] = None
+    # A named preset (GET /presets), or the pinned default preset of a quality tier
+    preset: Optional[str] = None
+    quality: Optional[str] = None
+
+class JobRequest(BaseModel):
+    url: str
+    convert_mp3: bool = True
+    keep_original: bool = False
+    output_format: Optional[str] = None
+    preset: Optional[str] = None
+    quality: Optional[str] = None
+    priority: int = 0
+
+class BatchRequest(BaseModel):
+    # Video, playlist or channel URLs; collections are expanded into their entries
+    urls: List[str]
+    convert_mp3: bool = True
+    output_format: Optional[str] = None
+    preset: Optional[str] = None
+    quality: Optional[str] = None
+    # "zip" streams an archive of the results, "jobs" queues one job per item
+    mode: str = "zip"
+    priority: int = 0
 
 # Temporary directory for web downloads
-TEMP_DOWNLOAD_DIR = Path("temp_downloads")
-TEMP_DOWNLOAD_DIR.mkdir(exist_ok=True)
-
-def cleanup_temp_files():
-    """Clean up temporary files older than 1 hour"""
-    current_time = time.time()
-    for file_path in TEMP_DOWNLOAD_DIR.glob("*"):
-        if file_path.is_file() and (current_time - file_path.stat().st_mtime) > 3600:
-            try:
-                file_path.unlink()
-                print(f"Cleaned up temp file: {file_path}")
-            except Exception as e:
-                print(f"Error cleaning up {file_path}: {e}")
-        elif file_path.is_dir():
-            try:
-                if (current_time - file_path.stat().st_mtime) > 3600:
-                    shutil.rmtree(file_path)
-                    print(f"Cleaned up temp directory: {file_path}")
-            except Exception as e:
-                print(f"Error cleaning up directory {file_path}: {e}")
+TEMP_DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+# Quota, sweeping and eviction for the temp directory; resumable partials are not aged out
+storage = StorageManager(TEMP_DOWNLOAD_DIR, keep=partial_index.active_dirs)
+
+# Finished files shared across requests, keyed by video ID and output options
+result_cache = ResultCache()
+
+class TimedFileResponse(RangeFileResponse):
+    """RangeFileResponse that records the serve stage and the bytes sent"""
+
+    async def __call__(self, scope, receive, send):
+        async def counting_send(message):
+            if message["type"] == "http.response.body":
+                BYTES_TRANSFERRED.inc(len(message.get("body", b"")), direction="served")
+            elif message["type"] == "http.response.zerocopysend":
+                BYTES_TRANSFERRED.inc(message["count"], direction="served")
+            elif message["type"] == "http.response.pathsend":
+                BYTES_TRANSFERRED.inc(int(self.headers["content-length"]), direction="served")
+            await send(message)
+
+        with span("serve"):
+            await super().__call__(scope, receive, counting_send)
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """StreamingResponse that gives its admission slot back when the response ends, however it ends"""
+
+    def __init__(self, *args, admitted_at, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.admitted_at = admitted_at
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            admission.release(self.admitted_at)
+
+@registry.collector
+def component_metrics():
+    """Caches, pools, storage and queues, read at scrape time"""
+    samples = [
+        *stats_samples("ytaudio_result_cache", result_cache.stats(), "Result cache",
+                       counters=("hits", "misses", "evictions")),
+        *stats_samples("ytaudio_metadata_cache", metadata_cache.stats(), "Metadata cache",
+                       counters=("hits", "misses")),
+        *stats_samples("ytaudio_ydl_pool", ydl_pool.stats(), "YoutubeDL pool", counters=("created", "reused")),
+        *stats_samples("ytaudio_storage", storage.stats(), "Temporary storage",
+                       counters=("evictions", "evicted_bytes", "expired", "refused", "sweeps")),
+        *stats_samples("ytaudio_admission", admission.stats(), "Admission control",
+                       counters=("admitted", "queued", "rejected")),
+        *stats_samples("ytaudio_cluster", cluster.stats(), "Cluster routing",
+                       counters=("local", "forwarded", "redirected", "failovers")),
+        ("ytaudio_singleflight_in_flight", "gauge", "Distinct downloads currently running", {}, flight.in_flight()),
+        ("ytaudio_resumable_partials", "gauge", "Work directories with resumable partial downloads", {},
+         len(partial_index.active_dirs())),
+    ]
+    for action, count in list(CONVERSION_COUNTS.items()):
+        samples.append(("ytaudio_conversions_total", "counter", "Format negotiation outcomes", {"action": action}, count))
+    for reason, count in admission.stats()["rejected_by_reason"].items():
+        samples.append(("ytaudio_admission_rejections_total", "counter", "Requests refused by admission control",
+                        {"reason": reason}, count))
+    for status, count in job_queue.counts().items():
+        samples.append(("ytaudio_jobs", "gauge", "Jobs per status", {"status": status}, count))
+    return samples
+
+def admit_download():
+    """Refuse new work with 503 while temporary storage is full"""
+    try:
+        storage.admit()
+    except StorageFull as e:
+        print(f"Refusing download: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def rejection(e: Rejected):
+    """HTTP error for a request refused by admission control"""
+    print(f"Refusing request: {e}")
+    return HTTPException(status_code=e.status, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def check_rate(http_request: Request):
+    """Spend one of the client's rate-limit tokens (429 when they are used up)"""
+    try:
+        admission.check_rate(client_key(http_request))
+    except Rejected as e:
+        raise rejection(e)
+
+async def admit(http_request: Request, rate_limit=True):
+    """Wait for a download slot; returns the admission time to pass to ``admission.release``"""
+    admit_download()
+    try:
+        return await admission.acquire(client_key(http_request), rate_limit=rate_limit)
+    except Rejected as e:
+        raise rejection(e)
+
+async def route_to_owner(url, http_request: Request):
+    """In cluster mode, the response of the node owning this video; None to serve it here"""
+    video_id = extract_video_id(url)
+    if cluster.mode == "forward" and cluster.owner(video_id) and not cluster.is_routed(http_request):
+        # Rate limit the client here; the owner only sees this node's address
+        check_rate(http_request)
+    return await cluster.route(http_request, video_id)
+
+def client_rate_limited(http_request: Request):
+    """False for requests a cluster member forwarded (it already spent the client's token)"""
+    return not cluster.is_forwarded(http_request)
+
+def requested_output(convert_mp3, output_format=None, preset=None, quality=None):
+    """Normalize request options to an output format ("native" keeps the source file) and preset
+
+    Without a named preset, converted output uses the default preset of the requested quality
+    tier for the requested format; a quality needs a converted format (output_format or convert_mp3).
+    """
+    if preset:
+        if preset not in PRESETS:
+            raise HTTPException(status_code=400, detail=f"Unknown preset: {preset}")
+        if output_format and output_format != PRESETS[preset]["target"]:
+            raise HTTPException(status_code=400, detail=f"Preset {preset} does not produce {output_format}")
+        return PRESETS[preset]["target"], preset
+    target = output_format or ("mp3" if convert_mp3 else "native")
+    if target != "native" and target not in TARGETS:
+        raise HTTPException(status_code=400, detail=f"Unsupported output format: {target}")
+    if target == "native":
+        if quality:
+            raise HTTPException(status_code=400, detail="quality needs an output_format or convert_mp3")
+        return "native", None
+    try:
+        return target, default_preset(target, quality)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def find_result_file(result, directory, target):
+    """Pick the file to serve from a download result (converted file if any, otherwise original)"""
+    # Priority: converted file if requested and available
+    if target != "native":
+        for file_info in result.get("files", []):
+            if file_info["type"] == target:
+                return Path(directory) / file_info["name"], target
+    
+    # If no converted file found or not requested, look for original
+    for file_info in result.get("files", []):
+        if file_info["type"] == "original":
+            return Path(directory) / file_info["name"], "original"
+    
+    return None, None
+
+def result_cache_key(url, target, preset=None):
+    """Cache key for the file /download-file would serve for these options"""
+    if target != "native":
+        return cache_key(extract_video_id(url), target, preset or TARGETS[target]["preset"], TARGETS[target]["encoder"])
+    return cache_key(extract_video_id(url), "original")
+
+def media_type_for(path: Path):
+    """Determine the response media type from the file extension"""
+    if path.suffix.lower() == '.mp3':
+        return 'audio/mpeg'
+    if path.suffix.lower() in ['.webm', '.m4a', '.ogg', '.opus']:
+        return 'audio/*'
+    return 'application/octet-stream'
+
+def serve_cached(key, entry):
+    """Response for a result cache entry; a dropped download resumes at its Content-Location with GET + Range"""
+    path = entry["path"]
+    video_id = key.split(":")[0]
+    return TimedFileResponse(
+        path=path,
+        filename=path.name,
+        media_type=media_type_for(path),
+        digest=entry.get("sha256"),
+        headers={"Content-Location": f"/result/{video_id}/{path.parent.name}"}
+    )
+
+def produce_cached_result(url, target, keep_original, key, progress_hook=None, preset=None):
+    """Download into a temp directory, publish the file to serve into the result cache and return the entry"""
+    # Another request or process may have produced it while this one waited
+    cached = result_cache.get(key, record=False)
+    if cached:
+        return cached
+    
+    # Stable work directory per video and output, so a retry resumes the partial download
+    temp_dir = storage.acquire(f"work_{extract_video_id(url)}_{preset or target}")
+    print(f"Downloading to temporary directory: {temp_dir}")
+    
+    try:
+        result = download_audio_from_youtube(
+            url=url,
+            output_dir=str(temp_dir),
+            keep_original=keep_original,
+            progress_hook=progress_hook,
+            output_format=target,
+            preset=preset
+        )
+        print(f"Download result: {result}")
+        
+        file_to_serve, file_type = find_result_file(result, temp_dir, target)
+        if not file_to_serve or not file_to_serve.exists():
+            print(f"File not found. Available files: {list(temp_dir.glob('*'))}")
+            raise FileNotFoundError("Downloaded file not found")
+        
+        print(f"Caching {file_type} file: {file_to_serve}")
+        entry = result_cache.publish(key, file_to_serve, title=result.get("title"), move=True)
+    except Exception:
+        # Keep interrupted partials for the next attempt
+        storage.release(temp_dir, delete=not partial_index.pending(temp_dir))
+        raise
+    storage.release(temp_dir, delete=True)
+    return entry
+
+def produce_batch_item(url, target, preset=None, routed=False):
+    """Produce one batch item through the result cache (of its owner node); runs on a batch worker thread"""
+    owner = None if routed else cluster.owner(extract_video_id(url))
+    if owner:
+        try:
+            return fetch_from_owner(owner, url, target, preset)
+        except OSError:
+            # Owner unreachable (now marked down): produce the item here
+            pass
+    key = result_cache_key(url, target, preset)
+    cached = result_cache.get(key)
+    if cached:
+        return cached
+    # Each download of a batch takes its own slot, waiting for one in this thread
+    with admission.hold():
+        return flight.do(key, lambda hook: produce_cached_result(url, target, False, key, hook, preset))
+
+def fetch_from_owner(owner, url, target, preset):
+    """Have the owner node produce a batch item, and copy its file here for the archive"""
+    body = {"url": url, "convert_mp3": target == "mp3", "output_format": target, "preset": preset,
+            "keep_original": False}
+    conn, response = cluster.send(owner, "POST", "/download-file", body)
+    try:
+        if response.status != 200:
+            detail = response.read(1000).decode(errors="replace")
+            raise RuntimeError(f"{owner} answered {response.status}: {detail}")
+        video_id = extract_video_id(url)
+        name = disposition_filename(response.getheader("content-disposition")) or f"{video_id}.{target}"
+        temp_dir = storage.acquire(f"relay_{video_id}_{uuid.uuid4().hex[:8]}")
+        try:
+            path = temp_dir / Path(name).name
+            with open(path, "wb") as f:
+                while True:
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+        except BaseException:
+            storage.release(temp_dir, delete=True)
+            raise
+    finally:
+        conn.close()
+    # The copy is only needed until the archive has it
+    return {"path": path, "cleanup": lambda: storage.release(temp_dir, delete=True)}
+
+def run_job(url, options, progress_hook):
+    """Run one queued job through the single-flight, storage and result cache of /download-file"""
+    target = options.get("output_format") or ("mp3" if options.get("convert_mp3") else "native")
+    preset = options.get("preset")
+    key = result_cache_key(url, target, preset)
+    entry = result_cache.get(key)
+    if entry is None:
+        with admission.hold():
+            entry = flight.do(
+                key,
+                lambda hook: produce_cached_result(url, target, options.get("keep_original", False), key, hook, preset),
+                progress_hook
+            )
+    return {
+        "cache_key": key,
+        "title": entry.get("title"),
+        "file": entry["path"].name,
+        "size": entry["size"],
+        "sha256": entry.get("sha256"),
+        "content_location": f"/result/{extract_video_id(url)}/{entry['path'].parent.name}",
+    }
+
+def job_admitted():
+    """Jobs stay queued while storage is full or interactive requests need every download slot
+
+    A claimed job then holds a slot of its own while it downloads (``run_job``).
+    """
+    return storage.has_capacity() and admission.has_room()
+
+# Persistent queue for asynchronous jobs (POST /jobs)
+job_queue = JobQueue(run_job, admit=job_admitted)
+
+def content_disposition(filename):
+    """Attachment header that survives non-ASCII titles"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
 
-def cleanup_file(temp_dir: Path):
-    """Clean up temporary directory after download"""
+def disposition_filename(header):
+    """File name of a Content-Disposition header written by ``content_disposition``, or None"""
+    match = re.search(r"filename\*=utf-8''([^;]+)", header or "")
+    if match:
+        return unquote(match.group(1))
+    match = re.search(r'filename="([^"]*)"', header or "")
+    return match.group(1) if match else None
+
+@app.get("/info")
+async def video_info(url: str, http_request: Request):
+    """Title, duration, audio formats and expected file sizes, without downloading"""
+    routed = await route_to_owner(url, http_request)
+    if routed:
+        return routed
+    if client_rate_limited(http_request):
+        check_rate(http_request)
     try:
-        if temp_dir.exists():
-            shutil.rmtree(temp_dir)
-            print(f"Cleaned up download directory: {temp_dir}")
+        return await run_download(probe, url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"Error cleaning up {temp_dir}: {e}")
+        print(f"Info error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Could not read video info: {str(e)}")
 
 @app.get("/download-stream")
-async def download_stream(url: str, convert_mp3: str, keep_original: str):
+async def download_stream(url: str, convert_mp3: str, keep_original: str, http_request: Request):
     """Endpoint for streaming download progress (for progress updates)"""
     convert_mp3 = convert_mp3.lower() == "true"
     keep_original = keep_original.lower() == "true"
 
+    routed = await route_to_owner(url, http_request)
+    if routed:
+        return routed
+    admitted_at = await admit(http_request, client_rate_limited(http_request))
     generator = stream_download(url, convert_mp3, keep_original)
-    return StreamingResponse(generator, media_type="text/event-stream")
+    return AdmittedStreamingResponse(generator, media_type="text/event-stream", admitted_at=admitted_at)
 
 @app.post("/download-file")
-async def download_file(request: DownloadRequest, background_tasks: BackgroundTasks):
+async def download_file(request: DownloadRequest, http_request: Request):
     """MAIN ENDPOINT - Direct file download that triggers browser save dialog"""
+    routed = await route_to_owner(request.url, http_request)
+    if routed:
+        return routed
+    return await produce_download(request, http_request, client_rate_limited(http_request))
+
+async def produce_download(request: DownloadRequest, http_request: Request, rate_limit=True):
+    """Serve a download from the result cache, or produce it once admitted"""
     try:
         print(f"Starting download for URL: {request.url}")
         print(f"Options - MP3: {request.convert_mp3}, Keep Original: {request.keep_original}")
         
-        # Use temp directory for web downloads
-        temp_dir = TEMP_DOWNLOAD_DIR / f"download_{hash(request.url)}_{int(time.time())}"
-        temp_dir.mkdir(parents=True, exist_ok=True)
-        
-        print(f"Downloading to temporary directory: {temp_dir}")
-        
-        # Download the file
-        result = download_audio_from_youtube(
-            url=request.url,
-            output_dir=str(temp_dir),
-            convert_to_mp3=request.convert_mp3,
-            keep_original=request.keep_original
-        )
-        
-        print(f"Download result: {result}")
-        
-        # Find the file to serve (MP3 if converted, otherwise original)
-        file_to_serve = None
-        file_type = None
-        
-        # Priority: MP3 if requested and available
-        if request.convert_mp3:
-            for file_info in result.get("files", []):
-                if file_info["type"] == "mp3":
-                    file_to_serve = Path(temp_dir) / file_info["name"]
-                    file_type = "mp3"
-                    break
-        
-        # If no MP3 found or not requested, look for original
-        if not file_to_serve:
-            for file_info in result.get("files", []):
-                if file_info["type"] == "original":
-                    file_to_serve = Path(temp_dir) / file_info["name"]
-                    file_type = "original"
-                    break
-        
-        if not file_to_serve or not file_to_serve.exists():
-            print(f"File not found. Available files: {list(temp_dir.glob('*'))}")
-            raise HTTPException(status_code=404, detail="Downloaded file not found")
-        
-        print(f"Serving file: {file_to_serve} (Type: {file_type})")
-        
-        # Determine media type and filename
-        filename = file_to_serve.name
-        if file_to_serve.suffix.lower() == '.mp3':
-            media_type = 'audio/mpeg'
-        elif file_to_serve.suffix.lower() in ['.webm', '.m4a', '.ogg']:
-            media_type = 'audio/*'
-        else:
-            media_type = 'application/octet-stream'
+        # Serve repeat requests straight from the result cache
+        target, preset = requested_output(request.convert_mp3, request.output_format, request.preset, request.quality)
+        key = result_cache_key(request.url, target, preset)
+        cached = result_cache.get(key)
+        if cached:
+            print(f"Cache hit: {key}")
+            return serve_cached(key, cached)
+        admitted_at = await admit(http_request, rate_limit)
         
-        # Schedule cleanup
-        background_tasks.add_task(cleanup_file, temp_dir)
+        # Identical concurrent requests share one download/transcode
+        try:
+            cached = await asyncio.wrap_future(flight.submit(
+                key,
+                lambda hook: produce_cached_result(
+                    request.url, target, request.keep_original, key, hook, preset
+                ),
+                download_executor()
+            ))
+        finally:
+            admission.release(admitted_at)
+        print(f"Serving file: {cached['path']}")
         
         # Return the file - this will trigger browser download dialog
-        return FileResponse(
-            path=file_to_serve,
-            filename=filename,
-            media_type=media_type,
-            background=background_tasks
-        )
+        return serve_cached(key, cached)
         
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
         print(f"Download error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
 
-@app.get("/file")
-async def get_file(path: str, background_tasks: BackgroundTasks):
-    """Legacy endpoint to serve files with cleanup"""
+@app.post("/download-live")
+async def download_live(request: DownloadRequest, http_request: Request):
+    """Stream the MP3 to the client while it is still being downloaded and encoded"""
+    routed = await route_to_owner(request.url, http_request)
+    if routed:
+        return routed
+    _, preset = requested_output(True, "mp3", request.preset, request.quality)
+    key = result_cache_key(request.url, "mp3", preset)
+    cached = result_cache.get(key)
+    if cached:
+        return serve_cached(key, cached)
+    
+    admitted_at = await admit(http_request, client_rate_limited(http_request))
+    fallback = request.model_copy(update={"convert_mp3": True, "output_format": "mp3", "preset": preset})
+    live = None
+    streaming = False
+    # Until the response owns them, the slot and the transcode are released here, also when
+    # the client disconnects (CancelledError) while yt-dlp or ffmpeg is starting
     try:
-        path = Path(path)
-        if not path.exists():
+        resolving = stream_executor().submit(resolve_live_stream, request.url)
+        try:
+            ydl, info = await asyncio.wrap_future(resolving)
+        except asyncio.CancelledError:
+            resolving.add_done_callback(release_resolved)
+            raise
+        except Exception as e:
+            print(f"Download error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
+        
+        if ydl is not None:
+            filename = Path(ydl.prepare_filename(info)).stem + ".mp3"
+            live = LiveTranscode(ydl, info, encoder_args("mp3", preset), "mp3", [get_estimator().progress_hook],
+                                 release=ydl_pool.release)
+            stream_executor().submit(live.run)
+            try:
+                await asyncio.wrap_future(live.ready)
+            except TranscodeError as e:
+                print(f"Live streaming unavailable, falling back to file download: {e}")
+            except Exception as e:
+                print(f"Download error: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
+            else:
+                print(f"Streaming MP3 to client: {filename}")
+                response = AdmittedStreamingResponse(
+                    live.iter_chunks(),
+                    media_type="audio/mpeg",
+                    headers={"Content-Disposition": content_disposition(filename)},
+                    admitted_at=admitted_at
+                )
+                streaming = True
+                return response
+    finally:
+        if not streaming:
+            if live is not None:
+                live.cancel()
+            admission.release(admitted_at)
+    
+    # Fragmented formats cannot be piped - produce the file first instead (the token is already spent)
+    return await produce_download(fallback, http_request, rate_limit=False)
+
+def release_resolved(resolving):
+    """Hand back the YoutubeDL of a live stream resolved for a client that has gone"""
+    if resolving.cancelled() or resolving.exception() is not None:
+        return
+    ydl, _ = resolving.result()
+    if ydl is not None:
+        ydl_pool.release(ydl)
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: JobRequest, http_request: Request):
+    """Queue a download on the owner of its video and return its job id immediately"""
+    routed = await route_to_owner(request.url, http_request)
+    if routed:
+        return routed
+    # The job queue bounds the work itself; clients are only rate limited
+    if client_rate_limited(http_request):
+        check_rate(http_request)
+    target, preset = requested_output(request.convert_mp3, request.output_format, request.preset, request.quality)
+    job_id = job_queue.submit(
+        request.url,
+        {
+            "output_format": target,
+            "preset": preset,
+            "keep_original": request.keep_original,
+        },
+        priority=request.priority,
+        # Lets any node route later requests for the job to the node that has it
+        id_prefix=extract_video_id(request.url)
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+async def route_job(job_id, http_request: Request):
+    """In cluster mode, the response of the node holding the job; None to serve it here"""
+    video_id, _, _ = job_id.rpartition(".")
+    if not video_id:
+        return None
+    return await cluster.route(http_request, video_id)
+
+def submit_remote_job(owner, url, options, priority):
+    """Queue a job on its owner node; returns the job id"""
+    conn, response = cluster.send(owner, "POST", "/jobs", {"url": url, **options, "priority": priority})
+    try:
+        body = json.loads(response.read() or b"{}")
+    finally:
+        conn.close()
+    if response.status != 202:
+        raise HTTPException(status_code=502, detail=f"{owner} refused a job: {body.get('detail')}")
+    return body["job_id"]
+
+async def submit_batch_job(url, options, priority, routed):
+    """Queue one batch item as a job on the owner of its video (or here)"""
+    video_id = extract_video_id(url)
+    owner = None if routed else cluster.owner(video_id)
+    if owner:
+        try:
+            return await run_download(submit_remote_job, owner, url, options, priority)
+        except OSError:
+            # Owner unreachable (now marked down): queue it here
+            pass
+    return job_queue.submit(url, options, priority=priority, id_prefix=video_id)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, http_request: Request):
+    """Job status, progress and (once completed) the download result"""
+    routed = await route_job(job_id, http_request)
+    if routed:
+        return routed
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+@app.api_route("/result/{video_id}/{entry_id}", methods=["GET", "HEAD"])
+async def get_result(video_id: str, entry_id: str, http_request: Request):
+    """A produced file by its Content-Location: supports Range, If-Range and conditional GET"""
+    routed = await cluster.route(http_request, video_id)
+    if routed:
+        return routed
+    entry = result_cache.find(entry_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Result is no longer cached")
+    return serve_cached(video_id, entry)
+
+@app.get("/jobs/{job_id}/file")
+async def get_job_file(job_id: str, http_request: Request):
+    """Serve the file produced by a completed job"""
+    routed = await route_job(job_id, http_request)
+    if routed:
+        return routed
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    
+    # Job files live in the result cache, which may have evicted them since
+    key = (job["result"] or {}).get("cache_key")
+    entry = result_cache.get(key) if key else None
+    if entry is None:
+        raise HTTPException(status_code=410, detail="Job file is no longer available")
+    return serve_cached(key, entry)
+
+@app.post("/batch")
+async def create_batch(request: BatchRequest, http_request: Request):
+    """Download several URLs (or whole playlists) as a streamed ZIP or a set of queued jobs"""
+    if not request.urls:
+        raise HTTPException(status_code=400, detail="No URLs given")
+    target, preset = requested_output(request.convert_mp3, request.output_format, request.preset, request.quality)
+    
+    if request.mode == "jobs":
+        check_rate(http_request)
+        try:
+            urls = await run_download(lambda: list(expand_urls(request.urls)))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Playlist expansion failed: {str(e)}")
+        options = {"output_format": target, "preset": preset, "keep_original": False}
+        routed = cluster.is_routed(http_request)
+        jobs = [
+            {"url": url, "job_id": await submit_batch_job(url, options, request.priority, routed)}
+            for url in urls
+        ]
+        return JSONResponse(status_code=202, content={"status": "queued", "jobs": jobs})
+    
+    if request.mode != "zip":
+        raise HTTPException(status_code=400, detail=f"Unsupported batch mode: {request.mode}")
+    # The archive itself takes no download slot: each of its items holds one while it downloads
+    check_rate(http_request)
+    admit_download()
+    
+    # Expansion happens on the batch thread, so items start downloading as the playlist is paged
+    routed = cluster.is_routed(http_request)
+    archive = ZipStream(expand_urls(request.urls), lambda url: produce_batch_item(url, target, preset, routed))
+    stream_executor().submit(archive.run)
+    return StreamingResponse(
+        archive.iter_chunks(),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(f"batch_{int(time.time())}.zip")}
+    )
+
+@app.get("/presets")
+async def presets():
+    """Output presets with their measured encode speed, output bitrate and cost"""
+    return {
+        "defaults": {
+            quality: {target: default_preset(target, quality) for target in TARGETS}
+            for quality in QUALITIES
+        },
+        # Current measurements; a recorded default is kept even when these later disagree
+        "cheapest": {
+            quality: {target: preset_profiler.cheapest(target, quality) for target in TARGETS}
+            for quality in QUALITIES
+        },
+        "presets": preset_profiler.summary(),
+    }
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit/miss metrics and size"""
+    return result_cache.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage timings, bytes, queue waits, concurrency and component stats"""
+    text = await asyncio.get_running_loop().run_in_executor(None, registry.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Download slots in use, queue depth, rejections and the current load"""
+    return admission.stats()
+
+@app.get("/cluster")
+async def cluster_stats():
+    """Cluster members, their health and ring shares, and how requests were routed"""
+    return cluster.stats()
+
+@app.get("/cluster/owner")
+async def cluster_owner(url: str):
+    """The node that downloads and caches ``url`` in cluster mode"""
+    video_id = extract_video_id(url)
+    return {"video_id": video_id, "owner": cluster.owner(video_id) or cluster.self_url or None}
+
+@app.get("/storage/stats")
+async def storage_stats():
+    """Temporary storage usage, watermarks and sweeper counters"""
+    return storage.stats()
+
+@app.api_route("/file", methods=["GET", "HEAD"])
+async def get_file(path: str):
+    """Legacy endpoint to serve files from temporary storage; they are removed after a grace period"""
+    try:
+        path = Path(path).resolve()
+        # Only files under the storage root, whatever ".." or links the path holds
+        try:
+            entry = path.relative_to(TEMP_DOWNLOAD_DIR.resolve()).parts[0]
+        except (ValueError, IndexError):
+            raise HTTPException(status_code=403, detail="Path is outside temporary storage")
+        if not path.is_file():
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Schedule cleanup for temp files
-        if "temp_downloads" in str(path):
-            background_tasks.add_task(cleanup_file, path.parent)
+        # Keep the file for resumed (Range) requests; the storage sweeper removes it afterwards
+        await asyncio.get_running_loop().run_in_executor(
+            None, storage.retain, TEMP_DOWNLOAD_DIR / entry, SERVE_GRACE_SECONDS
+        )
         
         # Determine media type
         if path.suffix.lower() == '.mp3':
@@ -158,12 +727,13 @@ async def get_file(path: str, background_tasks: BackgroundTasks):
         else:
             media_type = 'audio/*'
         
-        return FileResponse(
+        return TimedFileResponse(
             path,
             media_type=media_type,
-            filename=path.name,
-            background=background_tasks
+            filename=path.name
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -175,8 +745,29 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": time.time()}
 
-# Cleanup on startup
+def background_init():
+    """Startup work that does not have to finish before the app serves requests"""
+    try:
+        result_cache.scan()
+        if WARMUP:
+            warm_up()
+    except Exception as e:
+        print(f"Background initialization failed: {e}")
+
+# Heavy initialization runs in the background so cold starts and health checks stay fast
 @app.on_event("startup")
 async def startup_event():
-    cleanup_temp_files()
-    print("YouTube Audio Downloader API started successfully!")
\ No newline at end of file
+    storage.start()
+    job_queue.start()
+    preset_profiler.start()
+    cluster.start()
+    asyncio.get_running_loop().run_in_executor(None, background_init)
+    print("YouTube Audio Downloader API started successfully!")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    job_queue.stop()
+    storage.stop()
+    cluster.stop()
+    shutdown_executors()
+    ydl_pool.close()
\ No newline at end of file
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Cache of raw yt-dlp extractions per video ID, so /info and the download after it extract once.
+"""
+
+import collections
+import copy
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from metrics import span
+from singleflight import SingleFlight
+from ydl_pool import ydl_pool
+
+METADATA_TTL = int(os.environ.get("METADATA_TTL", 1800))
+METADATA_MAX_ENTRIES = int(os.environ.get("METADATA_MAX_ENTRIES", 512))
+# Drop entries this long before their stream URLs stop working
+URL_EXPIRY_MARGIN = 300
+
+# Extractions are deduplicated within the process; another process's result is not shared anyway
+info_flight = SingleFlight(lock_dir=None)
+
+PROBE_OPTS = {
+    "noplaylist": True,
+    "quiet": True,
+    "no_warnings": True,
+}
+
+def _url_expiry(info):
+    """Earliest ``expire=`` timestamp among the format URLs (YouTube signs them), or None"""
+    expiries = []
+    for fmt in info.get("formats") or [info]:
+        values = parse_qs(urlparse(fmt.get("url") or "").query).get("expire")
+        if values and values[0].isdigit():
+            expiries.append(int(values[0]))
+    return min(expiries) if expiries else None
+
+def estimated_size(fmt, duration=None, bitrate=None):
+    """File size in bytes from the format's reported size, or bitrate x duration"""
+    if bitrate is None:
+        size = fmt.get("filesize") or fmt.get("filesize_approx")
+        if size:
+            return int(size)
+        kbps = fmt.get("abr") or fmt.get("tbr")
+    else:
+        kbps = bitrate
+    if kbps and duration:
+        return int(kbps * 1000 / 8 * duration)
+    return None
+
+class MetadataCache:
+    """TTL + LRU cache of raw extraction results, keyed by ``key_func(url)`` (the video ID)"""
+
+    def __init__(self, key_func, ttl=METADATA_TTL, max_entries=METADATA_MAX_ENTRIES):
+        self.key_func = key_func
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # video id -> (expires_at, info); ordered oldest access first
+        self._entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _extract(self, url):
+        with span("metadata"), ydl_pool.lease(PROBE_OPTS) as ydl:
+            return ydl.extract_info(url, download=False, process=False)
+
+    def _store(self, video_id, info):
+        now = time.time()
+        expires_at = now + self.ttl
+        url_expiry = _url_expiry(info)
+        if url_expiry:
+            expires_at = min(expires_at, url_expiry - URL_EXPIRY_MARGIN)
+        if expires_at <= now:
+            return
+        with self._lock:
+            self._entries[video_id] = (expires_at, info)
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # ---- public API ----
+    def lookup(self, url):
+        """Return ``(info, cached)`` with a private copy of the raw extraction result"""
+        video_id = self.key_func(url)
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[video_id]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(video_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            info, cached = entry[1], True
+        else:
+            # Concurrent lookups of the same video share one extraction
+            info = info_flight.do(video_id, lambda hook: self._extract(url))
+            self._store(video_id, info)
+            cached = False
+        # process_ie_result mutates the dict it is given
+        return copy.deepcopy(info), cached
+
+    def info(self, url):
+        return self.lookup(url)[0]
+
+    def invalidate(self, url):
+        with self._lock:
+            self._entries.pop(self.key_func(url), None)
+
+    def process(self, ydl, url, download=True):
+        """``ydl.process_ie_result`` on the cached extraction of ``url``.
+
+        If the cached stream URLs are rejected (expired early, different IP),
+        the entry is dropped and the download retried once on a fresh extraction.
+        """
+        from yt_dlp.utils import DownloadError
+
+        info, cached = self.lookup(url)
+        try:
+            return ydl.process_ie_result(info, download=download)
+        except DownloadError:
+            if not cached:
+                raise
+            print("Cached metadata rejected, extracting again")
+            self.invalidate(url)
+            return ydl.process_ie_result(self.info(url), download=download)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""Prometheus metrics for ``GET /metrics`` and per-job timing spans.
+
+Stages: speedtest, metadata, download, stream, transcode, serve, cleanup, warmup.
+"""
+
+import contextlib
+import contextvars
+import json
+import math
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Seconds of audio encoded per wall-clock second
+RTF_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: str(item[0]))
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_sample(self, key, state):
+        lines = [
+            f"{self.name}_bucket{_format_labels(key + (('le', _format_value(float(bound))),))} {count}"
+            for bound, count in zip(self.buckets, state["counts"])
+        ]
+        lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {state['count']}")
+        return lines
+
+class Registry:
+    """Metrics plus collectors that read other components' stats at scrape time"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, func):
+        """Register ``func() -> [(name, type, help, labels_dict, value), ...]``"""
+        with self._lock:
+            self._collectors.append(func)
+        return func
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        families = {}
+        for func in collectors:
+            try:
+                samples = list(func())
+            except Exception as e:
+                print(f"Metrics collector {getattr(func, '__name__', func)} failed: {e}")
+                continue
+            for name, type_, help, labels, value in samples:
+                if value is None:
+                    continue
+                family = families.setdefault(name, {"type": type_, "help": help, "samples": []})
+                family["samples"].append((tuple(sorted(labels.items())), value))
+        for name, family in families.items():
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for key, value in family["samples"]:
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "ytaudio_stage_seconds", "Time spent per processing stage", ["stage"]
+)
+STAGE_IN_PROGRESS = registry.gauge(
+    "ytaudio_stage_in_progress", "Operations currently in each stage", ["stage"]
+)
+STAGE_ERRORS = registry.counter(
+    "ytaudio_stage_errors_total", "Failed operations per stage and exception type", ["stage", "error"]
+)
+BYTES_TRANSFERRED = registry.counter(
+    "ytaudio_bytes_total", "Bytes downloaded from sources and served to clients", ["direction"]
+)
+TRANSCODE_RTF = registry.histogram(
+    "ytaudio_transcode_realtime_factor", "Seconds of audio converted per second of ffmpeg time",
+    ["mode"], buckets=RTF_BUCKETS
+)
+QUEUE_WAIT = registry.histogram(
+    "ytaudio_queue_wait_seconds", "Time work waited before starting", ["queue"]
+)
+POOL_TASKS = registry.gauge(
+    "ytaudio_pool_tasks", "Tasks on the worker pools, waiting or running", ["pool", "state"]
+)
+HTTP_REQUESTS = registry.counter(
+    "ytaudio_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+HTTP_IN_PROGRESS = registry.gauge(
+    "ytaudio_http_requests_in_progress", "HTTP requests being handled"
+)
+
+# ---- per-job traces ----
+class Trace:
+    """Stage timings collected for one job"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def summary(self):
+        """Total seconds per stage, plus the individual spans"""
+        with self._lock:
+            spans = [dict(span) for span in self.spans]
+        stages = {}
+        for span in spans:
+            stages[span["stage"]] = round(stages.get(span["stage"], 0.0) + span["seconds"], 3)
+        return {
+            "name": self.name,
+            "total_seconds": round(time.time() - self.started_at, 3),
+            "stages": stages,
+            "spans": spans,
+        }
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+def current_trace():
+    return _current_trace.get()
+
+@contextlib.contextmanager
+def trace(name):
+    """Collect the spans of one job; nested calls join the outer trace.
+
+    The outermost trace logs its summary as a JSON line when it ends.
+    """
+    existing = _current_trace.get()
+    if existing is not None:
+        yield existing
+        return
+    job_trace = Trace(name)
+    token = _current_trace.set(job_trace)
+    try:
+        yield job_trace
+    finally:
+        _current_trace.reset(token)
+        print(f"Timings: {json.dumps(job_trace.summary())}")
+
+@contextlib.contextmanager
+def span(stage, **attributes):
+    """Time a stage; yields the span record (``seconds`` is filled in on exit)"""
+    record = {"stage": stage, "started_at": round(time.time(), 3), **attributes}
+    STAGE_IN_PROGRESS.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        STAGE_ERRORS.inc(stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        record["seconds"] = round(elapsed, 3)
+        STAGE_IN_PROGRESS.dec(stage=stage)
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        job_trace = _current_trace.get()
+        if job_trace is not None:
+            job_trace.add(record)
+
+def record_wait(queue, seconds):
+    """Record time spent waiting in ``queue`` (also as a ``queue_wait`` span of the current trace)"""
+    seconds = max(seconds, 0.0)
+    QUEUE_WAIT.observe(seconds, queue=queue)
+    job_trace = _current_trace.get()
+    if job_trace is not None:
+        job_trace.add({"stage": "queue_wait", "queue": queue, "seconds": round(seconds, 3)})
+
+def record_transcode(media_seconds, wall_seconds, mode):
+    """Observe the real-time factor of an encode, when both durations are known"""
+    if media_seconds and wall_seconds > 0:
+        TRANSCODE_RTF.observe(media_seconds / wall_seconds, mode=mode)
+
+def make_byte_counter():
+    """yt-dlp progress hook that adds downloaded bytes to ``ytaudio_bytes_total``"""
+    seen = {}
+
+    def progress_hook(progress):
+        if progress.get("status") not in ("downloading", "finished"):
+            return
+        downloaded = progress.get("downloaded_bytes")
+        if downloaded is None:
+            return
+        name = progress.get("tmpfilename") or progress.get("filename")
+        delta = downloaded - seen.get(name, 0)
+        seen[name] = downloaded
+        if delta > 0:
+            BYTES_TRANSFERRED.inc(delta, direction="downloaded")
+
+    return progress_hook
+
+def stats_samples(prefix, stats, help, counters=()):
+    """Turn a component's ``stats()`` dict into collector samples (numeric values only)
+
+    Keys listed in ``counters`` are exported as counters (``<prefix>_<key>_total``), the rest as gauges.
+    """
+    samples = []
+    for key, value in stats.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            continue
+        if key in counters:
+            samples.append((f"{prefix}_{key}_total", "counter", f"{help}: {key}", {}, value))
+        else:
+            samples.append((f"{prefix}_{key}", "gauge", f"{help}: {key}", {}, value))
+    return samples
+
+class RequestMetricsMiddleware:
+    """ASGI middleware counting HTTP requests by route template and status"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            # The router stores the matched route in the scope; templates keep label cardinality low
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(method=scope["method"], route=route, status=str(status["code"]))
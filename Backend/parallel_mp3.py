@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""Parallel MP3 encoding for long audio: encode chunks in separate ffmpeg processes and join them gaplessly.
+
+Chunks are cut on the MP3 frame grid with pre-roll and post-roll frames, encoded
+without the bit reservoir, and the Info/LAME tag is rewritten for the joined file.
+
+    PARALLEL_MP3             - split long MP3 encodes across cores (default 1)
+    PARALLEL_MP3_MIN_SECONDS - shortest audio worth splitting (default 600)
+"""
+
+import concurrent.futures
+import mmap
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+
+from executors import TRANSCODE_WORKERS, transcode_slot
+from formats import TARGETS
+from metrics import record_transcode, span
+
+PARALLEL_MP3 = os.environ.get("PARALLEL_MP3", "1") == "1"
+PARALLEL_MP3_MIN_SECONDS = float(os.environ.get("PARALLEL_MP3_MIN_SECONDS", 600))
+# Chunks shorter than this cost more in pre-roll and process start-up than they save
+MIN_CHUNK_SECONDS = 30
+
+FRAME_SAMPLES = 1152
+# Decoded sample d of a LAME stream is source sample d - STREAM_DELAY
+STREAM_DELAY = 576 + 529
+PREROLL_FRAMES = 3
+POSTROLL_FRAMES = 2
+# MPEG-1 Layer III; lower sample rates use MPEG-2 frames of a different size
+MPEG1_RATES = {44100: 0, 48000: 1, 32000: 2}
+MPEG1_L3_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+PCM_BLOCK = 1024 * 1024
+COPY_BLOCK = 1024 * 1024
+
+class ParallelEncodeError(RuntimeError):
+    """The chunked encode could not produce a valid file; encode in one pass instead"""
+
+def worth_splitting(target, duration, workers=TRANSCODE_WORKERS):
+    """True if a ``target`` encode of ``duration`` seconds should use ``encode_parallel``"""
+    return (
+        PARALLEL_MP3 and workers >= 2 and target in TARGETS and TARGETS[target]["encoder"] == "libmp3lame"
+        and bool(duration) and duration >= PARALLEL_MP3_MIN_SECONDS
+    )
+
+# ---- CRC-16/ARC ----
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC16_TABLE = _crc16_table()
+
+def crc16(data, crc=0, table=CRC16_TABLE):
+    """CRC-16/ARC, as used by the LAME tag"""
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+# CRC-16/ARC has no initial value or final XOR, so it is linear over GF(2):
+# crc(a + b) == crc16_shift(crc(a), len(b)) ^ crc(b). The 16x16 bit matrices
+# below (one column per input bit) advance or rewind a CRC over zero bytes.
+def _apply(matrix, vector):
+    result = 0
+    for column in matrix:
+        if vector & 1:
+            result ^= column
+        vector >>= 1
+    return result
+
+def _compose(a, b):
+    """Matrix of applying ``b`` and then ``a``"""
+    return [_apply(a, column) for column in b]
+
+def _invert(matrix):
+    """Inverse of an invertible 16x16 bit matrix (Gauss-Jordan on its rows)"""
+    rows = [sum(((matrix[col] >> row) & 1) << col for col in range(16)) | (1 << (16 + row)) for row in range(16)]
+    for col in range(16):
+        pivot = next(r for r in range(col, 16) if rows[r] >> col & 1)
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(16):
+            if r != col and rows[r] >> col & 1:
+                rows[r] ^= rows[col]
+    inverse_rows = [row >> 16 for row in rows]
+    return [sum(((inverse_rows[row] >> col) & 1) << row for row in range(16)) for col in range(16)]
+
+ZERO_BYTE = [crc16(b"\0", 1 << bit) for bit in range(16)]
+ZERO_BYTE_BACK = _invert(ZERO_BYTE)
+
+def crc16_shift(crc, count):
+    """CRC after ``count`` more zero bytes; a negative ``count`` removes trailing zero bytes"""
+    step = ZERO_BYTE if count >= 0 else ZERO_BYTE_BACK
+    count = abs(count)
+    while count:
+        if count & 1:
+            crc = _apply(step, crc)
+        count >>= 1
+        if count:
+            step = _compose(step, step)
+    return crc
+
+def crc16_trim(crc, prefix, suffix, kept_length):
+    """CRC of the middle part of ``prefix + middle + suffix`` from the CRC of the whole"""
+    middle_and_suffix = crc ^ crc16_shift(crc16(prefix), kept_length + len(suffix))
+    return crc16_shift(middle_and_suffix ^ crc16(suffix), -len(suffix))
+
+# ---- MP3 frame handling ----
+
+def skip_id3v2(data):
+    """Length of a leading ID3v2 tag (0 if there is none)"""
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def frame_length(header):
+    """Byte length of an MPEG-1 Layer III frame from its 4-byte header, or None if it is not one"""
+    if len(header) < 4:
+        return None
+    h = int.from_bytes(header[:4], "big")
+    # sync, MPEG-1, Layer III
+    if (h >> 21) & 0x7FF != 0x7FF or (h >> 19) & 3 != 3 or (h >> 17) & 3 != 1:
+        return None
+    bitrate_index, rate_index = (h >> 12) & 15, (h >> 10) & 3
+    if bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    rate = [44100, 48000, 32000][rate_index]
+    return 144 * MPEG1_L3_BITRATES[bitrate_index] * 1000 // rate + ((h >> 9) & 1)
+
+def side_info_size(frame):
+    return 17 if (frame[3] >> 6) == 3 else 32
+
+def main_data_begin(frame):
+    """Bytes of the bit reservoir this frame borrows from earlier frames"""
+    offset = 4 if frame[1] & 1 else 6  # protection bit clear -> 16-bit CRC follows the header
+    return (frame[offset] << 1) | (frame[offset + 1] >> 7)
+
+def split_frames(data):
+    """Byte ranges of consecutive MPEG audio frames in ``data`` (after any ID3v2 tag)"""
+    pos = skip_id3v2(data)
+    frames = []
+    while pos < len(data):
+        length = frame_length(data[pos:pos + 4])
+        if length is None:
+            if data[pos:pos + 3] == b"TAG":  # ID3v1 trailer
+                break
+            raise ParallelEncodeError(f"Unexpected bytes at offset {pos} in encoded chunk")
+        frames.append((pos, pos + length))
+        pos += length
+    return frames
+
+def info_tag_offset(frame):
+    """Offset of the "Info"/"Xing" tag inside a frame, or None"""
+    offset = 4 + side_info_size(frame)
+    return offset if frame[offset:offset + 4] in (b"Info", b"Xing") else None
+
+def lame_tag_offset(frame):
+    """Offset of the LAME extension behind the Info/Xing fields of a tag frame"""
+    pos = info_tag_offset(frame)
+    flags = struct.unpack(">I", frame[pos + 4:pos + 8])[0]
+    return pos + 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+
+def tag_music(frame):
+    """(music length, music CRC) recorded in a LAME tag frame"""
+    lame = lame_tag_offset(frame)
+    return struct.unpack(">IH", frame[lame + 28:lame + 34])
+
+def rewrite_info_tag(frame, audio_frames, audio_bytes, audio_crc, total_samples):
+    """Update an Info/LAME tag frame for the joined stream; returns the new frame bytes.
+
+    ``audio_frames`` is a list of frame lengths (without the tag frame).
+    """
+    frame = bytearray(frame)
+    pos = info_tag_offset(frame)
+    flags = struct.unpack(">I", frame[pos + 4:pos + 8])[0]
+    pos += 8
+    total_bytes = len(frame) + audio_bytes
+    if flags & 1:
+        struct.pack_into(">I", frame, pos, len(audio_frames))
+        pos += 4
+    if flags & 2:
+        struct.pack_into(">I", frame, pos, total_bytes)
+        pos += 4
+    if flags & 4:
+        # Seek table: byte position of each percent of the duration, scaled to 0-255
+        offsets = [len(frame)]
+        for length in audio_frames:
+            offsets.append(offsets[-1] + length)
+        for i in range(100):
+            position = offsets[min(len(audio_frames) * i // 100, len(audio_frames))]
+            frame[pos + i] = min(255, position * 256 // total_bytes)
+        pos += 100
+    if flags & 8:
+        pos += 4
+
+    lame = pos
+    delay = int.from_bytes(frame[lame + 21:lame + 24], "big") >> 12
+    padding = len(audio_frames) * FRAME_SAMPLES - total_samples - delay
+    if not 0 <= padding < 4096:
+        raise ParallelEncodeError(f"Joined stream has {padding} samples of padding")
+    frame[lame + 21:lame + 24] = ((delay << 12) | padding).to_bytes(3, "big")
+    struct.pack_into(">I", frame, lame + 28, total_bytes)
+    struct.pack_into(">H", frame, lame + 32, audio_crc)
+    struct.pack_into(">H", frame, lame + 34, crc16(frame[:lame + 34]))
+    return bytes(frame)
+
+# ---- PCM ----
+def read_wav_header(path):
+    """(sample_rate, channels, data_offset, data_bytes) of a PCM WAV file"""
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            raise ParallelEncodeError("Decoder did not produce a WAV file")
+        rate = channels = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ParallelEncodeError("WAV file has no data chunk")
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                channels, rate = struct.unpack("<HI", fmt[2:8])
+            elif chunk_id == b"data":
+                data_offset = f.tell()
+                data_bytes = os.path.getsize(path) - data_offset
+                return rate, channels, data_offset, data_bytes
+            else:
+                f.seek(size + (size & 1), 1)
+
+def decode_to_wav(src, wav_path):
+    """Decode the audio of ``src`` to 16-bit PCM WAV; returns ``read_wav_header`` of the result"""
+    with transcode_slot():
+        subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", "-i", str(src), "-vn", "-c:a", "pcm_s16le", str(wav_path)],
+            check=True, capture_output=True
+        )
+    return read_wav_header(wav_path)
+
+# ---- chunked encode ----
+def plan_chunks(total_samples, count):
+    """Split the output frame grid into ``count`` runs of frames: [(first_frame, end_frame), ...]"""
+    total_frames = -(-(total_samples + STREAM_DELAY) // FRAME_SAMPLES)
+    count = max(1, min(count, total_frames // (PREROLL_FRAMES + POSTROLL_FRAMES + 1)))
+    edges = [round(i * total_frames / count) for i in range(count + 1)]
+    return [(edges[i], edges[i + 1]) for i in range(count)]
+
+def _feed(stdin, wav_path, offset, length):
+    try:
+        with open(wav_path, "rb") as f:
+            f.seek(offset)
+            while length > 0:
+                block = f.read(min(PCM_BLOCK, length))
+                if not block:
+                    break
+                stdin.write(block)
+                length -= len(block)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            stdin.close()
+        except BrokenPipeError:
+            pass
+
+def encode_chunk(wav, index, first_frame, end_frame, last, codec_args, out_path, metadata_src=None):
+    """Encode the source samples behind output frames [first_frame, end_frame) plus pre/post-roll"""
+    rate, channels, data_offset, data_bytes = wav["rate"], wav["channels"], wav["offset"], wav["bytes"]
+    frame_bytes = 2 * channels
+    total_samples = data_bytes // frame_bytes
+    start = 0 if index == 0 else FRAME_SAMPLES * (first_frame - PREROLL_FRAMES)
+    end = total_samples if last else min(total_samples, FRAME_SAMPLES * (end_frame + POSTROLL_FRAMES))
+
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "s16le", "-ar", str(rate), "-ac", str(channels), "-i", "pipe:0"]
+    if index == 0 and metadata_src:
+        # Tags of the source go into the ID3 header, as in a single-pass encode
+        cmd += ["-i", str(metadata_src), "-map", "0:a", "-map_metadata", "1"]
+    cmd += [*codec_args, "-reservoir", "0"]
+    if index > 0:
+        # The Info tag stays: its music CRC saves hashing the chunk when joining
+        cmd += ["-id3v2_version", "0"]
+    cmd += ["-f", "mp3", str(out_path)]
+
+    with transcode_slot():
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        feeder = threading.Thread(
+            target=_feed,
+            args=(proc.stdin, wav["path"], data_offset + start * frame_bytes, (end - start) * frame_bytes),
+            daemon=True
+        )
+        feeder.start()
+        stderr = proc.stderr.read()
+        returncode = proc.wait()
+        feeder.join()
+    if returncode != 0:
+        raise ParallelEncodeError(f"Chunk {index} encode failed: {stderr.decode(errors='replace').strip()[-500:]}")
+    return out_path
+
+def scan_chunk(data, index, first_frame, end_frame):
+    """Kept byte range of one mapped chunk, its frame lengths and the CRC of the kept frames"""
+    frames = split_frames(data)
+    if not frames or info_tag_offset(data[frames[0][0]:frames[0][1]]) is None:
+        raise ParallelEncodeError(f"Chunk {index} has no Info tag")
+    tag = data[frames[0][0]:frames[0][1]]
+    audio = frames[1:]
+    skip = 0 if index == 0 else PREROLL_FRAMES
+    wanted = end_frame - first_frame
+    selected = audio[skip:skip + wanted]
+    if len(selected) != wanted:
+        raise ParallelEncodeError(f"Chunk {index} produced {len(audio)} frames, expected {skip + wanted}+")
+    if main_data_begin(data[selected[0][0]:selected[0][1]]):
+        raise ParallelEncodeError(f"Chunk {index} starts with a frame that uses the bit reservoir")
+
+    start, end = selected[0][0], selected[-1][1]
+    audio_start, audio_end = audio[0][0], audio[-1][1]
+    music_length, music_crc = tag_music(tag)
+    if music_length == len(tag) + audio_end - audio_start:
+        crc = crc16_trim(music_crc, data[audio_start:start], data[end:audio_end], end - start)
+    else:
+        # Tag not finalized by the muxer: hash the kept frames instead
+        crc = crc16(data[start:end])
+    return tag, (start, end), [e - s for s, e in selected], crc
+
+def join_chunks(parts, chunks, total_samples, out_path):
+    """Concatenate the kept frames of each chunk behind the first chunk's ID3 and rewritten Info tag"""
+    head = tag_frame = None
+    runs = []
+    lengths = []
+    crc = 0
+    # Pass 1: frame offsets and CRCs; the chunks are mapped, not read into memory
+    for index, (part, (first_frame, end_frame)) in enumerate(zip(parts, chunks)):
+        with open(part, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            tag, (start, end), frame_lengths, kept_crc = scan_chunk(data, index, first_frame, end_frame)
+            if index == 0:
+                head = data[:skip_id3v2(data)]
+                tag_frame = tag
+        crc = crc16_shift(crc, end - start) ^ kept_crc
+        lengths.extend(frame_lengths)
+        runs.append((part, start, end))
+
+    # Pass 2: copy the kept range of each chunk
+    tmp = Path(out_path).with_name(Path(out_path).name + ".joining")
+    with open(tmp, "wb") as out:
+        out.write(head)
+        out.write(rewrite_info_tag(tag_frame, lengths, sum(lengths), crc, total_samples))
+        for part, start, end in runs:
+            with open(part, "rb") as f:
+                f.seek(start)
+                remaining = end - start
+                while remaining:
+                    block = f.read(min(COPY_BLOCK, remaining))
+                    if not block:
+                        raise ParallelEncodeError(f"{part} shrank while joining")
+                    out.write(block)
+                    remaining -= len(block)
+    os.replace(tmp, out_path)
+
+def encode_parallel(src, out_path, codec_args, workers=TRANSCODE_WORKERS, media_seconds=None, chunks=None):
+    """Encode ``src`` to an MP3 at ``out_path`` with up to ``workers`` encoder processes.
+
+    Raises ``ParallelEncodeError`` when the source or the chunk output does not
+    allow a gapless join; the caller should then encode in one pass.
+    """
+    src, out_path = Path(src), Path(out_path)
+    work = Path(tempfile.mkdtemp(prefix=".parallel-", dir=out_path.parent))
+    try:
+        with span("transcode") as record:
+            wav_path = work / "source.wav"
+            rate, channels, offset, data_bytes = decode_to_wav(src, wav_path)
+            if rate not in MPEG1_RATES or channels not in (1, 2):
+                raise ParallelEncodeError(f"Cannot split {channels}-channel {rate} Hz audio")
+            total_samples = data_bytes // (2 * channels)
+            wav = {"path": wav_path, "rate": rate, "channels": channels, "offset": offset, "bytes": data_bytes}
+
+            if chunks is None:
+                chunks = min(workers, max(1, total_samples // (MIN_CHUNK_SECONDS * rate)))
+            plan = plan_chunks(total_samples, chunks)
+            print(f"Encoding MP3 in {len(plan)} chunks on up to {workers} cores")
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(plan)) as pool:
+                futures = [
+                    pool.submit(
+                        encode_chunk, wav, i, first, end, i == len(plan) - 1, codec_args,
+                        work / f"chunk{i:03d}.mp3", src if i == 0 else None
+                    )
+                    for i, (first, end) in enumerate(plan)
+                ]
+                parts = [future.result() for future in futures]
+            join_chunks(parts, plan, total_samples, out_path)
+        record_transcode(media_seconds or total_samples / rate, record["seconds"], "parallel")
+    except subprocess.CalledProcessError as e:
+        raise ParallelEncodeError(f"Decoding failed: {e.stderr.decode(errors='replace').strip()[-500:]}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return out_path
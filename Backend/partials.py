@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""SQLite index of partially downloaded files, so interrupted downloads can resume safely.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from storage import STATE_DIR
+
+PARTIALS_DB = Path(os.environ.get("PARTIALS_DB", STATE_DIR / "partials.sqlite3"))
+# Partials untouched for this long are abandoned and may be cleaned up
+PARTIAL_RETENTION = float(os.environ.get("PARTIAL_RETENTION", 24 * 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partials (
+    video_id TEXT NOT NULL,
+    format_id TEXT NOT NULL,
+    work_dir TEXT NOT NULL,
+    part_file TEXT,
+    downloaded_bytes INTEGER NOT NULL DEFAULT 0,
+    total_bytes INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (video_id, format_id, work_dir)
+);
+CREATE INDEX IF NOT EXISTS idx_partials_dir ON partials (work_dir);
+"""
+
+def _dir_key(work_dir):
+    return str(Path(work_dir).resolve())
+
+class PartialIndex:
+    """Persistent record of in-progress downloads and their partial files"""
+
+    def __init__(self, db_path=PARTIALS_DB, retention=PARTIAL_RETENTION):
+        self.db_path = Path(db_path)
+        self.retention = retention
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        with self._init_lock:
+            if not self._initialized:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(SCHEMA)
+                conn.close()
+                self._initialized = True
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    # ---- public API ----
+    def pending(self, work_dir, video_id=None):
+        """Partials recorded for ``work_dir`` (optionally only for one video)"""
+        query = "SELECT * FROM partials WHERE work_dir = ?"
+        params = [_dir_key(work_dir)]
+        if video_id is not None:
+            query += " AND video_id = ?"
+            params.append(video_id)
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def select(self, work_dir, video_id, format_id):
+        """Record that ``format_id`` is about to be downloaded into ``work_dir``.
+
+        Partials of other formats of the same video in that directory are
+        deleted so yt-dlp cannot resume the wrong file.
+        """
+        now = time.time()
+        work_dir = _dir_key(work_dir)
+        with self._connect() as conn:
+            stale = conn.execute(
+                "SELECT format_id, part_file FROM partials WHERE work_dir = ? AND video_id = ? AND format_id != ?",
+                (work_dir, video_id, format_id)
+            ).fetchall()
+            for row in stale:
+                if row["part_file"]:
+                    with contextlib.suppress(OSError):
+                        os.remove(row["part_file"])
+                print(f"Discarded partial download of format {row['format_id']}")
+            conn.execute(
+                "DELETE FROM partials WHERE work_dir = ? AND video_id = ? AND format_id != ?",
+                (work_dir, video_id, format_id)
+            )
+            conn.execute(
+                "INSERT INTO partials (video_id, format_id, work_dir, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (video_id, format_id, work_dir) DO UPDATE SET updated_at = excluded.updated_at",
+                (video_id, format_id, work_dir, now, now)
+            )
+
+    def make_progress_hook(self, work_dir, video_id):
+        """yt-dlp progress hook that keeps the partial's byte count current"""
+        work_dir = _dir_key(work_dir)
+        state = {"last": 0.0}
+
+        def progress_hook(progress):
+            now = time.time()
+            status = progress.get("status")
+            # Throttle database writes to about one per second
+            if status == "downloading" and now - state["last"] < 1.0:
+                return
+            state["last"] = now
+            format_id = (progress.get("info_dict") or {}).get("format_id")
+            if not format_id:
+                return
+            part_file = progress.get("tmpfilename") or progress.get("filename")
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE partials SET part_file = ?, downloaded_bytes = ?, total_bytes = ?, updated_at = ? "
+                    "WHERE work_dir = ? AND video_id = ? AND format_id = ?",
+                    (
+                        part_file,
+                        progress.get("downloaded_bytes") or 0,
+                        progress.get("total_bytes") or progress.get("total_bytes_estimate"),
+                        now, work_dir, video_id, format_id
+                    )
+                )
+
+        return progress_hook
+
+    def complete(self, work_dir, video_id):
+        """Forget the partials of a finished download"""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM partials WHERE work_dir = ? AND video_id = ?",
+                (_dir_key(work_dir), video_id)
+            )
+
+    def active_dirs(self):
+        """Work directories holding partials that may still be resumed; older records are dropped"""
+        cutoff = time.time() - self.retention
+        with self._connect() as conn:
+            conn.execute("DELETE FROM partials WHERE updated_at < ?", (cutoff,))
+            rows = conn.execute("SELECT DISTINCT work_dir FROM partials").fetchall()
+        return {Path(row["work_dir"]) for row in rows}
+
+# Process-wide index shared by the API, job workers and the GUI
+partial_index = PartialIndex()
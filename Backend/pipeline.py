@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""Streaming download -> ffmpeg pipeline: encode while the source is still downloading.
+"""
+
+import concurrent.futures
+import os
+import struct
+import subprocess
+import threading
+import time
+
+from executors import StreamBuffer, transcode_slot
+from metrics import BYTES_TRANSFERRED, span
+
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAMABLE_PROTOCOLS = ("http", "https")
+# Minimum seconds between progress reports
+PROGRESS_INTERVAL = 0.1
+# Downloaded bytes collected before a transcode slot is taken to feed them to ffmpeg
+FEED_BYTES = 1024 * 1024
+# Encoded chunks buffered per live stream before ffmpeg is paused
+LIVE_BUFFER_CHUNKS = int(os.environ.get("LIVE_BUFFER_CHUNKS", 16))
+
+class TranscodeError(RuntimeError):
+    """ffmpeg failed while consuming a stream"""
+
+def is_streamable(info):
+    """True if the selected format is a single direct HTTP(S) download"""
+    return (
+        info.get("protocol") in STREAMABLE_PROTOCOLS
+        and bool(info.get("url"))
+        and not info.get("requested_formats")
+    )
+
+def _report(hooks, status, info, filename, downloaded, total, start):
+    """Call progress hooks with a dict shaped like yt-dlp's own progress reports"""
+    from yt_dlp.downloader.common import FileDownloader
+
+    now = time.time()
+    speed = FileDownloader.calc_speed(start, now, downloaded)
+    eta = FileDownloader.calc_eta(speed, total - downloaded) if total and speed else None
+    percent = FileDownloader.calc_percent(downloaded, total) if status == "downloading" else 100.0
+    progress = {
+        "status": status,
+        "filename": filename,
+        "info_dict": info,
+        "downloaded_bytes": downloaded,
+        "total_bytes": total,
+        "elapsed": now - start,
+        "speed": speed,
+        "eta": eta,
+        "_percent_str": FileDownloader.format_percent(percent),
+        "_speed_str": FileDownloader.format_speed(speed),
+        "_eta_str": FileDownloader.format_eta(eta),
+    }
+    for hook in hooks:
+        hook(progress)
+
+def iter_source(ydl, info, progress_hooks=(), filename=None):
+    """Yield the selected format's bytes as they arrive, reporting progress along the way.
+
+    Formats that carry an ``http_chunk_size`` (YouTube throttles long unranged
+    reads) are fetched as consecutive Range requests.
+    """
+    from yt_dlp.networking import Request
+    from yt_dlp.networking.exceptions import HTTPError
+
+    url = info["url"]
+    headers = info.get("http_headers") or {}
+    total = info.get("filesize") or info.get("filesize_approx")
+    range_size = (info.get("downloader_options") or {}).get("http_chunk_size")
+
+    start = time.time()
+    downloaded = 0
+    last_report = 0.0
+    while True:
+        request_headers = dict(headers)
+        if range_size:
+            request_headers["Range"] = f"bytes={downloaded}-{downloaded + range_size - 1}"
+        try:
+            response = ydl.urlopen(Request(url, headers=request_headers))
+        except HTTPError as e:
+            # Asked for a range past the end of a file of unknown size
+            if e.status == 416 and downloaded:
+                break
+            raise
+
+        received = 0
+        try:
+            while True:
+                data = response.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                downloaded += len(data)
+                received += len(data)
+                yield data
+
+                now = time.time()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    last_report = now
+                    _report(progress_hooks, "downloading", info, filename, downloaded, total, start)
+        finally:
+            response.close()
+
+        if not range_size or response.status != 206 or received < range_size:
+            break
+        if total and downloaded >= total:
+            break
+
+    _report(progress_hooks, "finished", info, filename, downloaded, total or downloaded, start)
+
+def pipe_compatible(head):
+    """False for MP4/M4A files whose index (moov) comes after the media data.
+
+    ffmpeg cannot seek back to read such an index from a pipe. YouTube serves
+    fragmented MP4 with moov up front, which streams fine.
+    """
+    if head[4:8] != b"ftyp":
+        return True
+    offset = 0
+    while offset + 8 <= len(head):
+        size = struct.unpack(">I", head[offset:offset + 4])[0]
+        box_type = head[offset + 4:offset + 8]
+        if box_type == b"moov":
+            return True
+        if box_type == b"mdat" or size < 8:
+            return False
+        offset += size
+    return False
+
+def _drain(stream, sink):
+    for line in iter(stream.readline, b""):
+        sink.append(line)
+    stream.close()
+
+def open_source(ydl, info, progress_hooks=(), filename=None):
+    """Start reading the source and check it can be piped; returns (first chunk, rest)"""
+    source = iter_source(ydl, info, progress_hooks, filename=filename)
+    head = next(source, b"")
+    if not pipe_compatible(head):
+        source.close()
+        raise TranscodeError("container index is at the end of the file; cannot transcode from a pipe")
+    return head, source
+
+def transcode_stream(ydl, info, output_path, codec_args, progress_hooks=()):
+    """Download the selected format and encode it to ``output_path`` in one pass"""
+    head, source = open_source(ydl, info, progress_hooks, filename=str(output_path))
+
+    cmd = [
+        "ffmpeg", "-y",
+        "-loglevel", "error",
+        "-xerror",
+        "-i", "pipe:0",
+        "-vn",
+        *codec_args,
+        str(output_path)
+    ]
+
+    stderr = []
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    reader = threading.Thread(target=_drain, args=(proc.stderr, stderr), daemon=True)
+    reader.start()
+
+    def feed(chunks):
+        # ffmpeg only has work while it is being fed: hold a slot for that, not for the network waits
+        with transcode_slot():
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+
+    try:
+        try:
+            pending, pending_bytes = [head], len(head)
+            for chunk in source:
+                pending.append(chunk)
+                pending_bytes += len(chunk)
+                if pending_bytes >= FEED_BYTES:
+                    feed(pending)
+                    pending, pending_bytes = [], 0
+            feed(pending)
+        except BrokenPipeError:
+            # ffmpeg exited early; its stderr explains why
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        # Encoding the tail after the last feed
+        with transcode_slot():
+            returncode = proc.wait()
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        # Also stops the download when ffmpeg gave up early
+        source.close()
+        reader.join(timeout=5)
+
+    if returncode != 0:
+        message = b"".join(stderr[-10:]).decode(errors="replace").strip()
+        raise TranscodeError(f"ffmpeg exited with {returncode}: {message}")
+    return output_path
+
+class LiveTranscode:
+    """Download + encode in a worker thread, exposing ffmpeg's stdout as a bounded chunk queue.
+
+    The queue is the only buffer between ffmpeg and the HTTP client: when the
+    client reads slowly the queue fills, ffmpeg blocks on its stdout, and the
+    download in turn blocks on ffmpeg's stdin. ``cancel`` kills ffmpeg and
+    stops the download. A failure after the stream started is raised from
+    ``iter_chunks``, so the server aborts the response instead of ending it
+    like a complete file.
+    """
+
+    _EOF = object()
+
+    def __init__(self, ydl, info, codec_args, output_format="mp3", progress_hooks=(),
+                 max_chunks=LIVE_BUFFER_CHUNKS, release=None):
+        self.ydl = ydl
+        # Called with the YoutubeDL once the stream is done (e.g. to return it to a pool)
+        self.release = release or (lambda ydl: ydl.close())
+        self.info = info
+        self.codec_args = codec_args
+        self.output_format = output_format
+        self.progress_hooks = list(progress_hooks)
+        self.chunks = StreamBuffer(max_chunks)
+        # Resolves once the source has been checked and ffmpeg is running
+        self.ready = concurrent.futures.Future()
+        self.cancelled = threading.Event()
+        self.proc = None
+
+    def _put(self, item):
+        """Blocking put that gives up once the stream is cancelled"""
+        return self.chunks.put(item)
+
+    def _pump_stdout(self):
+        while True:
+            data = self.proc.stdout.read(STREAM_CHUNK_SIZE)
+            if not data or not self._put(data):
+                break
+
+    def _check_cancelled(self, progress):
+        if self.cancelled.is_set():
+            raise TranscodeError("Client disconnected")
+
+    def run(self):
+        """Blocking body, meant for an executor thread"""
+        try:
+            try:
+                head, source = open_source(self.ydl, self.info, [self._check_cancelled, *self.progress_hooks])
+            except BaseException as e:
+                self.ready.set_exception(e)
+                return
+            if self.cancelled.is_set():
+                # Cancelled while the source was opening: do not start ffmpeg at all
+                source.close()
+                self.ready.set_exception(TranscodeError("Client disconnected"))
+                return
+
+            cmd = [
+                "ffmpeg", "-y",
+                "-loglevel", "error",
+                "-xerror",
+                "-i", "pipe:0",
+                "-vn",
+                *self.codec_args,
+                "-f", self.output_format,
+                "pipe:1"
+            ]
+            with transcode_slot(), span("stream"):
+                self.proc = subprocess.Popen(
+                    cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                )
+                stderr = []
+                threading.Thread(target=_drain, args=(self.proc.stderr, stderr), daemon=True).start()
+                pump = threading.Thread(target=self._pump_stdout, daemon=True)
+                pump.start()
+                self.ready.set_result(True)
+
+                error = None
+                try:
+                    self.proc.stdin.write(head)
+                    for chunk in source:
+                        self.proc.stdin.write(chunk)
+                except BrokenPipeError:
+                    pass
+                except Exception as e:
+                    error = e
+                finally:
+                    source.close()
+                    try:
+                        self.proc.stdin.close()
+                    except BrokenPipeError:
+                        pass
+
+                if error is not None or self.cancelled.is_set():
+                    self.proc.kill()
+                returncode = self.proc.wait()
+                pump.join()
+
+            if error is None and returncode != 0 and not self.cancelled.is_set():
+                message = b"".join(stderr[-10:]).decode(errors="replace").strip()
+                error = TranscodeError(f"ffmpeg exited with {returncode}: {message}")
+            if error is not None and not self.cancelled.is_set():
+                print(f"Live transcode failed: {error}")
+                self._put(error)
+            self._put(self._EOF)
+        finally:
+            self.release(self.ydl)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.chunks.close()
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+
+    async def iter_chunks(self):
+        """Async iterator over encoded bytes; cancels the transcode if the consumer stops early"""
+        try:
+            while True:
+                item = await self.chunks.get(default=self._EOF)
+                if item is self._EOF:
+                    break
+                if isinstance(item, Exception):
+                    # Headers are already sent: abort the connection so the client sees a failed transfer
+                    raise item
+                BYTES_TRANSFERRED.inc(len(item), direction="served")
+                yield item
+        finally:
+            self.cancel()
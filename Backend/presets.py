@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Encode cost per preset, and the preset a request gets when it names none.
+
+The cheapest measured preset of a tier is recorded once in PRESET_CHOICES_FILE and never revised.
+
+    PRESET_PROFILE         - profile presets in the background at startup (default 0)
+    PRESET_PROFILE_SECONDS - length of the generated clip (default 20)
+    PRESET_CLIENT_MBPS     - client bandwidth assumed for the delivery cost (default 8)
+    PRESET_QUALITY         - tier used when a request names neither preset nor quality (default high)
+    PRESET_CHOICES_FILE    - recorded choices, shared by all workers (default: yt_audio_presets.json in the temp dir)
+
+``python presets.py`` profiles every preset, records the choices and prints the table.
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows - choices are still recorded, without the cross-process lock
+    fcntl = None
+
+from executors import transcode_slot
+from formats import PRESETS, QUALITIES, TARGETS, encoder_args
+
+PRESET_PROFILE = os.environ.get("PRESET_PROFILE", "0") == "1"
+PRESET_PROFILE_SECONDS = float(os.environ.get("PRESET_PROFILE_SECONDS", 20))
+PRESET_CLIENT_MBPS = float(os.environ.get("PRESET_CLIENT_MBPS", 8))
+PRESET_QUALITY = os.environ.get("PRESET_QUALITY", "high")
+PRESET_CHOICES_FILE = Path(
+    os.environ.get("PRESET_CHOICES_FILE", Path(tempfile.gettempdir()) / "yt_audio_presets.json")
+)
+# Weight of a new measurement in the moving averages
+EWMA_ALPHA = 0.2
+
+# Music-like test signal: two sweeping tones over pink noise
+PROFILE_SOURCE = (
+    "aevalsrc=0.3*sin(2*PI*(220+30*t)*t)+0.2*sin(2*PI*(660-20*t)*t)"
+    "|0.3*sin(2*PI*(330+20*t)*t)+0.2*sin(2*PI*(880-25*t)*t):s=48000"
+)
+
+def meets(quality, requested):
+    """True if tier ``quality`` is at least as good as ``requested``"""
+    return QUALITIES.index(quality) <= QUALITIES.index(requested)
+
+def candidates(target=None, quality=None):
+    """Presets producing ``target`` (any target if None) at ``quality`` or better"""
+    quality = quality or PRESET_QUALITY
+    if quality not in QUALITIES:
+        raise ValueError(f"Unknown quality: {quality} (expected one of {', '.join(QUALITIES)})")
+    return [
+        name for name, spec in PRESETS.items()
+        if (target is None or spec["target"] == target) and meets(spec["quality"], quality)
+    ]
+
+def pinned_preset(target=None, quality=None):
+    """Preset of a tier before its choice is recorded: the target's default if of that tier, else the lowest bitrate"""
+    names = candidates(target, quality)
+    default = TARGETS[target]["preset"] if target else None
+    if default in names and PRESETS[default]["quality"] == (quality or PRESET_QUALITY):
+        return default
+    return min(names, key=lambda name: PRESETS[name]["kbps"])
+
+def default_preset(target=None, quality=None):
+    """Preset for a request naming no preset: the recorded measured choice, else the pinned one"""
+    return preset_profiler.choice(target, quality) or pinned_preset(target, quality)
+
+def choice_key(target, quality):
+    return f"{target or 'any'}/{quality or PRESET_QUALITY}"
+
+class PresetProfiler:
+    """Measured encode speed and output bitrate per preset"""
+
+    def __init__(self, client_mbps=PRESET_CLIENT_MBPS, choices_file=PRESET_CHOICES_FILE):
+        self.client_mbps = client_mbps
+        self.choices_file = Path(choices_file)
+        self._lock = threading.Lock()
+        # preset -> {"speed", "kbps", "samples", "updated_at"}
+        self._profiles = {}
+        # "target/quality" -> preset, as recorded in choices_file
+        self._choices = {}
+        self._loaded_mtime = None
+        self._thread = None
+
+    # ---- measurements ----
+    def observe(self, preset, media_seconds, wall_seconds, output_bytes):
+        """Fold one encode of ``media_seconds`` of audio into the preset's profile"""
+        if preset not in PRESETS or not media_seconds or wall_seconds <= 0 or not output_bytes:
+            return
+        speed = media_seconds / wall_seconds
+        kbps = output_bytes * 8 / media_seconds / 1000
+        with self._lock:
+            profile = self._profiles.get(preset)
+            if profile is None:
+                self._profiles[preset] = {"speed": speed, "kbps": kbps, "samples": 1, "updated_at": time.time()}
+            else:
+                profile["speed"] += EWMA_ALPHA * (speed - profile["speed"])
+                profile["kbps"] += EWMA_ALPHA * (kbps - profile["kbps"])
+                profile["samples"] += 1
+                profile["updated_at"] = time.time()
+        self.record_choices()
+
+    def measure(self, seconds=PRESET_PROFILE_SECONDS, presets=None):
+        """Encode a generated clip with each preset (one transcode slot at a time)"""
+        with tempfile.TemporaryDirectory(prefix="yt_audio_presets_") as tmp:
+            tmp = Path(tmp)
+            source = tmp / "source.wav"
+            subprocess.run(
+                ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", PROFILE_SOURCE,
+                 "-f", "lavfi", "-i", "anoisesrc=color=pink:amplitude=0.05:r=48000",
+                 "-filter_complex", "[1]pan=stereo|c0=c0|c1=c0[n];[0][n]amix=inputs=2:duration=first",
+                 "-t", str(seconds), str(source)],
+                check=True, capture_output=True
+            )
+            for name in presets or PRESETS:
+                target = PRESETS[name]["target"]
+                out = tmp / f"{name}.{TARGETS[target]['ext']}"
+                cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(source), *encoder_args(target, name), str(out)]
+                with transcode_slot():
+                    started = time.perf_counter()
+                    subprocess.run(cmd, check=True, capture_output=True)
+                    elapsed = time.perf_counter() - started
+                self.observe(name, seconds, elapsed, out.stat().st_size)
+
+    # ---- choices ----
+    def _load_choices(self):
+        """Reload the recorded choices if another process has updated them (call with the lock held)"""
+        try:
+            mtime = self.choices_file.stat().st_mtime
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        try:
+            data = json.loads(self.choices_file.read_text())
+        except (OSError, ValueError):
+            return
+        self._choices = {key: name for key, name in data.items() if name in PRESETS}
+        self._loaded_mtime = mtime
+
+    def choice(self, target=None, quality=None):
+        """Recorded preset for ``target`` at ``quality``, or None if not chosen yet"""
+        key = choice_key(target, quality)
+        with self._lock:
+            self._load_choices()
+            name = self._choices.get(key)
+        # Ignore choices that no longer fit (e.g. PRESETS changed since they were recorded)
+        if name and name in candidates(target, quality):
+            return name
+        return None
+
+    def record_choices(self):
+        """Record the cheapest preset of every tier that has none yet and is fully measured
+
+        Recorded choices are kept, including ones other workers wrote first.
+        """
+        new = {}
+        for target in (None, *TARGETS):
+            for quality in QUALITIES:
+                if self.choice(target, quality) is None:
+                    name = self.cheapest(target, quality)
+                    if name:
+                        new[choice_key(target, quality)] = name
+        if not new:
+            return
+        with self._lock, _locked(self.choices_file):
+            self._loaded_mtime = None
+            self._load_choices()
+            for key, name in new.items():
+                if key not in self._choices:
+                    self._choices[key] = name
+                    print(f"Preset choice for {key}: {name}")
+            try:
+                self.choices_file.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.choices_file.parent, prefix=".presets-")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._choices, f, indent=1, sort_keys=True)
+                os.replace(tmp, self.choices_file)
+                self._loaded_mtime = self.choices_file.stat().st_mtime
+            except OSError as e:
+                print(f"Could not record preset choices: {e}")
+
+    def start(self):
+        """Profile all presets in a background thread"""
+        if not PRESET_PROFILE or self._thread is not None:
+            return
+
+        def run():
+            try:
+                self.measure()
+                print(f"Preset profiles: {self.summary()}")
+            except Exception as e:
+                print(f"Preset profiling failed: {e}")
+
+        self._thread = threading.Thread(target=run, name="preset-profiler", daemon=True)
+        self._thread.start()
+
+    # ---- reporting ----
+    def cost(self, preset):
+        """Seconds of encode plus delivery per second of audio, or None before the preset is measured"""
+        with self._lock:
+            profile = self._profiles.get(preset)
+            if profile is None:
+                return None
+            speed, kbps = profile["speed"], profile["kbps"]
+        return 1 / speed + kbps / 1000 / self.client_mbps
+
+    def cheapest(self, target=None, quality=None):
+        """Measured cheapest preset for ``target`` at ``quality`` or better; None until all are measured"""
+        names = candidates(target, quality)
+        costs = {name: self.cost(name) for name in names}
+        if not names or any(cost is None for cost in costs.values()):
+            return None
+        return min(names, key=costs.get)
+
+    def summary(self):
+        """Preset settings with their measured speed, bitrate and cost"""
+        with self._lock:
+            profiles = {name: dict(profile) for name, profile in self._profiles.items()}
+        presets = {}
+        for name, spec in PRESETS.items():
+            profile = profiles.get(name, {})
+            cost = self.cost(name)
+            presets[name] = {
+                "target": spec["target"],
+                "quality": spec["quality"],
+                "description": spec["description"],
+                "encoder_args": encoder_args(spec["target"], name),
+                "nominal_kbps": spec["kbps"],
+                "measured_kbps": round(profile["kbps"], 1) if profile else None,
+                "encode_speed": round(profile["speed"], 1) if profile else None,
+                "cost": round(cost, 4) if cost is not None else None,
+                "samples": profile.get("samples", 0),
+            }
+        return presets
+
+@contextlib.contextmanager
+def _locked(path):
+    """Exclusive lock on ``path`` across processes (a no-op without fcntl)"""
+    if fcntl is None:
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+preset_profiler = PresetProfiler()
+
+if __name__ == "__main__":
+    # Profile all presets and record the choices: python presets.py
+    preset_profiler.measure()
+    print(f"{'preset':10} {'quality':9} {'kbps':>7} {'speed':>7} {'cost':>7}")
+    for name, row in preset_profiler.summary().items():
+        print(f"{name:10} {row['quality']:9} {row['measured_kbps']:7.1f} {row['encode_speed']:6.1f}x {row['cost']:7.4f}")
+    for target in (None, *TARGETS):
+        print(f"{target or 'any':5} " + ", ".join(
+            f"{quality}: {default_preset(target, quality)}"
+            for quality in QUALITIES
+        ))
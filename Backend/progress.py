@@ -1,58 +1,154 @@
+import asyncio
+import collections
 import json
+import os
+import threading
 from downloader_core import download_audio_from_youtube
+from executors import download_executor
+from singleflight import flight
+
+# Maximum progress events sent to a client per second
+PROGRESS_RATE = float(os.environ.get("PROGRESS_RATE", 4))
+# Maximum status events buffered per stream before the oldest are dropped
+PROGRESS_QUEUE_SIZE = 32
+
+class DownloadCancelled(Exception):
+    """Raised inside the download thread when the client has gone away"""
 
 def sse_format(data):
     return f"data: {json.dumps(data)}\n\n"
 
-def stream_download(url, convert, keep):
-    """Generator function that yields progress updates"""
-    
-    # Yield initial status
-    yield sse_format({
-        "status": "starting",
-        "message": "Starting download process..."
-    })
-    
-    progress_data = {"last_update": None}
-    
+class ProgressChannel:
+    """Bounded, coalescing hand-off from a download thread to an async consumer.
+
+    ``publish`` never blocks the producer. Consecutive "downloading" updates are
+    merged so only the newest one is kept; other status events are queued in
+    order, and the oldest are dropped once ``maxsize`` is reached.
+    """
+
+    def __init__(self, loop, maxsize=PROGRESS_QUEUE_SIZE):
+        self._loop = loop
+        self._events = collections.deque(maxlen=maxsize)
+        self._latest = None
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self.cancelled = False
+
+    def publish(self, event):
+        """Called from the worker thread"""
+        with self._lock:
+            if event.get("status") == "downloading":
+                self._latest = event
+            else:
+                # Keep ordering: the last progress update goes out before the status change
+                if self._latest is not None:
+                    self._events.append(self._latest)
+                    self._latest = None
+                self._events.append(event)
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def drain(self):
+        """Return all pending events, oldest first"""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            if self._latest is not None:
+                events.append(self._latest)
+                self._latest = None
+            self._wakeup.clear()
+        return events
+
+    def notify(self):
+        """Wake the consumer (must be called on the event loop thread)"""
+        self._wakeup.set()
+
+    async def wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def make_progress_hook(channel):
+    """Build a yt-dlp progress hook that pushes updates into ``channel``"""
+    state = {"last_status": None}
+
     def progress_hook(progress):
         """This is called by yt-dlp on every progress update."""
+        if channel.cancelled:
+            raise DownloadCancelled("Client disconnected")
+
         current_status = progress.get("status")
-        
-        # Only yield progress if status changed or significant update
         if current_status == "downloading":
-            progress_data["last_update"] = "downloading"
-            return {
+            state["last_status"] = "downloading"
+            channel.publish({
                 "status": "downloading",
                 "percent": progress.get("_percent_str", "").strip(),
                 "speed": progress.get("_speed_str", "").strip(),
                 "eta": progress.get("_eta_str", "").strip(),
-            }
-        elif current_status == "finished" and progress_data["last_update"] != "finished":
-            progress_data["last_update"] = "finished"
-            return {
+                "downloaded_bytes": progress.get("downloaded_bytes"),
+                "total_bytes": progress.get("total_bytes") or progress.get("total_bytes_estimate"),
+            })
+        elif current_status == "finished" and state["last_status"] != "finished":
+            state["last_status"] = "finished"
+            channel.publish({
                 "status": "converting",
                 "message": "Download completed, converting audio..."
-            }
-        return None
+            })
 
-    try:
-        # Run download task with progress hook
-        results = download_audio_from_youtube(
+    return progress_hook
+
+async def stream_download(url, convert, keep):
+    """Async generator that yields SSE progress updates while the download runs in a worker"""
+    loop = asyncio.get_running_loop()
+    channel = ProgressChannel(loop)
+    interval = 1.0 / PROGRESS_RATE
+
+    # Yield initial status
+    yield sse_format({
+        "status": "starting",
+        "message": "Starting download process..."
+    })
+
+    # Identical concurrent streams share one download and all receive its progress
+    future = asyncio.wrap_future(flight.submit(
+        f"stream:{url}:{convert}:{keep}",
+        lambda hook: download_audio_from_youtube(
             url,
             convert_to_mp3=convert,
             keep_original=keep,
-            progress_hook=lambda d: progress_hook(d)
-        )
-        
+            progress_hook=hook
+        ),
+        download_executor(),
+        progress_hook=make_progress_hook(channel)
+    ))
+    future.add_done_callback(lambda _: channel.notify())
+
+    try:
+        while not future.done():
+            await channel.wait()
+            for event in channel.drain():
+                yield sse_format(event)
+            # Throttle: coalesce everything that arrives in the next interval
+            await asyncio.sleep(interval)
+
+        for event in channel.drain():
+            yield sse_format(event)
+
+        try:
+            results = future.result()
+        except Exception as e:
+            yield sse_format({
+                "status": "error",
+                "message": str(e)
+            })
+            return
+
         # Final completion message
         yield sse_format({
-            "status": "completed", 
+            "status": "completed",
             "results": results
         })
-        
-    except Exception as e:
-        yield sse_format({
-            "status": "error",
-            "message": str(e)
-        })
\ No newline at end of file
+    finally:
+        # Client went away (or we finished) - stop the worker at its next progress tick
+        if not future.done():
+            channel.cancelled = True
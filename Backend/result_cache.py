@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Content-addressed LRU cache of finished audio files, published atomically.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from serving import file_digest
+
+RESULT_CACHE_DIR = Path(os.environ.get("RESULT_CACHE_DIR", "result_cache"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+ENTRY_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+
+def cache_key(video_id, fmt, bitrate=None, codec=None):
+    """Build the cache key for a video and its output options"""
+    return f"{video_id}:{fmt}:{bitrate or 'native'}:{codec or 'native'}"
+
+class ResultCache:
+    """Size-bounded LRU cache of produced audio files"""
+
+    def __init__(self, root=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        # key -> {"path", "size", "title", "sha256"}; ordered oldest access first
+        self._index = collections.OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._scanned = False
+        self._scan_lock = threading.Lock()
+
+    def _entry_dir(self, key):
+        return self.root / hashlib.sha256(key.encode()).hexdigest()
+
+    def scan(self):
+        """Index the entries on disk, most recently used last (once)"""
+        with self._scan_lock:
+            if self._scanned:
+                return
+            self._scan()
+            self._scanned = True
+
+    def _scan(self):
+        entries = []
+        for meta_path in self.root.glob("*/meta.json"):
+            try:
+                meta = json.loads(meta_path.read_text())
+                path = meta_path.parent / meta["filename"]
+                entries.append((meta_path.stat().st_mtime, meta["key"], {
+                    "path": path,
+                    "size": path.stat().st_size,
+                    "title": meta.get("title"),
+                    "sha256": meta.get("sha256"),
+                }))
+            except (OSError, ValueError, KeyError):
+                # Half-written or corrupt entry - drop it
+                shutil.rmtree(meta_path.parent, ignore_errors=True)
+        # Leftovers from interrupted publishes
+        for tmp_dir in self.root.glob(".tmp-*"):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        with self._lock:
+            # Entries looked up since startup are already indexed, as the most recent ones
+            for _, key, entry in sorted(entries, key=lambda e: e[0], reverse=True):
+                if key in self._index:
+                    continue
+                self._index[key] = entry
+                self._index.move_to_end(key, last=False)
+                self._bytes += entry["size"]
+
+    # ---- public API ----
+    def get(self, key, record=True):
+        """Return the cached entry for ``key`` (and mark it recently used), or None.
+
+        ``record=False`` skips the hit/miss counters, for re-checks of a lookup
+        that was already counted.
+        """
+        with self._lock:
+            entry = self._index.get(key) or self._load_entry(key)
+            if entry is not None and not entry["path"].exists():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                if record:
+                    self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            if record:
+                self.hits += 1
+        try:
+            # Persist recency so the LRU order survives restarts
+            os.utime(entry["path"].parent / "meta.json")
+        except OSError:
+            pass
+        return dict(entry)
+
+    def find(self, entry_id):
+        """Entry by its directory name (the id in a result URL), or None"""
+        if not ENTRY_ID_RE.match(entry_id):
+            return None
+        try:
+            key = json.loads((self.root / entry_id / "meta.json").read_text())["key"]
+        except (OSError, ValueError, KeyError):
+            return None
+        return self.get(key, record=False)
+
+    def publish(self, key, src_file, title=None, move=False):
+        """Atomically add ``src_file`` to the cache under ``key`` and return the entry"""
+        # Eviction needs the full index
+        self.scan()
+        src_file = Path(src_file)
+        final_dir = self._entry_dir(key)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.root))
+        try:
+            dest = tmp_dir / src_file.name
+            if move:
+                shutil.move(str(src_file), dest)
+            else:
+                shutil.copy2(src_file, dest)
+            digest = file_digest(dest)
+            (tmp_dir / "meta.json").write_text(json.dumps({
+                "key": key,
+                "filename": src_file.name,
+                "title": title,
+                "sha256": digest,
+                "created_at": time.time(),
+            }))
+            with self._lock:
+                if key in self._index:
+                    # Another request published it first
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    self._index.move_to_end(key)
+                    return dict(self._index[key])
+                if final_dir.exists():
+                    shutil.rmtree(final_dir, ignore_errors=True)
+                os.rename(tmp_dir, final_dir)
+                entry = {
+                    "path": final_dir / src_file.name,
+                    "size": (final_dir / src_file.name).stat().st_size,
+                    "title": title,
+                    "sha256": digest,
+                }
+                self._index[key] = entry
+                self._bytes += entry["size"]
+                self._evict()
+                return dict(entry)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    # ---- internals (call with the lock held) ----
+    def _load_entry(self, key):
+        """Pick up an entry published by another process sharing this directory"""
+        entry_dir = self._entry_dir(key)
+        try:
+            meta = json.loads((entry_dir / "meta.json").read_text())
+            path = entry_dir / meta["filename"]
+            entry = {"path": path, "size": path.stat().st_size, "title": meta.get("title"), "sha256": meta.get("sha256")}
+        except (OSError, ValueError, KeyError):
+            return None
+        self._index[key] = entry
+        self._bytes += entry["size"]
+        return entry
+
+    def _remove(self, key):
+        entry = self._index.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry["size"]
+        shutil.rmtree(entry["path"].parent, ignore_errors=True)
+
+    def _evict(self):
+        # Never evict the newest entry, even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            key = next(iter(self._index))
+            self._remove(key)
+            self.evictions += 1
+            print(f"Evicted cached result: {key}")
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""Multi-connection HTTP downloader using Range requests through ``ydl.urlopen``.
+
+Completed ranges are saved next to the ``.part`` file so an interrupted download resumes.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from yt_dlp import YoutubeDL
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.common import FileDownloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError, RequestError
+from yt_dlp.utils import DownloadError
+
+from connections import ADAPTIVE_CONNECTIONS, AIMDController, host_settings
+
+MIN_SEGMENT = 256 * 1024
+MAX_SEGMENT = 16 * 1024 * 1024
+# Target duration of one Range request at the connection's measured speed
+SEGMENT_SECONDS = float(os.environ.get("SEGMENT_SECONDS", 2.0))
+READ_SIZE = 64 * 1024
+# Minimum seconds between progress reports / resume-state saves
+PROGRESS_INTERVAL = 0.2
+STATE_INTERVAL = 1.0
+
+def state_file(tmpfilename):
+    return tmpfilename + ".segments"
+
+def discard_sparse_part(tmpfilename):
+    """Delete a segmented ``.part`` (it may have holes) and its state before HttpFD resumes the file"""
+    if not os.path.exists(state_file(tmpfilename)):
+        return False
+    for path in (tmpfilename, state_file(tmpfilename)):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+    return True
+
+def _merge(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+class _ShortRead(Exception):
+    """The server closed a Range response early"""
+
+class _Segment:
+    """Byte range [start, end) owned by one worker; ``end`` may shrink when another worker splits it"""
+
+    __slots__ = ("start", "pos", "end")
+
+    def __init__(self, start, end):
+        self.start = start
+        self.pos = start
+        self.end = end
+
+class _Transfer:
+    """Shared bookkeeping for one segmented download"""
+
+    def __init__(self, total, done, max_segment):
+        self.total = total
+        self.max_segment = max_segment
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.error = None
+        self.done = _merge(done)
+        self.downloaded = sum(end - start for start, end in self.done)
+        # Gaps still to fetch, in file order
+        self.gaps = []
+        cursor = 0
+        for start, end in self.done:
+            if start > cursor:
+                self.gaps.append([cursor, start])
+            cursor = end
+        if cursor < total:
+            self.gaps.append([cursor, total])
+        self.active = []
+        # Workers wanted / running; the controller moves the target during the transfer
+        self.target = 1
+        self.running = 0
+        # Retried requests, a sign of throttling
+        self.errors = 0
+        # Set once every worker has exited
+        self.finished = threading.Event()
+
+    def has_work(self):
+        with self.lock:
+            return bool(self.gaps) or any(s.end - s.pos >= 2 * MIN_SEGMENT for s in self.active)
+
+    def worker_started(self):
+        with self.lock:
+            self.running += 1
+
+    def worker_exited(self):
+        with self.lock:
+            self.running -= 1
+            if self.running <= 0:
+                self.finished.set()
+
+    def retire(self):
+        """True if the calling worker should stop because the target dropped; it is counted out here"""
+        with self.lock:
+            if self.running > self.target:
+                self.running -= 1
+                return True
+            return False
+
+    def record_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def take(self, size):
+        """Next segment for a worker wanting about ``size`` bytes, or None when nothing is left"""
+        with self.lock:
+            if self.gaps:
+                gap = self.gaps[0]
+                end = min(gap[0] + size, gap[1])
+                # Do not leave a sliver behind for another request
+                if gap[1] - end < MIN_SEGMENT:
+                    end = gap[1]
+                segment = _Segment(gap[0], end)
+                gap[0] = end
+                if gap[0] >= gap[1]:
+                    self.gaps.pop(0)
+                self.active.append(segment)
+                return segment
+
+            # Nothing unassigned: split the largest remaining in-flight segment
+            victim = max(self.active, key=lambda s: s.end - s.pos, default=None)
+            if victim is None or victim.end - victim.pos < 2 * MIN_SEGMENT:
+                return None
+            middle = victim.pos + (victim.end - victim.pos) // 2
+            segment = _Segment(middle, victim.end)
+            victim.end = middle
+            self.active.append(segment)
+            return segment
+
+    def advance(self, segment, count):
+        """Record ``count`` bytes written at ``segment.pos``; returns the number that were wanted"""
+        with self.lock:
+            count = max(0, min(count, segment.end - segment.pos))
+            segment.pos += count
+            self.downloaded += count
+            return count
+
+    def release(self, segment):
+        """Return a worker's segment; an unfinished remainder goes back to the gaps"""
+        with self.lock:
+            self.active.remove(segment)
+            if segment.pos > segment.start:
+                self.done = _merge(self.done + [[segment.start, segment.pos]])
+            if segment.pos < segment.end:
+                self.gaps = _merge(self.gaps + [[segment.pos, segment.end]])
+
+    def completed_ranges(self):
+        with self.lock:
+            # The last read of an active segment may not have reached the file yet
+            ranges = list(self.done) + [
+                [s.start, s.pos - READ_SIZE] for s in self.active if s.pos - READ_SIZE > s.start
+            ]
+        return _merge(ranges)
+
+    def fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.stop.set()
+
+class SegmentedFD(FileDownloader):
+    """Download one HTTP(S) format with several concurrent Range requests"""
+
+    def _headers(self, info_dict, extra=None):
+        headers = dict(info_dict.get("http_headers") or {})
+        # Byte offsets must refer to the file itself, not a compressed transfer
+        headers["Accept-Encoding"] = "identity"
+        headers.update(extra or {})
+        return headers
+
+    def _probe_size(self, info_dict):
+        """Total size if the server honours Range requests, otherwise None"""
+        response = self.ydl.urlopen(Request(info_dict["url"], headers=self._headers(info_dict, {"Range": "bytes=0-0"})))
+        try:
+            if response.status != 206:
+                return None
+            content_range = response.headers.get("Content-Range") or ""
+            total = content_range.rpartition("/")[2]
+            return int(total) if total.isdigit() else None
+        finally:
+            response.close()
+
+    def _fallback(self, filename, info_dict):
+        discard_sparse_part(self.temp_name(filename))
+        fd = HttpFD(self.ydl, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        return fd.real_download(filename, info_dict)
+
+    def _fetch(self, transfer, segment, info_dict, handle):
+        """Fetch ``segment`` into ``handle``, retrying transient errors from the current position"""
+        retries = self.params.get("retries", 10)
+        if retries == float("inf"):
+            retries = 10
+        attempt = 0
+        while not transfer.stop.is_set() and segment.pos < segment.end:
+            headers = self._headers(info_dict, {"Range": f"bytes={segment.pos}-{segment.end - 1}"})
+            try:
+                response = self.ydl.urlopen(Request(info_dict["url"], headers=headers))
+                try:
+                    if response.status != 206:
+                        raise DownloadError(f"server ignored the Range request (HTTP {response.status})")
+                    while not transfer.stop.is_set() and segment.pos < segment.end:
+                        data = response.read(READ_SIZE)
+                        if not data:
+                            break
+                        handle.seek(segment.pos)
+                        wanted = transfer.advance(segment, len(data))
+                        handle.write(data[:wanted])
+                        attempt = 0
+                finally:
+                    response.close()
+                if segment.pos < segment.end and not transfer.stop.is_set():
+                    raise _ShortRead("connection closed before the segment was complete")
+            except (RequestError, _ShortRead, OSError) as e:
+                if isinstance(e, HTTPError) and e.status < 500 and e.status != 429:
+                    raise
+                attempt += 1
+                transfer.record_error()
+                if attempt > retries:
+                    raise
+                self.report_retry(e, attempt, retries)
+                time.sleep(min(attempt, 5))
+
+    def _worker(self, transfer, tmpfilename, info_dict):
+        size = MIN_SEGMENT * 4
+        retired = False
+        try:
+            with open(tmpfilename, "r+b", buffering=0) as handle:
+                while not transfer.stop.is_set():
+                    if transfer.retire():
+                        retired = True
+                        return
+                    segment = transfer.take(size)
+                    if segment is None:
+                        return
+                    started, before = time.time(), segment.pos
+                    try:
+                        self._fetch(transfer, segment, info_dict, handle)
+                    finally:
+                        transfer.release(segment)
+                    # Size the next request to this connection's measured speed
+                    elapsed = time.time() - started
+                    if elapsed > 0 and segment.pos > before:
+                        speed = (segment.pos - before) / elapsed
+                        size = int(min(max(speed * SEGMENT_SECONDS, MIN_SEGMENT), transfer.max_segment))
+        except Exception as e:
+            transfer.fail(e)
+        finally:
+            if not retired:
+                transfer.worker_exited()
+
+    def _spawn_workers(self, transfer, tmpfilename, info_dict):
+        """Start workers until the target count is running (while there is work to share)"""
+        while transfer.running < transfer.target and transfer.has_work():
+            transfer.worker_started()
+            threading.Thread(
+                target=self._worker, args=(transfer, tmpfilename, info_dict), daemon=True
+            ).start()
+        if transfer.running == 0:
+            # Nothing left to fetch (e.g. a fully downloaded resume)
+            transfer.finished.set()
+
+    def _load_state(self, tmpfilename, total):
+        """Ranges already on disk from an earlier attempt at the same file"""
+        if not os.path.exists(tmpfilename):
+            return []
+        try:
+            with open(state_file(tmpfilename)) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            # A .part without segment state comes from HttpFD: its bytes are contiguous from 0
+            size = os.path.getsize(tmpfilename)
+            return [(0, size)] if 0 < size <= total else []
+        except (OSError, ValueError):
+            return []
+        if state.get("total") != total:
+            return []
+        return [tuple(r) for r in state.get("done", [])]
+
+    def _save_state(self, tmpfilename, transfer):
+        path = state_file(tmpfilename)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"total": transfer.total, "done": transfer.completed_ranges()}, f)
+        os.replace(path + ".tmp", path)
+
+    def _report(self, transfer, filename, tmpfilename, info_dict, start, resumed):
+        now = time.time()
+        downloaded = transfer.downloaded
+        speed = self.calc_speed(start, now, downloaded - resumed)
+        status = {
+            "status": "downloading",
+            "downloaded_bytes": downloaded,
+            "total_bytes": transfer.total,
+            "tmpfilename": tmpfilename,
+            "filename": filename,
+            "eta": self.calc_eta(speed, transfer.total - downloaded) if speed else None,
+            "speed": speed,
+            "elapsed": now - start,
+            "ctx_id": info_dict.get("ctx_id"),
+        }
+        self._hook_progress(status, info_dict)
+        self.report_progress(status)
+
+    def real_download(self, filename, info_dict):
+        url = info_dict["url"]
+        # Start from what worked for this CDN host before, else from the bandwidth table
+        connections = host_settings.get(url) or self.params.get("concurrent_fragment_downloads") or 1
+        tmpfilename = self.temp_name(filename)
+
+        try:
+            total = self._probe_size(info_dict)
+        except HTTPError:
+            total = None
+        if not total or total < 2 * MIN_SEGMENT or (connections < 2 and not ADAPTIVE_CONNECTIONS):
+            return self._fallback(filename, info_dict)
+
+        done = self._load_state(tmpfilename, total) if self.params.get("continuedl", True) else []
+        if not done:
+            with open(tmpfilename, "wb"):
+                pass
+        max_segment = (info_dict.get("downloader_options") or {}).get("http_chunk_size") or MAX_SEGMENT
+        transfer = _Transfer(total, done, max_segment)
+        # From here on the .part may have holes; the state file says so
+        self._save_state(tmpfilename, transfer)
+        resumed = transfer.downloaded
+        if resumed:
+            self.report_resuming_byte(resumed)
+
+        self.report_destination(filename)
+        start = time.time()
+        controller = AIMDController(connections) if ADAPTIVE_CONNECTIONS else None
+        transfer.target = controller.target if controller else connections
+        self._spawn_workers(transfer, tmpfilename, info_dict)
+
+        last_state = time.time()
+        try:
+            while not transfer.finished.wait(PROGRESS_INTERVAL):
+                self._report(transfer, filename, tmpfilename, info_dict, start, resumed)
+                # Adapt while extra connections would have work; the very tail says little about goodput
+                if controller and transfer.has_work():
+                    transfer.target = controller.update(time.time(), transfer.downloaded, transfer.errors)
+                    self._spawn_workers(transfer, tmpfilename, info_dict)
+                if time.time() - last_state >= STATE_INTERVAL:
+                    last_state = time.time()
+                    self._save_state(tmpfilename, transfer)
+        except BaseException:
+            # A progress hook cancelled the download: keep what we have for a retry
+            transfer.stop.set()
+            transfer.finished.wait()
+            self._save_state(tmpfilename, transfer)
+            raise
+
+        if controller and controller.best_connections:
+            host_settings.record(url, controller.best_connections, controller.best_throughput)
+
+        if transfer.error is not None or transfer.downloaded < total:
+            self._save_state(tmpfilename, transfer)
+            raise DownloadError(f"segmented download failed: {transfer.error or 'incomplete'}")
+
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(state_file(tmpfilename))
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            "downloaded_bytes": total,
+            "total_bytes": total,
+            "filename": filename,
+            "status": "finished",
+            "elapsed": time.time() - start,
+            "ctx_id": info_dict.get("ctx_id"),
+        }, info_dict)
+        return True
+
+class SegmentedYoutubeDL(YoutubeDL):
+    """YoutubeDL that downloads plain HTTP formats with ``SegmentedFD``"""
+
+    def _use_segmented(self, name, info):
+        if name == "-" or info.get("is_live") or self.params.get("external_downloader"):
+            return False
+        if (self.params.get("concurrent_fragment_downloads") or 1) < 2 and not ADAPTIVE_CONNECTIONS:
+            return False
+        return get_suitable_downloader(info, self.params) is HttpFD
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if test or subtitle or not info.get("url") or not self._use_segmented(name, info):
+            if name != "-" and not self.params.get("nopart"):
+                # An earlier segmented attempt may have left a .part with holes
+                discard_sparse_part(name + ".part")
+            return super().dl(name, info, subtitle=subtitle, test=test)
+
+        fd = SegmentedFD(self, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        self.write_debug(f'Invoking {fd.FD_NAME} downloader on "{info["url"]}"')
+        new_info = self._copy_infodict(info)
+        if new_info.get("http_headers") is None:
+            new_info["http_headers"] = self._calc_headers(new_info)
+        return fd.download(name, new_info, subtitle)
+
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Serving produced audio files: byte ranges, strong validators, zero-copy sends.
+
+    SERVE_CHUNK_BYTES   - read size when the server has no zero-copy extension (default 256 KB)
+    SERVE_GRACE_SECONDS - how long a file served by /file stays available for resumed requests (default 900)
+"""
+
+import collections
+import hashlib
+import os
+import re
+import stat
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+
+SERVE_CHUNK_BYTES = int(os.environ.get("SERVE_CHUNK_BYTES", 256 * 1024))
+SERVE_GRACE_SECONDS = float(os.environ.get("SERVE_GRACE_SECONDS", 900))
+# Memoized content digests (path, size, mtime -> sha256)
+DIGEST_CACHE_SIZE = 1024
+HASH_BLOCK = 1024 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def file_digest(path):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class DigestCache:
+    """Content digests of served files, recomputed only when size or mtime change"""
+
+    def __init__(self, max_entries=DIGEST_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._digests = collections.OrderedDict()
+
+    def get(self, path, stat_result=None):
+        stat_result = stat_result or os.stat(path)
+        key = (str(path), stat_result.st_size, stat_result.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[key] = digest
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
+
+digests = DigestCache()
+
+def strong_etag(digest):
+    return f'"{digest}"'
+
+def etag_matches(header, etag, weak=True):
+    """True if an If-None-Match / If-Match style list contains ``etag``"""
+    if header.strip() == "*":
+        return True
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+def not_modified_since(header, mtime):
+    try:
+        return int(mtime) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single-range header; None to send the whole file"""
+    match = RANGE_RE.match(header.strip())
+    if not match or not any(match.groups()):
+        # Multiple ranges or another unit: ignoring Range is always allowed
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            raise RangeNotSatisfiable()
+    else:
+        suffix = int(last)
+        if not suffix or not size:
+            raise RangeNotSatisfiable()
+        start, end = max(size - suffix, 0), size - 1
+    return start, end
+
+class RangeFileResponse(FileResponse):
+    """FileResponse with Range, strong ETag and conditional GET support"""
+
+    chunk_size = SERVE_CHUNK_BYTES
+
+    def __init__(self, path, *args, digest=None, **kwargs):
+        super().__init__(path, *args, **kwargs)
+        self.digest = digest
+
+    def set_stat_headers(self, stat_result):
+        self.headers.setdefault("content-length", str(stat_result.st_size))
+        self.headers.setdefault("last-modified", formatdate(stat_result.st_mtime, usegmt=True))
+        self.headers.setdefault("accept-ranges", "bytes")
+
+    async def __call__(self, scope, receive, send):
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            raise RuntimeError(f"File at path {self.path} does not exist.")
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise RuntimeError(f"File at path {self.path} is not a file.")
+        self.set_stat_headers(stat_result)
+        if self.digest is None:
+            # Hashed once per file version; later requests hit the memo
+            self.digest = await anyio.to_thread.run_sync(digests.get, self.path, stat_result)
+        etag = strong_etag(self.digest)
+        self.headers["etag"] = etag
+
+        request_headers = Headers(scope=scope)
+        method = scope.get("method", "GET").upper()
+        conditional = method in ("GET", "HEAD")
+        size = stat_result.st_size
+        start, end = 0, size - 1
+
+        if conditional and (
+            etag_matches(request_headers["if-none-match"], etag) if "if-none-match" in request_headers
+            else not_modified_since(request_headers.get("if-modified-since"), stat_result.st_mtime)
+        ):
+            await self._send_headers_only(send, 304, drop=("content-length", "content-type"))
+            return await self._finish()
+
+        if conditional and "range" in request_headers and self._if_range(request_headers, etag, stat_result):
+            try:
+                selected = parse_range(request_headers["range"], size)
+            except RangeNotSatisfiable:
+                self.headers["content-range"] = f"bytes */{size}"
+                self.headers["content-length"] = "0"
+                await self._send_headers_only(send, 416)
+                return await self._finish()
+            if selected is not None:
+                start, end = selected
+                self.status_code = 206
+                self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+                self.headers["content-length"] = str(end - start + 1)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.send_header_only or method == "HEAD" or size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await self._send_body(scope, send, start, end - start + 1, size)
+        await self._finish()
+
+    # ---- internals ----
+    def _if_range(self, request_headers, etag, stat_result):
+        """Honour Range unless If-Range names an older version of the file"""
+        if_range = request_headers.get("if-range")
+        if if_range is None:
+            return True
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # If-Range needs a strong match
+            return if_range.strip() == etag
+        return not_modified_since(if_range, stat_result.st_mtime)
+
+    async def _send_headers_only(self, send, status, drop=()):
+        for name in drop:
+            if name in self.headers:
+                del self.headers[name]
+        await send({"type": "http.response.start", "status": status, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_body(self, scope, send, offset, count, size):
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            # The server sendfile()s straight from the page cache
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": offset, "count": count})
+            return
+        if "http.response.pathsend" in extensions and count == size:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+        try:
+            end = offset + count
+            while offset < end:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(self.chunk_size, end - offset), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": offset < end})
+            if offset < end:
+                # File shrank underneath us; end the body rather than hang
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+    async def _finish(self):
+        if self.background is not None:
+            await self.background()
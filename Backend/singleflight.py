@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Single-flight coordination: identical concurrent downloads share one run and its progress.
+"""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+from storage import STATE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows - in-process coordination only
+    fcntl = None
+
+SINGLEFLIGHT_LOCK_DIR = os.environ.get("SINGLEFLIGHT_LOCK_DIR") or str(STATE_DIR / "locks")
+
+class _Call:
+    """One in-flight run and the callers waiting on it"""
+
+    def __init__(self):
+        self.future = concurrent.futures.Future()
+        self.lock = threading.Lock()
+        # Subscriber hooks; None means "waiting without progress", False means "cancelled"
+        self.subscribers = []
+        self.last_event = None
+
+    def subscribe(self, hook):
+        with self.lock:
+            self.subscribers.append(hook)
+            last_event = self.last_event
+        if hook and last_event is not None:
+            try:
+                hook(last_event)
+            except Exception:
+                pass
+
+    def fan_out(self, event):
+        """Progress hook handed to the leader's function"""
+        with self.lock:
+            self.last_event = event
+            subscribers = list(enumerate(self.subscribers))
+        error = None
+        for i, hook in subscribers:
+            if not hook:
+                continue
+            try:
+                hook(event)
+            except Exception as e:
+                # This subscriber gave up (e.g. its client disconnected)
+                with self.lock:
+                    self.subscribers[i] = False
+                error = e
+        # Abort the shared run only once every subscriber has cancelled
+        with self.lock:
+            all_cancelled = all(hook is False for hook in self.subscribers)
+        if error is not None and all_cancelled:
+            raise error
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self, lock_dir=SINGLEFLIGHT_LOCK_DIR):
+        self.lock_dir = Path(lock_dir) if lock_dir and fcntl else None
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def _join_or_lead(self, key, progress_hook):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+        call.subscribe(progress_hook)
+        return call, leader
+
+    @contextlib.contextmanager
+    def _process_lock(self, key):
+        if not self.lock_dir:
+            yield
+            return
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        lock_path = self.lock_dir / (hashlib.sha256(key.encode()).hexdigest() + ".lock")
+        with open(lock_path, "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _lead(self, key, call, func):
+        try:
+            with self._process_lock(key):
+                result = func(call.fan_out)
+        except BaseException as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def submit(self, key, func, executor, progress_hook=None):
+        """Join or start the run for ``key`` on ``executor`` and return a Future for its result.
+
+        ``func`` is called as ``func(progress_hook)`` and only by the leader.
+        """
+        call, leader = self._join_or_lead(key, progress_hook)
+        if leader:
+            executor.submit(self._lead, key, call, func)
+        return call.future
+
+    def do(self, key, func, progress_hook=None):
+        """Blocking variant: the leader runs ``func`` in the calling thread"""
+        call, leader = self._join_or_lead(key, progress_hook)
+        if leader:
+            self._lead(key, call, func)
+        return call.future.result()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+# Process-wide coordinator of downloads, shared by the API endpoints and the job workers
+flight = SingleFlight()
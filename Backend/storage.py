@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""Disk-space-aware manager for the temporary download directory.
+
+Entries are swept by age and under disk pressure; a shared file lock keeps entries
+another worker process is using.
+
+    TEMP_DOWNLOAD_DIR - the temp root (default: temp_downloads next to this module)
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from metrics import span
+
+try:
+    import fcntl
+except ImportError:  # Windows - a single worker process, no entry locks
+    fcntl = None
+
+# Temp root of the API, shared by every worker process; next to this module unless configured,
+# so tools importing the backend from another directory (GUI, CLI) use the same one
+TEMP_DOWNLOAD_DIR = Path(os.environ.get("TEMP_DOWNLOAD_DIR") or Path(__file__).resolve().parent / "temp_downloads")
+STATE_DIR = TEMP_DOWNLOAD_DIR / ".state"
+
+STORAGE_QUOTA_BYTES = int(os.environ.get("STORAGE_QUOTA_BYTES", 5 * 1024 ** 3))
+STORAGE_HIGH_WATERMARK = float(os.environ.get("STORAGE_HIGH_WATERMARK", 0.9))
+STORAGE_LOW_WATERMARK = float(os.environ.get("STORAGE_LOW_WATERMARK", 0.7))
+# New work is refused when the filesystem has less than this free
+STORAGE_MIN_FREE_BYTES = int(os.environ.get("STORAGE_MIN_FREE_BYTES", 1024 ** 3))
+STORAGE_SWEEP_INTERVAL = float(os.environ.get("STORAGE_SWEEP_INTERVAL", 60))
+# Idle entries older than this are removed by the sweeper
+TEMP_MAX_AGE = float(os.environ.get("TEMP_MAX_AGE", 3600))
+# Seconds a free disk space reading is reused by admission checks
+DISK_FREE_TTL = 1.0
+# Lock files the entries of a temp root are hashed into
+ENTRY_LOCK_BUCKETS = 256
+
+class StorageFull(Exception):
+    """Raised by ``admit()`` when there is no room for new work"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def _measure(path):
+    """Bytes used by a file or directory tree"""
+    try:
+        if not path.is_dir():
+            return path.stat().st_size
+    except OSError:
+        return 0
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+class StorageManager:
+    """Quota, watermarks and oldest-first eviction for the temp download directory"""
+
+    def __init__(self, root, quota=STORAGE_QUOTA_BYTES, high=STORAGE_HIGH_WATERMARK,
+                 low=STORAGE_LOW_WATERMARK, min_free=STORAGE_MIN_FREE_BYTES,
+                 interval=STORAGE_SWEEP_INTERVAL, max_age=TEMP_MAX_AGE, keep=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.lock_dir = self.root / ".state" / "entries"
+        self.quota = quota
+        self.high = high
+        self.low = low
+        self.min_free = min_free
+        self.interval = interval
+        self.max_age = max_age
+        # Callable returning resolved paths the sweeper must not age out (resumable partials)
+        self.keep = keep or (lambda: set())
+
+        self._lock = threading.Lock()
+        # resolved path -> {"size", "last_used", "users", "holds"}
+        self._entries = {}
+        self._bytes = 0
+        self._stopping = threading.Event()
+        # Set to run a sweep before the interval is up
+        self._wake = threading.Event()
+        self._sweep_requested = None
+        self._thread = None
+        self._free = None
+        self._free_checked = 0.0
+
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.expired = 0
+        self.refused = 0
+        self.sweeps = 0
+        self.last_sweep = None
+
+    # ---- public API ----
+    def acquire(self, name):
+        """Create (or reuse) the work directory ``name`` and mark it in use"""
+        path = (self.root / name).resolve()
+        # Waits while another process is evicting this directory
+        hold = self._entry_lock(path, exclusive=False)
+        path.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                entry = self._entries[path] = {"size": _measure(path), "last_used": time.time(), "users": 0}
+                self._bytes += entry["size"]
+            entry["users"] += 1
+            entry["last_used"] = time.time()
+            entry.setdefault("holds", []).append(hold)
+        return path
+
+    def release(self, path, delete=False):
+        """Mark a work directory idle again; ``delete`` removes it right away"""
+        path = Path(path).resolve()
+        hold = None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                entry["users"] = max(entry["users"] - 1, 0)
+                entry["last_used"] = time.time()
+                if entry.get("holds"):
+                    hold = entry["holds"].pop()
+        if hold is not None:
+            hold.close()
+        if delete:
+            self.remove(path)
+        else:
+            self._resize(path)
+
+    def remove(self, path):
+        """Delete a work directory (or file) and drop it from the index, unless it is still in use"""
+        return self._evict(Path(path).resolve())
+
+    def retain(self, path, seconds):
+        """Keep an idle entry for at least ``seconds`` more (a served file stays resumable), then expire it"""
+        path = Path(path).resolve()
+        if not path.exists():
+            return
+        size = _measure(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                entry = self._entries[path] = {"size": size, "last_used": time.time(), "users": 0}
+                self._bytes += size
+            entry["last_used"] = time.time()
+            entry["expires_at"] = max(entry.get("expires_at", 0), time.time() + seconds)
+
+    def admit(self):
+        """Raise ``StorageFull`` if there is no room for another download (no disk scan, no deletes)"""
+        if self.has_capacity():
+            return
+        with self._lock:
+            self.refused += 1
+            used = self._bytes
+            # Retry soon if the sweep asked for by has_capacity has not run yet
+            pending = self.last_sweep is None or self.last_sweep < self._sweep_requested
+        raise StorageFull(
+            f"Temporary storage is full ({used} of {self.quota} bytes in use, "
+            f"{self._disk_free(cached=True)} bytes free on disk)",
+            retry_after=1 if pending else max(1, int(self.interval))
+        )
+
+    def has_capacity(self):
+        """True if a new download fits; otherwise wakes the sweeper to make room"""
+        if self._fits():
+            return True
+        self.request_sweep()
+        return False
+
+    def request_sweep(self):
+        """Have the sweeper thread run a sweep now instead of at the next interval"""
+        with self._lock:
+            self._sweep_requested = time.time()
+        self._wake.set()
+
+    def start(self):
+        """Start the background sweeper; it first indexes what a previous run left behind"""
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._sweeper, name="storage-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+
+    def sweep(self):
+        """Expire old idle entries, then evict oldest-first if over the high watermark or low on disk"""
+        now = time.time()
+        keep = self.keep()
+        for path in self._in_use():
+            self._resize(path)
+
+        for last_used, path in self._idle():
+            with self._lock:
+                expires_at = self._entries.get(path, {}).get("expires_at")
+            expired = now > expires_at if expires_at else now - last_used > self.max_age
+            if expired and path not in keep and self._evict(path):
+                self.expired += 1
+                print(f"Cleaned up temp entry: {path}")
+
+        if self._over_high():
+            for _, path in self._idle():
+                if self._under_low():
+                    break
+                if path in keep:
+                    continue
+                size = self._entries.get(path, {}).get("size", 0)
+                if self._evict(path):
+                    self.evictions += 1
+                    self.evicted_bytes += size
+                    print(f"Evicted temp entry under storage pressure: {path} ({size} bytes)")
+
+        self.sweeps += 1
+        self.last_sweep = time.time()
+
+    def stats(self):
+        """Current usage and sweeper counters"""
+        try:
+            disk = shutil.disk_usage(self.root)
+            disk_total, disk_free = disk.total, disk.free
+        except OSError:
+            disk_total = disk_free = None
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "entries": len(self._entries),
+                "in_use": sum(1 for entry in self._entries.values() if entry["users"]),
+                "quota_bytes": self.quota,
+                "high_watermark_bytes": int(self.quota * self.high),
+                "low_watermark_bytes": int(self.quota * self.low),
+                "disk_total_bytes": disk_total,
+                "disk_free_bytes": disk_free,
+                "min_free_bytes": self.min_free,
+                "accepting": self._bytes < self.quota and (disk_free is None or disk_free >= self.min_free),
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "expired": self.expired,
+                "refused": self.refused,
+                "sweeps": self.sweeps,
+                "last_sweep": self.last_sweep,
+            }
+
+    # ---- internals ----
+    def _scan(self):
+        """One pass over the temp root, for entries not created through ``acquire``"""
+        for child in self.root.iterdir():
+            if child.name.startswith("."):
+                continue
+            path = child.resolve()
+            try:
+                last_used = child.stat().st_mtime
+            except OSError:
+                continue
+            size = _measure(path)
+            with self._lock:
+                if path in self._entries:
+                    continue
+                self._entries[path] = {"size": size, "last_used": last_used, "users": 0}
+                self._bytes += size
+
+    def _sweeper(self):
+        try:
+            self._scan()
+            self.sweep()
+        except Exception as e:
+            print(f"Storage scan failed: {e}")
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping.is_set():
+                return
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Storage sweep failed: {e}")
+
+    def _in_use(self):
+        with self._lock:
+            return [path for path, entry in self._entries.items() if entry["users"]]
+
+    def _idle(self):
+        """(last_used, path) of entries no download is using, oldest first"""
+        with self._lock:
+            return sorted(
+                ((entry["last_used"], path) for path, entry in self._entries.items() if not entry["users"]),
+                key=lambda item: item[0]
+            )
+
+    def _resize(self, path):
+        size = _measure(path) if path.exists() else None
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+            if size is None and not entry["users"]:
+                self._forget(path)
+                return
+            self._bytes += (size or 0) - entry["size"]
+            entry["size"] = size or 0
+
+    def _evict(self, path):
+        """Delete an entry unless a download in this or another process is using it"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry["users"]:
+                return False
+        lock = self._entry_lock(path, exclusive=True)
+        if lock is False:
+            return False
+        try:
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry["users"]:
+                    return False
+                self._forget(path)
+            self._delete(path)
+        finally:
+            if lock is not None:
+                lock.close()
+        return True
+
+    def _entry_lock(self, path, exclusive):
+        """Open file holding the entry's shared (blocking) or exclusive (non-blocking) lock
+
+        Returns None without fcntl, and False if the exclusive lock is taken.
+        """
+        if fcntl is None:
+            return None
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        bucket = int(hashlib.sha256(path.name.encode()).hexdigest(), 16) % ENTRY_LOCK_BUCKETS
+        f = open(self.lock_dir / f"{bucket:03d}.lock", "a")
+        try:
+            fcntl.flock(f, (fcntl.LOCK_EX | fcntl.LOCK_NB) if exclusive else fcntl.LOCK_SH)
+        except BlockingIOError:
+            f.close()
+            return False
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def _forget(self, path):
+        """Drop an entry from the index (call with the lock held)"""
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    @staticmethod
+    def _delete(path):
+        try:
+            with span("cleanup"):
+                if path.is_dir():
+                    shutil.rmtree(path)
+                elif path.exists():
+                    path.unlink()
+        except OSError as e:
+            print(f"Error cleaning up {path}: {e}")
+
+    def _disk_free(self, cached=False):
+        now = time.monotonic()
+        if cached and now - self._free_checked < DISK_FREE_TTL:
+            return self._free
+        try:
+            free = shutil.disk_usage(self.root).free
+        except OSError:
+            free = None
+        self._free, self._free_checked = free, now
+        return free
+
+    def _fits(self):
+        free = self._disk_free(cached=True)
+        with self._lock:
+            used = self._bytes
+        return used < self.quota and (free is None or free >= self.min_free)
+
+    def _over_high(self):
+        free = self._disk_free()
+        with self._lock:
+            used = self._bytes
+        return used > self.quota * self.high or (free is not None and free < self.min_free)
+
+    def _under_low(self):
+        free = self._disk_free()
+        with self._lock:
+            used = self._bytes
+        return used <= self.quota * self.low and (free is None or free >= self.min_free)
@@ -0,0 +1,40 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+BACKEND = Path(__file__).resolve().parent.parent
+# Backend modules are flat top-level modules
+sys.path.insert(0, str(BACKEND))
+# State of the modules imported by the tests themselves (main included) goes to a throwaway directory
+TEST_STATE = Path(tempfile.mkdtemp(prefix="yt_audio_tests_"))
+os.environ.update({
+    "PRESET_CHOICES_FILE": str(TEST_STATE / "presets.json"),
+    "TEMP_DOWNLOAD_DIR": str(TEST_STATE / "temp_downloads"),
+    "RESULT_CACHE_DIR": str(TEST_STATE / "result_cache"),
+    "JOBS_DIR": str(TEST_STATE / "jobs"),
+})
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+
+
+def run_api_script(script, workdir, **env):
+    """Run ``script`` (which imports main) in its own working directory and return the JSON it prints last
+
+    For scenarios that need a fresh API process: its own state directories,
+    caches and job queue, and a server started from scratch.
+    """
+    workdir = Path(workdir)
+    env = {**os.environ, "PYTHONPATH": str(BACKEND), "PRESET_PROFILE": "0", "WARMUP": "0",
+           "BANDWIDTH_MODE": "offline", "PRESET_CHOICES_FILE": str(workdir / "presets.json"),
+           "TEMP_DOWNLOAD_DIR": str(workdir / "temp_downloads"), "RESULT_CACHE_DIR": str(workdir / "result_cache"),
+           "JOBS_DIR": str(workdir / "jobs"), **env}
+    run = subprocess.run([sys.executable, "-c", script], cwd=workdir, env=env,
+                         capture_output=True, text=True, timeout=120)
+    assert run.returncode == 0, run.stderr
+    return json.loads(run.stdout.strip().splitlines()[-1])
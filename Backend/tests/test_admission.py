@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import admission as admission_module
+from admission import AdmissionController, Rejected, TokenBucket
+
+
+def controller(**kwargs):
+    kwargs = {"max_active": 1, "queue_size": 2, "queue_timeout": 0.2, "max_load": 0,
+              "rate_per_minute": 0, "burst": 1, **kwargs}
+    return AdmissionController(**kwargs)
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission_module.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=2, burst=2)
+    assert bucket.take() == 0 and bucket.take() == 0
+    assert bucket.take() == pytest.approx(0.5)
+    now[0] += 0.5
+    assert bucket.take() == 0
+    assert not bucket.full()
+    now[0] += 1
+    assert bucket.full()
+
+
+def test_rate_limit_is_per_client():
+    gate = controller(rate_per_minute=60, burst=2)
+    gate.check_rate("a")
+    gate.check_rate("a")
+    with pytest.raises(Rejected) as refused:
+        gate.check_rate("a")
+    assert refused.value.status == 429 and refused.value.retry_after == 1
+    gate.check_rate("b")
+
+
+def test_queue_timeout_and_full_queue():
+    async def scenario():
+        gate = controller(queue_size=1)
+        held = await gate.acquire("a")
+        waiting = asyncio.create_task(gate.acquire("b"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(Rejected) as full:
+            await gate.acquire("c")
+        with pytest.raises(Rejected) as timed_out:
+            await waiting
+        gate.release(held)
+        return gate, full.value, timed_out.value
+
+    gate, full, timed_out = asyncio.run(scenario())
+    assert (full.status, full.reason) == (503, "queue_full")
+    assert (timed_out.status, timed_out.reason) == (503, "queue_timeout")
+    assert full.retry_after >= 1 and timed_out.retry_after >= 1
+    assert gate.active == 0 and gate.stats()["waiting"] == 0
+
+
+def test_slot_released_from_a_thread_goes_to_the_oldest_waiter():
+    async def scenario():
+        gate = controller(queue_timeout=5)
+        gate.hold_slot()
+        first = asyncio.create_task(gate.acquire("a"))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(gate.acquire("b"))
+        await asyncio.sleep(0.05)
+        threading.Thread(target=gate.release).start()
+        await asyncio.wait_for(first, 5)
+        assert not second.done() and gate.active == 1
+        gate.release()
+        await asyncio.wait_for(second, 5)
+        gate.release()
+        return gate
+
+    assert asyncio.run(scenario()).active == 0
+
+
+def test_worker_threads_count_against_the_cap():
+    gate = controller(max_active=2)
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        with gate.hold():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert peak[0] == 2 and gate.active == 0
+
+
+def test_refusals_carry_retry_after(monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, "admission", controller(rate_per_minute=60, burst=1, queue_size=0))
+    client = TestClient(main.app)
+    # A request that never gets a slot: the only one is taken and nobody may queue
+    main.admission.hold_slot()
+    body = {"url": "https://youtu.be/dQw4w9WgXcQ", "convert_mp3": True, "keep_original": False}
+    busy = client.post("/download-file", json=body)
+    assert busy.status_code == 503 and int(busy.headers["retry-after"]) >= 1
+    limited = client.post("/download-file", json=body)
+    assert limited.status_code == 429 and int(limited.headers["retry-after"]) >= 1
+
+
+def test_jobs_and_batch_items_hold_a_slot_while_downloading(monkeypatch, tmp_path):
+    import main
+
+    monkeypatch.setattr(main, "admission", controller(max_active=2))
+    seen = []
+
+    def produce(url, target, keep_original, key, hook=None, preset=None):
+        seen.append(main.admission.active)
+        path = tmp_path / f"{len(seen)}.mp3"
+        path.write_bytes(b"mp3")
+        return {"path": path, "size": 3, "title": "song"}
+
+    monkeypatch.setattr(main, "produce_cached_result", produce)
+    main.run_job("https://youtu.be/dQw4w9WgXcQ", {"output_format": "mp3", "preset": "mp3-320"}, None)
+    main.produce_batch_item("https://youtu.be/oHg5SJYRHA0", "mp3", "mp3-320")
+    assert seen == [1, 1] and main.admission.active == 0
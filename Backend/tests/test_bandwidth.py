@@ -0,0 +1,76 @@
+import contextlib
+import threading
+import time
+
+import pytest
+
+import bandwidth
+import downloader_core
+from bandwidth import BandwidthEstimator, StaticEstimator, set_estimator
+from downloader_core import choose_connections, download_audio_from_youtube
+
+
+class Stop(Exception):
+    def __str__(self):
+        return "stopped before the transfer"
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    """Options the downloader hands to yt-dlp; the download itself stops there"""
+    options = {}
+
+    def no_speedtest():
+        raise AssertionError("speedtest must not run inline")
+
+    @contextlib.contextmanager
+    def lease(opts, **overrides):
+        options.update(opts)
+        raise Stop()
+        yield
+
+    monkeypatch.setattr(bandwidth, "measure_download_speed", no_speedtest)
+    monkeypatch.setattr(downloader_core, "check_tool_exists", lambda tool: False)
+    monkeypatch.setattr(downloader_core.metadata_cache, "info", lambda url: {"id": "dQw4w9WgXcQ"})
+    monkeypatch.setattr(downloader_core.ydl_pool, "lease", lease)
+    yield options
+    set_estimator(None)
+
+
+def download(tmp_path):
+    with pytest.raises(RuntimeError, match="stopped before the transfer"):
+        download_audio_from_youtube("https://youtu.be/dQw4w9WgXcQ", output_dir=str(tmp_path))
+
+
+@pytest.mark.parametrize("mbps, connections", [(0, 1), (5, 1), (20, 4), (60, 8), (200, 16)])
+def test_connections_come_from_the_injected_estimate(captured, tmp_path, mbps, connections):
+    set_estimator(StaticEstimator(mbps))
+    download(tmp_path)
+    assert captured["concurrent_fragment_downloads"] == connections
+
+
+def test_stale_estimate_never_blocks_the_download(captured, tmp_path):
+    started = threading.Event()
+    finish = threading.Event()
+
+    def slow_speedtest():
+        started.set()
+        finish.wait(10)
+        return 500.0
+
+    estimator = BandwidthEstimator(cache_file=tmp_path / "bandwidth.json", ttl=60, mode="speedtest",
+                                   measure=slow_speedtest)
+    set_estimator(estimator)
+    begin = time.monotonic()
+    download(tmp_path)
+    # No estimate yet: one connection now, the speedtest runs in the background
+    assert time.monotonic() - begin < 1
+    assert captured["concurrent_fragment_downloads"] == 1
+    assert started.wait(5)
+    finish.set()
+
+    deadline = time.time() + 5
+    while estimator.current_mbps() != 500.0 and time.time() < deadline:
+        time.sleep(0.01)
+    download(tmp_path)
+    assert captured["concurrent_fragment_downloads"] == choose_connections(500.0) == 16
@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import io
+import json
+import threading
+import time
+import zipfile
+
+import pytest
+
+import batch
+from batch import ZipStream, expand_urls, is_collection_url, run_batch
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.youtube.com/playlist?list=PL123", True),
+    ("https://www.youtube.com/@someone/videos", True),
+    ("https://www.youtube.com/channel/UC123", True),
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ", False),
+    # A video watched inside a playlist is just that video
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PL123", False),
+    ("https://www.youtube.com/watch?list=PL123", True),
+])
+def test_is_collection_url(url, expected):
+    assert is_collection_url(url) == expected
+
+
+@pytest.fixture
+def playlists(monkeypatch):
+    extracted = []
+    playlists = {
+        "https://www.youtube.com/playlist?list=PL1": [
+            {"url": "https://youtu.be/a"},
+            {"_type": "playlist", "entries": [{"url": "https://youtu.be/b"}, None]},
+            {"url": "https://youtu.be/a"},
+            {"url": "https://youtu.be/c"},
+        ],
+    }
+
+    class FakeYdl:
+        def extract_info(self, url, download=False, process=True):
+            extracted.append(url)
+            return {"_type": "playlist", "entries": iter(playlists[url])}
+
+    class FakePool:
+        @contextlib.contextmanager
+        def lease(self, opts):
+            assert opts["extract_flat"]
+            yield FakeYdl()
+
+    monkeypatch.setattr(batch, "ydl_pool", FakePool())
+    return extracted
+
+
+def test_expand_urls_flattens_and_deduplicates(playlists):
+    urls = list(expand_urls([
+        "https://www.youtube.com/watch?v=x&list=PL1",
+        "https://www.youtube.com/playlist?list=PL1",
+        "https://youtu.be/c",
+    ]))
+    assert urls == [
+        "https://www.youtube.com/watch?v=x&list=PL1",
+        "https://youtu.be/a", "https://youtu.be/b", "https://youtu.be/c",
+    ]
+    assert playlists == ["https://www.youtube.com/playlist?list=PL1"]
+
+
+def test_expand_urls_stops_at_max_items(playlists):
+    urls = list(expand_urls(["https://www.youtube.com/playlist?list=PL1"], max_items=2))
+    assert urls == ["https://youtu.be/a", "https://youtu.be/b"]
+
+
+def test_run_batch_is_bounded():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def produce(url):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        if url == "bad":
+            raise RuntimeError("no such video")
+        return url.upper()
+
+    urls = ["a", "b", "bad", "c", "d", "e"]
+    results = {index: (result, error) for index, _, result, error in run_batch(iter(urls), produce, workers=2)}
+    assert peak[0] == 2
+    assert [results[i][0] for i in (0, 1, 3, 4, 5)] == ["A", "B", "C", "D", "E"]
+    assert isinstance(results[2][1], RuntimeError)
+
+
+def test_cancelled_batch_does_not_wait_for_running_items():
+    started = []
+    release = threading.Event()
+    cancelled = threading.Event()
+
+    def produce(url):
+        started.append(url)
+        release.wait(10)
+        return url
+
+    results = run_batch(["a", "b", "c", "d"], produce, workers=2, cancelled=cancelled)
+    threading.Timer(0.1, cancelled.set).start()
+    began = time.monotonic()
+    assert list(results) == []
+    assert time.monotonic() - began < 2
+    release.set()
+    time.sleep(0.1)
+    # Items that had not started are never produced
+    assert sorted(started) == ["a", "b"]
+
+
+def produce_file(tmp_path, delay=0):
+    def produce(url):
+        time.sleep(delay)
+        if url == "bad":
+            raise RuntimeError("no such video")
+        path = tmp_path / f"{url}.mp3"
+        path.write_bytes(url.encode() * 1000)
+        return {"path": path}
+    return produce
+
+
+async def consume(archive, limit=None):
+    body = b""
+    async for chunk in archive.iter_chunks():
+        body += chunk
+        if limit is not None and len(body) >= limit:
+            break
+    return body
+
+
+def test_zip_stream_contains_every_item_and_a_manifest(tmp_path):
+    archive = ZipStream(iter(["a", "bad", "b"]), produce_file(tmp_path), workers=2)
+    threading.Thread(target=archive.run).start()
+    body = asyncio.run(consume(archive))
+    with zipfile.ZipFile(io.BytesIO(body)) as result:
+        names = result.namelist()
+        assert names[-1] == "manifest.json"
+        assert result.read("001 - a.mp3") == b"a" * 1000
+        assert result.read("003 - b.mp3") == b"b" * 1000
+        manifest = json.loads(result.read("manifest.json"))
+    assert [item["status"] for item in manifest] == ["success", "error", "success"]
+
+
+def test_disconnect_stops_the_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "ZIP_BUFFER_CHUNKS", 1)
+    produced = []
+    slow = produce_file(tmp_path, delay=0.3)
+
+    def produce(url):
+        produced.append(url)
+        return slow(url)
+
+    archive = ZipStream(iter([f"item{i}" for i in range(20)]), produce, workers=2)
+    runner = threading.Thread(target=archive.run)
+    runner.start()
+    asyncio.run(consume(archive, limit=1))
+    runner.join(5)
+    assert not runner.is_alive()
+    # Items queued after the client left were never downloaded
+    assert len(produced) < 20
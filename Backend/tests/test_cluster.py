@@ -0,0 +1,226 @@
+import hashlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+from cluster import FORWARDED_HEADER, ClusterRouter, HashRing
+from result_cache import ResultCache, cache_key
+
+BACKEND = Path(__file__).resolve().parent.parent
+SECRET = "test-cluster-secret"
+PAYLOAD = os.urandom(200_000)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def request(headers=(), query=""):
+    return Request({
+        "type": "http", "method": "GET", "path": "/", "query_string": query.encode(),
+        "headers": [(name.encode(), value.encode()) for name, value in headers],
+    })
+
+
+# ---- trust of forwarded requests ----
+def test_cluster_refuses_to_start_without_secret():
+    with pytest.raises(ValueError):
+        ClusterRouter("http://a,http://b", "http://a", secret="")
+
+
+def test_forwarded_header_needs_the_secret():
+    router = ClusterRouter("http://a,http://b", "http://a", secret=SECRET)
+    assert router.is_forwarded(request([(FORWARDED_HEADER, SECRET)]))
+    assert not router.is_forwarded(request([(FORWARDED_HEADER, "http://b")]))
+    assert not router.is_forwarded(request())
+    # A forged header does not stop the request from being routed to its owner
+    assert not router.is_routed(request([(FORWARDED_HEADER, "guess")]))
+
+
+def test_forwarded_header_ignored_without_cluster():
+    router = ClusterRouter("", "", secret=SECRET)
+    assert not router.is_forwarded(request([(FORWARDED_HEADER, SECRET)]))
+
+
+# ---- several local nodes ----
+class Node:
+    def __init__(self, url, workdir, process):
+        self.url = url
+        self.workdir = workdir
+        self.process = process
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def start_nodes(tmp_path, mode, count=3, stage=None):
+    """``count`` uvicorn processes in cluster mode, each with its own working directory"""
+    urls = [f"http://127.0.0.1:{free_port()}" for _ in range(count)]
+    workdirs = [tmp_path / f"node{i}" for i in range(count)]
+    if stage:
+        stage(urls, workdirs)
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(BACKEND),
+        "CLUSTER_NODES": ",".join(urls),
+        "CLUSTER_MODE": mode,
+        "CLUSTER_SECRET": SECRET,
+        "CLUSTER_HEALTH_INTERVAL": "1",
+        "PRESET_PROFILE": "0",
+        "WARMUP": "0",
+        "BANDWIDTH_MODE": "offline",
+        # Relative to each node's working directory
+        "TEMP_DOWNLOAD_DIR": "temp_downloads",
+        "RESULT_CACHE_DIR": "result_cache",
+        "JOBS_DIR": "jobs",
+        "PRESET_CHOICES_FILE": "presets.json",
+    }
+    nodes = []
+    for url, workdir in zip(urls, workdirs):
+        workdir.mkdir(exist_ok=True)
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", url.rsplit(":", 1)[1]],
+            cwd=workdir, env={**env, "CLUSTER_SELF": url},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        nodes.append(Node(url, workdir, process))
+
+    deadline = time.time() + 60
+    for node in nodes:
+        while True:
+            try:
+                if httpx.get(f"{node.url}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if node.process.poll() is not None or time.time() > deadline:
+                for n in nodes:
+                    n.stop()
+                pytest.fail(f"node {node.url} did not start")
+            time.sleep(0.2)
+    return nodes
+
+
+@pytest.fixture
+def cluster_with_result(tmp_path):
+    """Start nodes with one cached result on the owner of a video; yields (nodes, owner, video path)"""
+    started = []
+    placed = {}
+
+    def stage(urls, workdirs):
+        ring = HashRing(urls)
+        video_id = next(f"vid{i:08d}" for i in range(1000) if ring.owner(f"vid{i:08d}") != urls[0])
+        owner = urls.index(ring.owner(video_id))
+        source = tmp_path / "song.mp3"
+        source.write_bytes(PAYLOAD)
+        key = cache_key(video_id, "mp3")
+        cache = ResultCache(workdirs[owner] / "result_cache")
+        cache.publish(key, source, title="song")
+        # The native file too, so jobs and batches of the video complete from the owner's cache
+        cache.publish(cache_key(video_id, "original"), source, title="song")
+        placed.update(owner=owner, path=f"/result/{video_id}/{hashlib.sha256(key.encode()).hexdigest()}")
+
+    def start(mode):
+        nodes = start_nodes(tmp_path / mode, mode, stage=stage)
+        started.extend(nodes)
+        return nodes, nodes[placed["owner"]], placed["path"]
+
+    yield start
+    for node in started:
+        node.stop()
+
+
+def test_forward_to_owner(cluster_with_result):
+    nodes, owner, path = cluster_with_result("forward")
+    entry = nodes[0]
+    assert entry is not owner
+
+    response = httpx.get(entry.url + path, timeout=30)
+    assert response.status_code == 200
+    assert response.content == PAYLOAD
+    assert response.headers["x-cluster-owner"] == owner.url
+    assert response.headers["etag"] == f'"{hashlib.sha256(PAYLOAD).hexdigest()}"'
+
+    # Range requests pass through the forward
+    response = httpx.get(entry.url + path, headers={"Range": "bytes=100-199"}, timeout=30)
+    assert response.status_code == 206
+    assert response.content == PAYLOAD[100:200]
+    assert httpx.get(f"{entry.url}/cluster", timeout=5).json()["forwarded"] == 2
+
+    # With the owner gone the entry node serves the video itself
+    owner.stop()
+    response = httpx.get(entry.url + path, timeout=30)
+    assert response.status_code == 404
+    assert "x-cluster-owner" not in response.headers
+
+
+def test_redirect_to_owner(cluster_with_result):
+    nodes, owner, path = cluster_with_result("redirect")
+    entry = nodes[0]
+
+    response = httpx.get(entry.url + path, timeout=30)
+    assert response.status_code == 307
+    assert response.headers["x-cluster-owner"] == owner.url
+    location = response.headers["location"]
+    assert location.startswith(owner.url + path) and "cluster_routed=1" in location
+
+    response = httpx.get(entry.url + path, follow_redirects=True, timeout=30)
+    assert response.status_code == 200
+    assert response.content == PAYLOAD
+    assert str(response.url).startswith(owner.url)
+
+
+def test_jobs_and_batches_run_on_owner(cluster_with_result):
+    nodes, owner, path = cluster_with_result("forward")
+    entry = nodes[0]
+    video_id = path.split("/")[2]
+    url = f"https://youtu.be/{video_id}"
+
+    response = httpx.post(f"{entry.url}/jobs", json={"url": url, "output_format": "native"}, timeout=30)
+    assert response.status_code == 202
+    assert response.headers["x-cluster-owner"] == owner.url
+    job_id = response.json()["job_id"]
+    assert job_id.startswith(f"{video_id}.")
+
+    # Any node finds the job through its id
+    deadline = time.time() + 30
+    while True:
+        response = httpx.get(f"{entry.url}/jobs/{job_id}", timeout=30)
+        assert response.status_code == 200
+        assert response.headers["x-cluster-owner"] == owner.url
+        if response.json()["status"] == "completed" or time.time() > deadline:
+            break
+        time.sleep(0.2)
+    assert response.json()["status"] == "completed"
+    assert httpx.get(f"{entry.url}/jobs/{job_id}/file", timeout=30).content == PAYLOAD
+
+    response = httpx.post(f"{entry.url}/batch", json={"urls": [url], "output_format": "native", "mode": "jobs"},
+                          timeout=30)
+    assert response.status_code == 202
+    job_id = response.json()["jobs"][0]["job_id"]
+    assert job_id.startswith(f"{video_id}.")
+    assert httpx.get(f"{owner.url}/jobs/{job_id}", timeout=30).status_code == 200
+
+    # A ZIP batch copies the item from its owner
+    response = httpx.post(f"{entry.url}/batch", json={"urls": [url], "output_format": "native", "mode": "zip"},
+                          timeout=60)
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.read("001 - song.mp3") == PAYLOAD
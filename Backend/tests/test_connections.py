@@ -0,0 +1,81 @@
+import json
+
+from connections import HOLD_WINDOWS, AIMDController, HostSettings, host_key
+
+
+def drive(controller, goodput, windows, errors=lambda connections: 0):
+    """Feed ``windows`` one-second windows of ``goodput(connections)`` bytes; returns the count after each"""
+    now, downloaded, failed = 0.0, 0, 0
+    controller.update(now, downloaded, failed)
+    targets = []
+    for _ in range(windows):
+        connections = controller.target
+        now += 1
+        downloaded += goodput(connections)
+        failed += errors(connections)
+        targets.append(controller.update(now, downloaded, failed))
+    return targets
+
+
+def measured(controller):
+    return [connections for connections, _ in controller.history]
+
+
+def test_slow_start_doubles_then_falls_back_to_the_best():
+    controller = AIMDController(1, maximum=16)
+    # Goodput stops growing at 8 connections
+    drive(controller, lambda n: min(n, 8) * 100_000, 12)
+    # Each change is followed by a warm-up window that is not measured
+    assert measured(controller)[:6] == [1, 2, 4, 8, 16, 8]
+    assert controller.best_connections == 8 and controller.target == 8
+
+
+def test_probes_one_connection_at_a_time_after_holding():
+    controller = AIMDController(1, maximum=16)
+    targets = drive(controller, lambda n: min(n, 8) * 100_000, 11 + HOLD_WINDOWS)
+    assert targets[-1] == 9
+    assert 16 not in targets[targets.index(8, targets.index(16)):]
+
+
+def test_errors_halve_the_count():
+    controller = AIMDController(4, maximum=16)
+    targets = drive(controller, lambda n: n * 100_000, 4 + 2 * HOLD_WINDOWS, errors=lambda n: n >= 8)
+    # 4 -> 8 by slow start, refused at 8: back to 4, then additive steps only
+    assert measured(controller)[:3] == [4, 8, 4]
+    assert max(targets[targets.index(4, 2):]) < 8
+
+
+def test_count_stays_within_bounds():
+    assert AIMDController(100, maximum=16).target == 16
+    controller = AIMDController(1, minimum=1, maximum=4)
+    targets = drive(controller, lambda n: 1000, 8, errors=lambda n: 1)
+    assert set(targets) == {1}
+
+
+def test_no_change_within_a_window():
+    controller = AIMDController(2, interval=1.0)
+    controller.update(0.0, 0)
+    assert controller.update(0.5, 10**9) == 2
+    assert controller.history == []
+
+
+def test_host_key_groups_cdn_edges():
+    assert host_key("https://rr3---sn-abc.googlevideo.com/videoplayback?x=1") == "googlevideo.com"
+    assert host_key("https://rr5---sn-xyz.googlevideo.com/videoplayback") == "googlevideo.com"
+    assert host_key("http://127.0.0.1:8000/a.mp3") == "127.0.0.1"
+    assert host_key("http://localhost/a.mp3") == "localhost"
+
+
+def test_host_settings_shared_and_expiring(tmp_path):
+    path = tmp_path / "connections.json"
+    settings = HostSettings(path, ttl=60)
+    assert settings.get("https://rr1---sn-a.googlevideo.com/v") is None
+    settings.record("https://rr1---sn-a.googlevideo.com/v", 6, 2_000_000)
+    # Another process reads the same file
+    assert HostSettings(path, ttl=60).get("https://rr9---sn-b.googlevideo.com/v") == 6
+
+    data = json.loads(path.read_text())
+    data["googlevideo.com"]["updated_at"] -= 61
+    path.write_text(json.dumps(data))
+    assert settings.get("https://rr1---sn-a.googlevideo.com/v") is None
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,18 @@
+import threading
+
+from executors import STREAM_WORKERS, download_executor, stream_executor
+
+
+def test_streams_do_not_take_download_workers():
+    assert stream_executor() is not download_executor()
+    # A long-running stream occupies a stream worker, not a download worker
+    release = threading.Event()
+    streams = [stream_executor().submit(release.wait, 10) for _ in range(STREAM_WORKERS)]
+    try:
+        assert download_executor().submit(lambda: threading.current_thread().name).result(5).startswith("download")
+        # Streams beyond STREAM_WORKERS wait for a free worker
+        extra = stream_executor().submit(lambda: True)
+        assert not extra.done()
+    finally:
+        release.set()
+    assert extra.result(5) and all(stream.result(5) for stream in streams)
@@ -0,0 +1,69 @@
+import pytest
+
+from formats import FormatNegotiator, ffmpeg_args, plan_conversion, resolve_preset, summarize
+
+OPUS = {"format_id": "251", "acodec": "opus", "vcodec": "none", "ext": "webm", "abr": 130}
+AAC = {"format_id": "140", "acodec": "mp4a.40.2", "vcodec": "none", "ext": "m4a", "abr": 128}
+AAC_LOW = {"format_id": "139", "acodec": "mp4a.40.5", "vcodec": "none", "ext": "m4a", "abr": 48}
+VIDEO = {"format_id": "18", "acodec": "mp4a.40.2", "vcodec": "avc1", "ext": "mp4", "abr": 96}
+YOUTUBE = [VIDEO, AAC_LOW, AAC, OPUS]
+
+
+def test_keep_native_takes_best_audio():
+    plan = plan_conversion(YOUTUBE, None)
+    assert plan["action"] == "none" and plan["format"] is OPUS
+
+
+def test_same_codec_and_container_needs_nothing():
+    plan = plan_conversion(YOUTUBE, "m4a")
+    assert (plan["action"], plan["format"], plan["preset"]) == ("none", AAC, "aac-192")
+
+
+def test_same_codec_other_container_is_remuxed():
+    plan = plan_conversion(YOUTUBE, "opus")
+    assert plan["action"] == "copy" and plan["format"] is OPUS
+    assert ffmpeg_args(plan) == ["-codec:a", "copy"]
+
+
+def test_no_compatible_source_is_transcoded():
+    plan = plan_conversion(YOUTUBE, "mp3", "mp3-v2")
+    assert plan["action"] == "transcode" and plan["format"] is OPUS
+    assert ffmpeg_args(plan) == ["-codec:a", "libmp3lame", "-q:a", "2"]
+    assert summarize(plan) == {"action": "transcode", "target": "mp3", "preset": "mp3-v2",
+                               "source_format": "251", "source_codec": "opus", "source_ext": "webm"}
+
+
+def test_source_far_above_the_preset_is_transcoded():
+    # 128 kbps AAC is more than the 96 kbps preset allows (with headroom), 48 kbps is not
+    plan = plan_conversion(YOUTUBE, "m4a", "aac-96")
+    assert plan["action"] == "none" and plan["format"] is AAC_LOW
+    plan = plan_conversion([AAC], "m4a", "aac-96")
+    assert plan["action"] == "transcode"
+
+
+def test_codec_from_container_when_unreported():
+    mp3 = {"format_id": "http", "ext": "mp3", "abr": 128}
+    assert plan_conversion([mp3], "mp3")["action"] == "none"
+
+
+def test_video_formats_only_without_audio_only():
+    assert plan_conversion([VIDEO], "m4a")["format"] is VIDEO
+    assert plan_conversion([], "mp3") is None
+
+
+def test_presets_must_match_the_target():
+    assert resolve_preset("mp3") == "mp3-320"
+    with pytest.raises(ValueError):
+        resolve_preset("mp3", "opus-64")
+    with pytest.raises(ValueError):
+        resolve_preset("mp3", "mp3-999")
+    with pytest.raises(ValueError):
+        FormatNegotiator("flac")
+
+
+def test_negotiator_yields_and_remembers_its_choice():
+    chosen = []
+    negotiator = FormatNegotiator("opus", on_select=chosen.append)
+    assert list(negotiator({"formats": YOUTUBE})) == [OPUS]
+    assert negotiator.plan["action"] == "copy" and chosen == [OPUS]
+    assert list(FormatNegotiator("mp3")({"formats": []})) == []
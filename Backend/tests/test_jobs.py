@@ -0,0 +1,88 @@
+import time
+
+from conftest import run_api_script
+from jobs import JobQueue
+
+
+def expire_lease(queue, job_id, attempts):
+    """Leave a job as a crashed worker would: running, with a lease in the past"""
+    with queue._connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'running', attempts = ?, lease_until = ? WHERE id = ?",
+            (attempts, time.time() - 1, job_id)
+        )
+
+
+def test_expired_lease_is_reclaimed_before_the_last_attempt(tmp_path):
+    queue = JobQueue(lambda url, options, hook: {}, jobs_dir=tmp_path, max_attempts=3)
+    job_id = queue.submit("https://youtu.be/dQw4w9WgXcQ")
+    expire_lease(queue, job_id, 2)
+    job = queue._claim()
+    assert job["id"] == job_id and job["attempts"] == 3
+
+
+def test_expired_lease_on_the_last_attempt_fails_the_job(tmp_path):
+    queue = JobQueue(lambda url, options, hook: {}, jobs_dir=tmp_path, max_attempts=3)
+    lost = queue.submit("https://youtu.be/dQw4w9WgXcQ", priority=1)
+    waiting = queue.submit("https://youtu.be/jNQXAC9IVRw")
+    expire_lease(queue, lost, 3)
+    # The lost job is failed and the next runnable one is claimed instead
+    assert queue._claim()["id"] == waiting
+    job = queue.get(lost)
+    assert job["status"] == "failed" and job["attempts"] == 3
+    assert "attempt 3 of 3" in job["error"]
+
+
+API_JOBS = r"""
+import json, os, time
+from pathlib import Path
+import main
+from fastapi.testclient import TestClient
+
+calls = []
+def fake_download(url, output_dir, keep_original, progress_hook, output_format, preset):
+    calls.append(url)
+    time.sleep(0.5)
+    Path(output_dir, "song.mp3").write_bytes(b"ID3" + bytes(1000))
+    return {"title": "song", "files": [{"name": "song.mp3", "type": "mp3"}]}
+main.download_audio_from_youtube = fake_download
+
+seen = []
+release = main.storage.release
+main.storage.release = lambda path, delete=False: (seen.append(Path(path).name), release(path, delete))[1]
+
+ids = [main.job_queue.submit("https://youtu.be/dQw4w9WgXcQ", {"output_format": "mp3", "preset": "mp3-320"})
+       for _ in range(2)]
+main.job_queue.start()
+deadline = time.time() + 20
+while time.time() < deadline and any(main.job_queue.get(i)["status"] != "completed" for i in ids):
+    time.sleep(0.05)
+main.job_queue.stop()
+
+client = TestClient(main.app)
+jobs = [client.get(f"/jobs/{i}").json() for i in ids]
+file = client.get(f"/jobs/{ids[0]}/file")
+print(json.dumps({
+    "calls": len(calls),
+    "status": [job["status"] for job in jobs],
+    "locations": [job["result"]["content_location"] for job in jobs],
+    "work_dirs": seen,
+    "file_status": file.status_code,
+    "file_size": len(file.content),
+    "file_location": file.headers.get("content-location"),
+    "jobs_dir": sorted(os.listdir("jobs")),
+}))
+"""
+
+
+def test_identical_jobs_share_one_download(tmp_path):
+    report = run_api_script(API_JOBS, tmp_path, JOB_WORKERS="2")
+
+    assert report["calls"] == 1
+    assert report["status"] == ["completed", "completed"]
+    assert report["locations"][0] == report["locations"][1]
+    # The download ran in a work directory of the storage manager, not a job directory
+    assert report["work_dirs"] == ["work_dQw4w9WgXcQ_mp3-320"]
+    assert all(name.startswith("jobs.sqlite3") for name in report["jobs_dir"])
+    assert report["file_status"] == 200 and report["file_size"] == 1003
+    assert report["file_location"] == report["locations"][0]
@@ -0,0 +1,179 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+from conftest import run_api_script
+from pipeline import LiveTranscode, TranscodeError
+
+LIVE_CLEANUP = r"""
+import asyncio, concurrent.futures, json, threading
+import main
+from starlette.requests import Request
+
+class FakeYdl:
+    def prepare_filename(self, info):
+        return "song.webm"
+
+class StartingTranscode:
+    # ffmpeg never gets ready: the client gives up first
+    instances = []
+    def __init__(self, ydl, info, *args, release=None, **kwargs):
+        self.ready = concurrent.futures.Future()
+        self.cancelled = False
+        StartingTranscode.instances.append(self)
+    def run(self):
+        pass
+    def cancel(self):
+        self.cancelled = True
+
+released = []
+main.ydl_pool.release = lambda ydl, discard=False: released.append(ydl)
+main.LiveTranscode = StartingTranscode
+request = main.DownloadRequest(url="https://youtu.be/dQw4w9WgXcQ", convert_mp3=True, keep_original=False)
+
+def http_request():
+    return Request({"type": "http", "method": "POST", "path": "/download-live", "query_string": b"",
+                    "headers": [], "client": ("203.0.113.7", 5000)})
+
+async def disconnect_during(resolve):
+    main.resolve_live_stream = resolve
+    task = asyncio.create_task(main.download_live(request, http_request()))
+    await asyncio.sleep(0.3)
+    busy = main.admission.active
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return busy
+
+async def scenario():
+    report = {}
+    ydl = FakeYdl()
+    report["busy_starting"] = await disconnect_during(lambda url: (ydl, {"id": "dQw4w9WgXcQ"}))
+    report["slots_after_starting"] = main.admission.active
+    report["transcode_cancelled"] = StartingTranscode.instances[0].cancelled
+
+    gate = threading.Event()
+    slow_ydl = FakeYdl()
+    def slow_resolve(url):
+        gate.wait(10)
+        return slow_ydl, {"id": "dQw4w9WgXcQ"}
+    report["busy_resolving"] = await disconnect_during(slow_resolve)
+    report["slots_after_resolving"] = main.admission.active
+    gate.set()
+    await asyncio.sleep(0.3)
+    report["ydl_released"] = slow_ydl in released
+    return report
+
+print(json.dumps(asyncio.run(scenario())))
+"""
+
+LIVE_ABORT = r"""
+import json, socket, threading, time
+import httpx, uvicorn
+import main
+from pipeline import LiveTranscode, TranscodeError
+
+class FakeYdl:
+    def prepare_filename(self, info):
+        return "song.webm"
+
+class FailingTranscode(LiveTranscode):
+    # Sends some audio, then the encoder fails after the headers went out
+    def run(self):
+        self.ready.set_result(True)
+        self.chunks.put(b"\xff\xfb" * 1000)
+        self.chunks.put(TranscodeError("ffmpeg exited with 1"))
+
+main.LiveTranscode = FailingTranscode
+main.resolve_live_stream = lambda url: (FakeYdl(), {"id": "dQw4w9WgXcQ"})
+main.ydl_pool.release = lambda ydl, discard=False: None
+
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+server = uvicorn.Server(uvicorn.Config(main.app, port=port, log_level="critical"))
+threading.Thread(target=server.run, daemon=True).start()
+while not server.started:
+    time.sleep(0.05)
+
+report = {}
+body = b""
+try:
+    with httpx.stream("POST", f"http://127.0.0.1:{port}/download-live", timeout=10,
+                      json={"url": "https://youtu.be/dQw4w9WgXcQ", "convert_mp3": True, "keep_original": False}) as r:
+        report["status"] = r.status_code
+        for chunk in r.iter_bytes():
+            body += chunk
+    report["outcome"] = "complete"
+except httpx.HTTPError as e:
+    report["outcome"] = type(e).__name__
+report["received"] = len(body)
+report["slots"] = main.admission.active
+server.should_exit = True
+print(json.dumps(report))
+"""
+
+
+def test_disconnect_releases_slot_and_transcode(tmp_path):
+    report = run_api_script(LIVE_CLEANUP, tmp_path)
+    assert report["busy_starting"] == 1 and report["busy_resolving"] == 1
+    assert report["slots_after_starting"] == 0 and report["slots_after_resolving"] == 0
+    assert report["transcode_cancelled"]
+    assert report["ydl_released"]
+
+
+def test_failure_after_headers_aborts_the_response(tmp_path):
+    report = run_api_script(LIVE_ABORT, tmp_path)
+    assert report["status"] == 200
+    # The client sees a broken transfer, not a short file that looks complete
+    assert report["outcome"] == "RemoteProtocolError"
+    assert report["received"] == 2000
+    assert report["slots"] == 0
+
+
+def test_iter_chunks_raises_stream_errors():
+    live = LiveTranscode(None, {}, [], release=lambda ydl: None)
+    live.ready = concurrent.futures.Future()
+    live.chunks.put(b"audio")
+    live.chunks.put(TranscodeError("ffmpeg exited with 1"))
+
+    async def consume():
+        return [chunk async for chunk in live.iter_chunks()]
+
+    with pytest.raises(TranscodeError):
+        asyncio.run(consume())
+    assert live.cancelled.is_set()
+
+
+def test_waiting_for_chunks_takes_no_thread():
+    live = LiveTranscode(None, {}, [], release=lambda ydl: None)
+
+    def produce():
+        for chunk in (b"a", b"b", b"c"):
+            time.sleep(0.05)
+            live.chunks.put(chunk)
+        live.chunks.put(LiveTranscode._EOF)
+
+    async def consume():
+        threading.Thread(target=produce).start()
+        chunks = [chunk async for chunk in live.iter_chunks()]
+        # The consumer was woken from the producer thread, not polled from an executor
+        return chunks, asyncio.get_running_loop()._default_executor
+
+    chunks, executor = asyncio.run(consume())
+    assert chunks == [b"a", b"b", b"c"] and executor is None
+
+
+def test_cancel_wakes_a_waiting_consumer():
+    live = LiveTranscode(None, {}, [], release=lambda ydl: None)
+
+    async def consume():
+        asyncio.get_running_loop().call_later(0.1, live.cancel)
+        return [chunk async for chunk in live.iter_chunks()]
+
+    assert asyncio.run(asyncio.wait_for(consume(), 5)) == []
@@ -0,0 +1,99 @@
+import threading
+import time
+import types
+
+import pytest
+
+import metadata
+from metadata import URL_EXPIRY_MARGIN, MetadataCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable time seen by the metadata module"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(metadata, "time", types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def cache_of(infos, **kwargs):
+    """MetadataCache whose extractions return the next of ``infos``, counting the calls"""
+    cache = MetadataCache(lambda url: url.rsplit("/", 1)[1], **kwargs)
+    cache.extractions = []
+
+    def extract(url):
+        cache.extractions.append(url)
+        return infos[len(cache.extractions) - 1]
+
+    cache._extract = extract
+    return cache
+
+
+def test_hit_until_ttl_expires(clock):
+    cache = cache_of([{"title": "first"}, {"title": "second"}], ttl=60)
+    assert cache.lookup("https://youtu.be/a") == ({"title": "first"}, False)
+    clock[0] += 59
+    assert cache.lookup("https://youtu.be/a") == ({"title": "first"}, True)
+    clock[0] += 1
+    assert cache.lookup("https://youtu.be/a") == ({"title": "second"}, False)
+    assert cache.stats() == {"hits": 1, "misses": 2, "entries": 1}
+
+
+def test_entries_expire_before_their_stream_urls(clock):
+    expire = int(clock[0]) + URL_EXPIRY_MARGIN + 100
+    signed = {"formats": [{"url": f"https://cdn.example/a?expire={expire}&sig=x"}, {"url": "https://cdn.example/b"}]}
+    cache = cache_of([signed, signed], ttl=3600)
+    cache.lookup("https://youtu.be/a")
+    clock[0] += 99
+    assert cache.lookup("https://youtu.be/a")[1]
+    clock[0] += 1
+    assert not cache.lookup("https://youtu.be/a")[1]
+
+
+def test_already_expired_urls_are_not_cached(clock):
+    expire = int(clock[0]) + URL_EXPIRY_MARGIN
+    cache = cache_of([{"url": f"https://cdn.example/a?expire={expire}"}] * 2)
+    cache.lookup("https://youtu.be/a")
+    cache.lookup("https://youtu.be/a")
+    assert len(cache.extractions) == 2 and cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_dropped(clock):
+    cache = cache_of([{"id": "a"}, {"id": "b"}, {"id": "c"}, {"id": "b2"}], max_entries=2)
+    cache.lookup("https://youtu.be/a")
+    cache.lookup("https://youtu.be/b")
+    cache.lookup("https://youtu.be/a")
+    cache.lookup("https://youtu.be/c")
+    assert cache.lookup("https://youtu.be/a")[1]
+    assert cache.lookup("https://youtu.be/b") == ({"id": "b2"}, False)
+
+
+def test_lookups_return_private_copies(clock):
+    cache = cache_of([{"formats": [{"url": "https://cdn.example/a"}]}])
+    cache.info("https://youtu.be/a")["formats"].clear()
+    assert cache.info("https://youtu.be/a")["formats"] == [{"url": "https://cdn.example/a"}]
+
+
+def test_invalidate(clock):
+    cache = cache_of([{"title": "first"}, {"title": "second"}])
+    cache.lookup("https://youtu.be/a")
+    cache.invalidate("https://youtu.be/a")
+    assert cache.info("https://youtu.be/a") == {"title": "second"}
+
+
+def test_concurrent_lookups_share_one_extraction():
+    gate = threading.Event()
+    cache = cache_of([{"title": "only"}])
+    extract = cache._extract
+    cache._extract = lambda url: (gate.wait(5), extract(url))[1]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.info("https://youtu.be/a")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [{"title": "only"}] * 4
+    assert len(cache.extractions) == 1
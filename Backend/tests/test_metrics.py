@@ -0,0 +1,86 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import metrics
+from metrics import Registry, span, stats_samples, trace
+
+
+def test_counter_and_gauge_render_with_labels():
+    registry = Registry()
+    requests = registry.counter("app_requests_total", "Requests", ["route"])
+    active = registry.gauge("app_active", "Active work")
+    requests.inc(route="/b")
+    requests.inc(2, route='/a"\n')
+    active.inc()
+    active.inc(0.5)
+    assert registry.render().splitlines() == [
+        "# HELP app_requests_total Requests",
+        "# TYPE app_requests_total counter",
+        'app_requests_total{route="/a\\"\\n"} 2',
+        'app_requests_total{route="/b"} 1',
+        "# HELP app_active Active work",
+        "# TYPE app_active gauge",
+        "app_active 1.5",
+    ]
+    with pytest.raises(ValueError):
+        requests.inc(status="200")
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    seconds = registry.histogram("app_seconds", "Time", ["stage"], buckets=(1, 5))
+    for value in (0.5, 2, 2, 10):
+        seconds.observe(value, stage="x")
+    assert registry.render().splitlines()[2:] == [
+        'app_seconds_bucket{stage="x",le="1"} 1',
+        'app_seconds_bucket{stage="x",le="5"} 3',
+        'app_seconds_bucket{stage="x",le="+Inf"} 4',
+        'app_seconds_sum{stage="x"} 14.5',
+        'app_seconds_count{stage="x"} 4',
+    ]
+
+
+def test_collectors_read_at_scrape_time():
+    registry = Registry()
+    stats = {"hits": 1, "entries": 3, "enabled": True, "mode": "lru", "ratio": None}
+    registry.collector(lambda: stats_samples("app_cache", stats, "Cache", counters=("hits",)))
+
+    @registry.collector
+    def broken():
+        raise RuntimeError("component gone")
+
+    text = registry.render()
+    assert "# TYPE app_cache_hits_total counter\napp_cache_hits_total 1\n" in text
+    assert "# TYPE app_cache_entries gauge\napp_cache_entries 3\n" in text
+    assert "app_cache_enabled 1\n" in text
+    assert "mode" not in text and "ratio" not in text
+    stats["hits"] = 5
+    assert "app_cache_hits_total 5\n" in registry.render()
+
+
+def test_spans_feed_metrics_and_the_trace():
+    before = metrics.STAGE_ERRORS._values.get((("stage", "cleanup"), ("error", "OSError")), 0)
+    with trace("job") as job:
+        with span("download", url="u"):
+            with trace("nested") as inner:
+                assert inner is job
+        with pytest.raises(OSError):
+            with span("cleanup"):
+                raise OSError("busy")
+    summary = job.summary()
+    assert [record["stage"] for record in summary["spans"]] == ["download", "cleanup"]
+    assert summary["spans"][0]["url"] == "u" and summary["spans"][1]["error"] == "OSError"
+    assert set(summary["stages"]) == {"download", "cleanup"}
+    assert metrics.STAGE_ERRORS._values[(("stage", "cleanup"), ("error", "OSError"))] == before + 1
+    assert metrics.STAGE_IN_PROGRESS._values[(("stage", "cleanup"),)] == 0
+
+
+def test_metrics_endpoint_counts_requests_by_route():
+    import main
+
+    client = TestClient(main.app)
+    client.get("/jobs/none.0")
+    text = client.get("/metrics").text
+    assert "# TYPE ytaudio_stage_seconds histogram" in text
+    assert 'ytaudio_http_requests_total{method="GET",route="/jobs/{job_id}",status="404"}' in text
+    assert "ytaudio_result_cache_hits_total" in text
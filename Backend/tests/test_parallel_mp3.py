@@ -0,0 +1,103 @@
+import array
+import math
+import os
+import subprocess
+
+import pytest
+
+from conftest import requires_ffmpeg
+from formats import encoder_args
+from parallel_mp3 import (
+    crc16, crc16_shift, crc16_trim, encode_parallel, info_tag_offset, join_chunks, split_frames, tag_music,
+)
+
+SECONDS = 40
+
+
+def decode_samples(path):
+    """Decoded 16-bit interleaved samples of an audio file"""
+    result = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", str(path), "-f", "s16le", "-c:a", "pcm_s16le", "pipe:1"],
+        check=True, capture_output=True
+    )
+    samples = array.array("h")
+    samples.frombytes(result.stdout)
+    return samples
+
+
+def similarity(reference, candidate):
+    """(correlation, SNR in dB) over the common length"""
+    n = min(len(reference), len(candidate))
+    dot = ref_energy = cand_energy = noise = 0
+    for a, b in zip(reference[:n], candidate[:n]):
+        dot += a * b
+        ref_energy += a * a
+        cand_energy += b * b
+        noise += (a - b) * (a - b)
+    correlation = dot / math.sqrt(ref_energy * cand_energy)
+    return correlation, (10 * math.log10(ref_energy / noise) if noise else math.inf)
+
+
+@pytest.fixture(scope="module")
+def source(tmp_path_factory):
+    """A sweep plus noise bursts, so seams land on changing material"""
+    path = tmp_path_factory.mktemp("parallel") / "source.flac"
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"aevalsrc=0.4*sin(2*PI*(200+40*t)*t)|0.4*sin(2*PI*(300+25*t)*t):s=44100:d={SECONDS}",
+        "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.2:d={SECONDS}:r=44100",
+        "-filter_complex", "[1]volume='gt(mod(t,7),5)':eval=frame,pan=stereo|c0=c0|c1=c0[n];[0][n]amix=inputs=2",
+        "-c:a", "flac", str(path)
+    ], check=True)
+    return path
+
+
+def test_crc16_is_linear():
+    assert crc16(b"123456789") == 0xBB3D
+    a, b, c = os.urandom(700), os.urandom(5000), os.urandom(300)
+    assert crc16(a + b) == crc16_shift(crc16(a), len(b)) ^ crc16(b)
+    assert crc16_shift(crc16_shift(crc16(a), 999), -999) == crc16(a)
+    assert crc16_trim(crc16(a + b + c), a, c, len(b)) == crc16(b)
+
+
+@requires_ffmpeg
+@pytest.mark.parametrize("preset", ["mp3-320", "mp3-v2"])
+def test_parallel_matches_single_pass(source, tmp_path, preset):
+    single = tmp_path / "single.mp3"
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", str(source), "-vn", *encoder_args("mp3", preset), str(single)],
+        check=True
+    )
+    parallel = tmp_path / "parallel.mp3"
+    encode_parallel(source, parallel, encoder_args("mp3", preset), workers=4, chunks=4)
+
+    source_pcm, single_pcm, parallel_pcm = (decode_samples(p) for p in (source, single, parallel))
+    # Gapless: the Info tag trims the joined stream to the exact source length
+    assert len(parallel_pcm) == len(source_pcm) == len(single_pcm)
+    correlation, _ = similarity(single_pcm, parallel_pcm)
+    assert correlation > 0.999
+    _, snr = similarity(source_pcm, parallel_pcm)
+    assert snr > 20
+
+
+@requires_ffmpeg
+def test_joined_tag_matches_audio(source, tmp_path, monkeypatch):
+    """The music length and CRC derived per chunk equal those of the joined frames"""
+    parallel = tmp_path / "parallel.mp3"
+    joined = []
+
+    def spy(parts, *args):
+        joined.append([os.path.getsize(part) for part in parts])
+        return join_chunks(parts, *args)
+
+    monkeypatch.setattr("parallel_mp3.join_chunks", spy)
+    encode_parallel(source, parallel, encoder_args("mp3"), workers=3, chunks=3)
+    assert len(joined[0]) == 3
+
+    data = parallel.read_bytes()
+    frames = split_frames(data)
+    tag = data[frames[0][0]:frames[0][1]]
+    assert info_tag_offset(tag) is not None
+    length, crc = tag_music(tag)
+    assert length == frames[-1][1] - frames[0][0]
+    assert crc == crc16(data[frames[1][0]:frames[-1][1]])
@@ -0,0 +1,69 @@
+import contextlib
+import subprocess
+
+import pytest
+
+import pipeline
+from conftest import requires_ffmpeg
+from pipeline import TranscodeError, transcode_stream
+
+
+@pytest.fixture(scope="module")
+def mp3():
+    return subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=30",
+         "-c:a", "libmp3lame", "-f", "mp3", "pipe:1"],
+        check=True, capture_output=True
+    ).stdout
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    state = {"held": False, "taken": 0}
+
+    @contextlib.contextmanager
+    def slot():
+        state["held"] = True
+        state["taken"] += 1
+        try:
+            yield
+        finally:
+            state["held"] = False
+
+    monkeypatch.setattr(pipeline, "transcode_slot", slot)
+    return state
+
+
+def fake_source(monkeypatch, data, slots, closed):
+    chunks = [data[i:i + 64 * 1024] for i in range(0, len(data), 64 * 1024)]
+
+    def source():
+        try:
+            for chunk in chunks[1:]:
+                # The network transfer must not run under a transcode slot
+                assert not slots["held"]
+                yield chunk
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(pipeline, "open_source", lambda *args, **kwargs: (chunks[0], source()))
+
+
+@requires_ffmpeg
+def test_slot_is_held_only_while_ffmpeg_has_work(monkeypatch, tmp_path, mp3, slots):
+    monkeypatch.setattr(pipeline, "FEED_BYTES", 128 * 1024)
+    closed = []
+    fake_source(monkeypatch, mp3, slots, closed)
+    out = transcode_stream(None, {}, tmp_path / "out.opus", ["-c:a", "libopus", "-b:a", "64k"])
+    assert out.stat().st_size > 0
+    # One slot per fed block, plus one for the tail
+    assert slots["taken"] > 2 and closed
+
+
+@requires_ffmpeg
+def test_source_is_closed_when_ffmpeg_exits_early(monkeypatch, tmp_path, mp3, slots):
+    closed = []
+    fake_source(monkeypatch, mp3 * 20, slots, closed)
+    with pytest.raises(TranscodeError):
+        transcode_stream(None, {}, tmp_path / "out.opus", ["-c:a", "no_such_encoder"])
+    assert closed
@@ -0,0 +1,100 @@
+import pytest
+
+import presets
+from conftest import run_api_script
+from formats import PRESETS, QUALITIES, TARGETS
+from presets import PresetProfiler, default_preset, meets, pinned_preset
+
+
+@pytest.fixture
+def profiler(tmp_path, monkeypatch):
+    profiler = PresetProfiler(choices_file=tmp_path / "presets.json")
+    monkeypatch.setattr(presets, "preset_profiler", profiler)
+    return profiler
+
+
+def measure_all(profiler, round_=0):
+    for name in PRESETS:
+        # Drifting measurements that keep reordering the presets by cost
+        speed = 5 + (len(name) * 7 + round_ * 3) % 40
+        profiler.observe(name, 20, 20 / speed, PRESETS[name]["kbps"] * 1000 / 8 * 20)
+
+
+@pytest.mark.parametrize("target", [None, *TARGETS])
+@pytest.mark.parametrize("quality", QUALITIES)
+def test_default_preset_meets_the_tier(profiler, target, quality):
+    preset = default_preset(target, quality)
+    assert meets(PRESETS[preset]["quality"], quality)
+    assert target is None or PRESETS[preset]["target"] == target
+
+
+def test_target_default_is_its_tier_default_until_measured(profiler):
+    for target, spec in TARGETS.items():
+        assert default_preset(target, PRESETS[spec["preset"]]["quality"]) == spec["preset"]
+
+
+def test_default_follows_the_first_measurement_and_then_stays(profiler, tmp_path):
+    measure_all(profiler)
+    chosen = {(t, q): default_preset(t, q) for t in (None, *TARGETS) for q in QUALITIES}
+    assert chosen == {(t, q): profiler.cheapest(t, q) for t, q in chosen}
+    for round_ in range(1, 20):
+        measure_all(profiler, round_)
+    # The preset is part of the result cache key
+    assert any(profiler.cheapest(t, q) != name for (t, q), name in chosen.items())
+    assert {(t, q): default_preset(t, q) for t, q in chosen} == chosen
+    # Other workers and restarts read the same choices
+    restarted = PresetProfiler(choices_file=tmp_path / "presets.json")
+    assert {(t, q): restarted.choice(t, q) for t, q in chosen} == chosen
+
+
+def test_recorded_choices_are_not_overwritten(profiler, tmp_path):
+    other = PresetProfiler(choices_file=tmp_path / "presets.json")
+    other.observe("mp3-320", 20, 20 / 5, 320 * 1000 / 8 * 20)
+    other.observe("mp3-v0", 20, 20 / 50, 245 * 1000 / 8 * 20)
+    assert other.choice("mp3", "high") == "mp3-v0"
+    # This worker measures mp3-320 as cheaper, but keeps the first worker's choice
+    profiler.observe("mp3-320", 20, 20 / 500, 320 * 1000 / 8 * 20)
+    profiler.observe("mp3-v0", 20, 20 / 5, 245 * 1000 / 8 * 20)
+    assert profiler.cheapest("mp3", "high") == "mp3-320"
+    assert default_preset("mp3", "high") == "mp3-v0"
+
+
+def test_cheapest_needs_every_candidate_measured(profiler):
+    profiler.observe("mp3-320", 20, 1, 320 * 1000 / 8 * 20)
+    assert profiler.cheapest("mp3", "high") is None
+    assert default_preset("mp3", "high") == pinned_preset("mp3", "high")
+    profiler.observe("mp3-v0", 20, 0.5, 245 * 1000 / 8 * 20)
+    assert profiler.cheapest("mp3", "high") == "mp3-v0"
+
+
+def test_unknown_quality(profiler):
+    with pytest.raises(ValueError):
+        default_preset("mp3", "lossless")
+
+
+def test_quality_stays_on_the_requested_format(tmp_path):
+    script = """
+import json
+from fastapi import HTTPException
+from main import requested_output
+
+def output(*args):
+    try:
+        return requested_output(*args)
+    except HTTPException as e:
+        return e.status_code
+
+print(json.dumps({
+    "mp3": output(True, None, None, "high"),
+    "opus": output(False, "opus", None, "mobile"),
+    "native": output(False, None, None, None),
+    "native_quality": output(False, None, None, "high"),
+    "preset": output(False, None, "aac-96", None),
+}))
+"""
+    result = run_api_script(script, tmp_path)
+    assert result["mp3"] == ["mp3", "mp3-320"]
+    assert result["opus"] == ["opus", "opus-64"]
+    assert result["native"] == ["native", None]
+    assert result["native_quality"] == 400
+    assert result["preset"] == ["m4a", "aac-96"]
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import threading
+import uuid
+
+import pytest
+
+import progress
+from progress import DownloadCancelled, ProgressChannel, make_progress_hook
+
+
+def downloading(percent):
+    return {"status": "downloading", "percent": f"{percent}%"}
+
+
+# Never runs: publish only schedules the consumer's wake-up on it
+LOOP = asyncio.new_event_loop()
+
+
+def channel(maxsize=32):
+    return ProgressChannel(LOOP, maxsize)
+
+
+# ---- channel ----
+def test_progress_updates_coalesce_to_the_newest():
+    events = channel()
+    for percent in range(10):
+        events.publish(downloading(percent))
+    assert events.drain() == [downloading(9)]
+    assert events.drain() == []
+
+
+def test_status_change_keeps_order():
+    events = channel()
+    events.publish(downloading(1))
+    events.publish(downloading(2))
+    events.publish({"status": "converting"})
+    events.publish(downloading(3))
+    assert events.drain() == [downloading(2), {"status": "converting"}, downloading(3)]
+
+
+def test_oldest_status_events_dropped_when_full():
+    events = channel(maxsize=3)
+    for i in range(5):
+        events.publish({"status": "step", "index": i})
+    assert [event["index"] for event in events.drain()] == [2, 3, 4]
+
+
+def test_hook_converts_once_and_stops_when_cancelled():
+    events = channel()
+    hook = make_progress_hook(events)
+    hook({"status": "downloading", "_percent_str": " 50% ", "downloaded_bytes": 5, "total_bytes_estimate": 10})
+    hook({"status": "finished"})
+    hook({"status": "finished"})
+    drained = events.drain()
+    assert drained[0]["percent"] == "50%" and drained[0]["total_bytes"] == 10
+    assert [event["status"] for event in drained] == ["downloading", "converting"]
+
+    events.cancelled = True
+    with pytest.raises(DownloadCancelled):
+        hook({"status": "downloading"})
+
+
+# ---- stream_download ----
+async def collect(generator, limit=None):
+    events = []
+    async for message in generator:
+        events.append(json.loads(message[len("data: "):]))
+        if limit and len(events) >= limit:
+            break
+    await generator.aclose()
+    return events
+
+
+def test_stream_throttles_progress(monkeypatch):
+    def fake_download(url, convert_to_mp3, keep_original, progress_hook):
+        for i in range(200):
+            progress_hook({"status": "downloading", "_percent_str": f"{i / 2}%"})
+        progress_hook({"status": "finished"})
+        return {"status": "success"}
+
+    monkeypatch.setattr(progress, "download_audio_from_youtube", fake_download)
+    events = asyncio.run(collect(progress.stream_download(f"https://youtu.be/{uuid.uuid4().hex}", True, False)))
+    statuses = [event["status"] for event in events]
+    assert statuses[0] == "starting" and statuses[-1] == "completed"
+    assert events[-1]["results"] == {"status": "success"}
+    assert "converting" in statuses
+    # The 200 updates were merged, and the last one still made it out
+    assert statuses.count("downloading") < 20
+    assert [event for event in events if event["status"] == "downloading"][-1]["percent"] == "99.5%"
+
+
+def test_stream_reports_errors(monkeypatch):
+    def fake_download(url, convert_to_mp3, keep_original, progress_hook):
+        raise RuntimeError("no formats")
+
+    monkeypatch.setattr(progress, "download_audio_from_youtube", fake_download)
+    events = asyncio.run(collect(progress.stream_download(f"https://youtu.be/{uuid.uuid4().hex}", True, False)))
+    assert events[-1] == {"status": "error", "message": "no formats"}
+
+
+def test_disconnect_cancels_the_download(monkeypatch):
+    stopped = threading.Event()
+
+    def fake_download(url, convert_to_mp3, keep_original, progress_hook):
+        try:
+            for _ in range(1000):
+                progress_hook({"status": "downloading"})
+                threading.Event().wait(0.01)
+        except DownloadCancelled:
+            stopped.set()
+            raise
+        return {"status": "success"}
+
+    monkeypatch.setattr(progress, "download_audio_from_youtube", fake_download)
+    # The client leaves after the first progress event
+    events = asyncio.run(collect(progress.stream_download(f"https://youtu.be/{uuid.uuid4().hex}", True, False),
+                                 limit=2))
+    assert events[-1]["status"] == "downloading"
+    assert stopped.wait(5)
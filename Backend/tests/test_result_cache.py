@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+from result_cache import ResultCache, cache_key
+
+
+def source(tmp_path, name, size=100):
+    path = tmp_path / "src" / name
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(os.urandom(size))
+    return path
+
+
+def test_miss_then_hit(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    key = cache_key("dQw4w9WgXcQ", "mp3", "mp3-320", "libmp3lame")
+    assert cache.get(key) is None
+
+    song = source(tmp_path, "song.mp3")
+    published = cache.publish(key, song, title="song")
+    entry = cache.get(key)
+    assert entry == published
+    assert entry["path"].read_bytes() == song.read_bytes()
+    assert entry["sha256"] == hashlib.sha256(song.read_bytes()).hexdigest()
+    assert cache.find(entry["path"].parent.name) == entry
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    # record=False re-checks without counting
+    cache.get(key, record=False)
+    cache.get("other", record=False)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=250)
+    for name in ("a", "b"):
+        cache.publish(name, source(tmp_path, f"{name}.mp3"))
+    # "a" becomes the most recent, so "b" goes when "c" does not fit
+    cache.get("a")
+    cache.publish("c", source(tmp_path, "c.mp3"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 200
+
+
+def test_newest_entry_kept_even_over_budget(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=50)
+    cache.publish("big", source(tmp_path, "big.mp3"))
+    assert cache.get("big") is not None
+
+
+def test_publish_is_atomic(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path / "cache")
+    song = source(tmp_path, "song.mp3")
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    # A publish that fails half-way leaves neither an entry nor its temp directory
+    monkeypatch.setattr("result_cache.file_digest", fail)
+    with pytest.raises(OSError):
+        cache.publish("key", song)
+    monkeypatch.undo()
+    assert cache.get("key") is None
+    assert list((tmp_path / "cache").iterdir()) == []
+    assert song.exists()
+
+    # Move hands over the file; a second publish of the same key keeps the first
+    first = cache.publish("key", song, move=True)
+    assert not song.exists()
+    again = cache.publish("key", source(tmp_path, "song.mp3"))
+    assert again["path"] == first["path"] and again["sha256"] == first["sha256"]
+    assert [p.name for p in (tmp_path / "cache").iterdir()] == [first["path"].parent.name]
+
+
+def test_scan_indexes_entries_and_drops_leftovers(tmp_path):
+    root = tmp_path / "cache"
+    cache = ResultCache(root)
+    entry = cache.publish("key", source(tmp_path, "song.mp3"), title="song")
+    (root / ".tmp-interrupted").mkdir()
+    corrupt = root / ("f" * 64)
+    corrupt.mkdir()
+    (corrupt / "meta.json").write_text("{")
+
+    # Another process (or a restart) sees the same directory
+    restarted = ResultCache(root)
+    restarted.scan()
+    assert restarted.stats()["entries"] == 1
+    assert restarted.get("key")["path"] == entry["path"]
+    assert sorted(p.name for p in root.iterdir()) == [entry["path"].parent.name]
+    assert json.loads((entry["path"].parent / "meta.json").read_text())["title"] == "song"
+
+
+def test_entry_removed_on_disk_is_a_miss(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    entry = cache.publish("key", source(tmp_path, "song.mp3"))
+    entry["path"].unlink()
+    assert cache.get("key") is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
@@ -0,0 +1,124 @@
+import hashlib
+import os
+
+import pytest
+
+import segmented
+from local_server import LocalMediaServer
+from segmented import SegmentedYoutubeDL, state_file
+
+SIZE = 6 * 1024 * 1024 + 12345
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def fixed_connections(monkeypatch):
+    # Fixed connection counts, and nothing read from or written to the learned host settings
+    monkeypatch.setattr(segmented, "ADAPTIVE_CONNECTIONS", False)
+    monkeypatch.setattr(segmented.host_settings, "get", lambda url: None)
+
+
+@pytest.fixture(scope="module")
+def media(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("media")
+    payload = os.urandom(SIZE)
+    (directory / "track.bin").write_bytes(payload)
+    return directory, payload
+
+
+def download(url, target, connections, hook=None):
+    ydl = SegmentedYoutubeDL({"quiet": True, "noprogress": True, "concurrent_fragment_downloads": connections})
+    if hook:
+        ydl.add_progress_hook(hook)
+    try:
+        ydl.dl(str(target), {"id": "track", "url": url, "ext": "bin", "protocol": "http"})
+    finally:
+        ydl.close()
+
+
+def interrupt_after(limit):
+    def hook(status):
+        if status["status"] == "downloading" and status["downloaded_bytes"] >= limit:
+            raise Interrupted()
+    return hook
+
+
+def first_progress(statuses):
+    return next(s["downloaded_bytes"] for s in statuses if s["status"] == "downloading")
+
+
+def sha256(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def interrupted_download(server, target):
+    """Leave a sparse .part and its segment state behind, as a cancelled download does"""
+    with pytest.raises(Interrupted):
+        download(server.url("track.bin"), target, 4, interrupt_after(SIZE // 4))
+    part = target.with_name(target.name + ".part")
+    assert os.path.exists(state_file(str(part)))
+    return part
+
+
+@pytest.mark.parametrize("connections", [2, 4])
+def test_download_matches_source(media, tmp_path, connections):
+    directory, payload = media
+    with LocalMediaServer(directory, per_connection_bps=8 * 1024 * 1024) as server:
+        download(server.url("track.bin"), tmp_path / "track.bin", connections)
+        assert server.requests > connections
+    assert sha256(tmp_path / "track.bin") == hashlib.sha256(payload).hexdigest()
+
+
+def test_interrupted_download_resumes(media, tmp_path):
+    directory, payload = media
+    target = tmp_path / "track.bin"
+    statuses = []
+    with LocalMediaServer(directory, per_connection_bps=2 * 1024 * 1024) as server:
+        part = interrupted_download(server, target)
+        with open(state_file(str(part))) as f:
+            saved = sum(end - start for start, end in segmented.json.load(f)["done"])
+        assert saved >= SIZE // 4
+        download(server.url("track.bin"), target, 4, statuses.append)
+    assert first_progress(statuses) >= saved
+    assert sha256(target) == hashlib.sha256(payload).hexdigest()
+    assert not part.exists() and not os.path.exists(state_file(str(part)))
+
+
+def test_single_connection_discards_sparse_part(media, tmp_path):
+    # One connection goes straight to HttpFD, which would resume from the size of the sparse file
+    directory, payload = media
+    target = tmp_path / "track.bin"
+    statuses = []
+    with LocalMediaServer(directory, per_connection_bps=2 * 1024 * 1024) as server:
+        part = interrupted_download(server, target)
+        download(server.url("track.bin"), target, 1, statuses.append)
+    assert first_progress(statuses) < SIZE // 4
+    assert sha256(target) == hashlib.sha256(payload).hexdigest()
+    assert not os.path.exists(state_file(str(part)))
+
+
+def test_fallback_without_ranges_discards_sparse_part(media, tmp_path):
+    directory, payload = media
+    target = tmp_path / "track.bin"
+    with LocalMediaServer(directory, per_connection_bps=2 * 1024 * 1024) as server:
+        part = interrupted_download(server, target)
+    with LocalMediaServer(directory, ranges=False) as server:
+        download(server.url("track.bin"), target, 4)
+    assert sha256(target) == hashlib.sha256(payload).hexdigest()
+    assert not os.path.exists(state_file(str(part)))
+
+
+def test_contiguous_part_is_kept(media, tmp_path):
+    # A .part without segment state was written by HttpFD: the segmented download continues it
+    directory, payload = media
+    target = tmp_path / "track.bin"
+    kept = SIZE // 2
+    # Marker bytes show the existing part was kept rather than fetched again
+    (tmp_path / "track.bin.part").write_bytes(bytes(kept))
+    with LocalMediaServer(directory, per_connection_bps=4 * 1024 * 1024) as server:
+        download(server.url("track.bin"), target, 4)
+    data = target.read_bytes()
+    assert data[:kept] == bytes(kept) and data[kept:] == payload[kept:]
@@ -0,0 +1,115 @@
+import hashlib
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from result_cache import cache_key
+
+PAYLOAD = os.urandom(100_000)
+ETAG = f'"{hashlib.sha256(PAYLOAD).hexdigest()}"'
+client = TestClient(main.app)
+
+
+@pytest.fixture
+def result_url(tmp_path):
+    """Content-Location of a result cache entry holding PAYLOAD"""
+    source = tmp_path / "song.mp3"
+    source.write_bytes(PAYLOAD)
+    entry = main.result_cache.publish(cache_key("dQw4w9WgXcQ", "mp3"), source, title="song")
+    return f"/result/dQw4w9WgXcQ/{entry['path'].parent.name}"
+
+
+@pytest.fixture
+def temp_file():
+    """A file in temporary storage, as the legacy endpoints left them"""
+    directory = main.TEMP_DOWNLOAD_DIR / "legacy_test"
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / "song.mp3"
+    path.write_bytes(PAYLOAD)
+    return path
+
+
+# ---- /result ----
+def test_whole_file_carries_validators(result_url):
+    response = client.get(result_url)
+    assert response.status_code == 200
+    assert response.content == PAYLOAD
+    assert response.headers["etag"] == ETAG
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "last-modified" in response.headers
+
+
+def test_range(result_url):
+    response = client.get(result_url, headers={"Range": "bytes=1000-1999"})
+    assert response.status_code == 206
+    assert response.content == PAYLOAD[1000:2000]
+    assert response.headers["content-range"] == f"bytes 1000-1999/{len(PAYLOAD)}"
+
+    # Open-ended and suffix ranges
+    assert client.get(result_url, headers={"Range": "bytes=99000-"}).content == PAYLOAD[99000:]
+    assert client.get(result_url, headers={"Range": "bytes=-500"}).content == PAYLOAD[-500:]
+
+
+def test_unsatisfiable_range(result_url):
+    response = client.get(result_url, headers={"Range": f"bytes={len(PAYLOAD)}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(PAYLOAD)}"
+    assert response.content == b""
+
+
+def test_conditional_get(result_url):
+    response = client.get(result_url, headers={"If-None-Match": ETAG})
+    assert response.status_code == 304 and response.content == b""
+    last_modified = client.head(result_url).headers["last-modified"]
+    assert client.get(result_url, headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get(result_url, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_if_range(result_url):
+    # Same version: the range is served
+    response = client.get(result_url, headers={"Range": "bytes=0-99", "If-Range": ETAG})
+    assert response.status_code == 206 and response.content == PAYLOAD[:100]
+    # Changed (or weak) validator: the whole file instead
+    for validator in ('"other"', f"W/{ETAG}"):
+        response = client.get(result_url, headers={"Range": "bytes=0-99", "If-Range": validator})
+        assert response.status_code == 200 and response.content == PAYLOAD
+
+
+def test_head(result_url):
+    response = client.head(result_url, headers={"Range": "bytes=0-99"})
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "100"
+    assert response.content == b""
+
+
+def test_evicted_result():
+    assert client.get("/result/dQw4w9WgXcQ/" + "0" * 64).status_code == 404
+
+
+# ---- /file ----
+def test_file_serves_temporary_storage(temp_file):
+    response = client.get("/file", params={"path": str(temp_file)}, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == PAYLOAD[10:20]
+    response = client.head("/file", params={"path": str(temp_file)})
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(PAYLOAD))
+
+
+def test_file_missing_is_404():
+    response = client.get("/file", params={"path": str(main.TEMP_DOWNLOAD_DIR / "gone" / "song.mp3")})
+    assert response.status_code == 404
+
+
+def test_file_outside_storage_is_refused(temp_file, tmp_path):
+    outside = tmp_path / "secret.txt"
+    outside.write_text("secret")
+    for path in (outside, temp_file.parent / ".." / ".." / outside.name, main.TEMP_DOWNLOAD_DIR):
+        assert client.get("/file", params={"path": str(path)}).status_code == 403
+    # A path that merely contains the directory name
+    decoy = tmp_path / "temp_downloads" / "song.mp3"
+    decoy.parent.mkdir()
+    decoy.write_bytes(PAYLOAD)
+    assert client.get("/file", params={"path": str(decoy)}).status_code == 403
@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from conftest import BACKEND
+from metadata import info_flight
+from singleflight import SINGLEFLIGHT_LOCK_DIR, SingleFlight
+
+
+def test_lock_is_on_by_default():
+    # Worker processes share the stable work directories under the temp root
+    assert SINGLEFLIGHT_LOCK_DIR
+    assert SingleFlight().lock_dir is not None
+
+
+def test_metadata_lookups_take_no_file_lock():
+    assert info_flight.lock_dir is None
+
+
+def test_state_dir_does_not_follow_the_working_directory(tmp_path):
+    env = {k: v for k, v in os.environ.items() if k not in ("TEMP_DOWNLOAD_DIR", "SINGLEFLIGHT_LOCK_DIR")}
+    run = subprocess.run(
+        [sys.executable, "-c", "import singleflight; print(singleflight.SINGLEFLIGHT_LOCK_DIR)"],
+        cwd=tmp_path, env={**env, "PYTHONPATH": str(BACKEND)}, capture_output=True, text=True, check=True
+    )
+    assert run.stdout.strip() == str(BACKEND / "temp_downloads" / ".state" / "locks")
+    assert not any(tmp_path.iterdir())
+
+
+def run_once(lock_dir, log_path, name):
+    def produce(hook):
+        with open(log_path, "a") as log:
+            log.write(f"start {name} {time.time()}\n")
+        time.sleep(0.5)
+        with open(log_path, "a") as log:
+            log.write(f"end {name} {time.time()}\n")
+        return name
+
+    SingleFlight(lock_dir).do("video:mp3:mp3-320:libmp3lame", produce)
+
+
+def test_identical_downloads_in_two_processes_do_not_overlap(tmp_path):
+    log_path = tmp_path / "log"
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_once, args=(str(tmp_path / "locks"), str(log_path), name))
+        for name in ("a", "b")
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    events = [line.split() for line in log_path.read_text().splitlines()]
+    assert [event for event, _, _ in events] == ["start", "end", "start", "end"]
+    assert events[0][1] == events[1][1] and events[2][1] == events[3][1]
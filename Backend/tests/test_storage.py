@@ -0,0 +1,103 @@
+import multiprocessing
+import time
+
+import pytest
+
+import storage
+from storage import StorageFull, StorageManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = StorageManager(tmp_path / "temp", quota=1000, min_free=0, interval=3600, max_age=3600)
+    yield manager
+    manager.stop()
+
+
+def fill(manager, name, size):
+    path = manager.acquire(name)
+    (path / "data").write_bytes(bytes(size))
+    manager.release(path)
+    return path
+
+
+def test_admit_never_touches_the_disk(manager, monkeypatch):
+    fill(manager, "work_a", 1200)
+
+    def forbidden(*args):
+        raise AssertionError("admit must not scan or delete")
+
+    monkeypatch.setattr(storage, "_measure", forbidden)
+    monkeypatch.setattr(StorageManager, "_delete", staticmethod(forbidden))
+    with pytest.raises(StorageFull) as refused:
+        manager.admit()
+    # A sweep is pending, so the client is asked to come back soon
+    assert refused.value.retry_after == 1
+    assert manager.refused == 1
+
+
+def test_refusal_wakes_the_sweeper(manager):
+    manager.start()
+    deadline = time.time() + 5
+    while manager.sweeps == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    old = fill(manager, "work_old", 1200)
+
+    with pytest.raises(StorageFull):
+        manager.admit()
+    # The sweeper evicts the idle entry long before its interval is up
+    while manager.evictions == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager.evictions == 1 and not old.exists()
+    manager.admit()
+
+
+def test_entries_in_use_are_not_evicted(manager):
+    busy = manager.acquire("work_busy")
+    (busy / "data").write_bytes(bytes(1200))
+    manager.sweep()
+    assert busy.exists()
+    assert not manager.has_capacity()
+    manager.release(busy)
+    manager.sweep()
+    assert not busy.exists() and manager.has_capacity()
+
+
+def test_kept_entries_are_not_evicted_under_pressure(tmp_path):
+    kept = set()
+    manager = StorageManager(tmp_path / "temp", quota=1000, min_free=0, interval=3600, max_age=3600,
+                             keep=lambda: kept)
+    partial = fill(manager, "work_partial", 1200)
+    kept.add(partial)
+    manager.sweep()
+    assert partial.exists() and manager.evictions == 0
+
+
+def use_entry(root, name, ready, done):
+    manager = StorageManager(root)
+    path = manager.acquire(name)
+    (path / "data").write_bytes(bytes(1200))
+    ready.set()
+    done.wait(30)
+    manager.release(path)
+
+
+@pytest.mark.skipif(storage.fcntl is None, reason="entry locks need fcntl")
+def test_entries_another_process_uses_are_not_evicted(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    ready, done = context.Event(), context.Event()
+    other = context.Process(target=use_entry, args=(tmp_path / "temp", "work_shared", ready, done))
+    other.start()
+    try:
+        assert ready.wait(30)
+        # Found by the startup scan, idle as far as this process knows
+        manager = StorageManager(tmp_path / "temp", quota=1000, min_free=0, interval=3600, max_age=0)
+        manager._scan()
+        manager.sweep()
+        assert (tmp_path / "temp" / "work_shared").exists()
+        assert manager.evictions == 0 and manager.expired == 0
+    finally:
+        done.set()
+        other.join(30)
+    manager.sweep()
+    assert not (tmp_path / "temp" / "work_shared").exists()
@@ -0,0 +1,78 @@
+import pytest
+
+from ydl_pool import YoutubeDLPool
+
+
+class FakeYoutubeDL:
+    """Holds the attributes the pool sets and restores, like YoutubeDL"""
+
+    def __init__(self, params):
+        self.params = {"outtmpl": {"default": "%(title)s.%(ext)s"}, "format": "bestaudio", **params}
+        self.format_selector = "built:bestaudio"
+        self._progress_hooks = ["base hook"]
+        self.closed = False
+
+    def build_format_selector(self, spec):
+        return f"built:{spec}"
+
+    def close(self):
+        self.closed = True
+
+
+def pool(**kwargs):
+    return YoutubeDLPool(factory=FakeYoutubeDL, **kwargs)
+
+
+def test_lease_applies_then_restores_job_settings():
+    ydls = pool()
+    with ydls.lease({"quiet": True}, outtmpl="/tmp/job/%(id)s", format="251",
+                    progress_hooks=["job hook"]) as ydl:
+        assert ydl.params["outtmpl"]["default"] == "/tmp/job/%(id)s"
+        assert (ydl.params["format"], ydl.format_selector) == ("251", "built:251")
+        assert ydl._progress_hooks == ["base hook", "job hook"]
+
+    assert ydl.params["outtmpl"] == {"default": "%(title)s.%(ext)s"}
+    assert (ydl.params["format"], ydl.format_selector) == ("bestaudio", "built:bestaudio")
+    assert ydl._progress_hooks == ["base hook"]
+    assert not ydl.closed
+
+
+def test_callable_format_is_the_selector():
+    def selector(ctx):
+        yield from ()
+
+    with pool().lease({}, format=selector) as ydl:
+        assert ydl.format_selector is selector
+
+
+def test_instances_reused_per_option_variant():
+    ydls = pool()
+    with ydls.lease({"quiet": True, "noplaylist": True}) as first:
+        pass
+    with ydls.lease({"noplaylist": True, "quiet": True}) as again:
+        assert again is first
+    with ydls.lease({"quiet": False}) as other:
+        assert other is not first
+    assert ydls.stats() == {"created": 2, "reused": 1, "idle": 2}
+
+
+def test_instance_discarded_after_an_error():
+    ydls = pool()
+    with pytest.raises(RuntimeError):
+        with ydls.lease({}, format="251") as broken:
+            raise RuntimeError("extractor failed")
+    assert broken.closed
+    assert broken.format_selector == "built:bestaudio"
+    with ydls.lease({}) as fresh:
+        assert fresh is not broken
+    assert ydls.stats()["idle"] == 1
+
+
+def test_idle_instances_bounded():
+    ydls = pool(max_idle=1)
+    leased = [ydls.acquire({}) for _ in range(3)]
+    for ydl in leased:
+        ydls.release(ydl)
+    assert [ydl.closed for ydl in leased] == [False, True, True]
+    ydls.close()
+    assert leased[0].closed and ydls.stats()["idle"] == 0
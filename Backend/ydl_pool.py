@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Pool of long-lived YoutubeDL instances, leased to one thread at a time.
+
+    YDL_POOL_IDLE - idle instances kept per option variant (default 4)
+"""
+
+import contextlib
+import os
+import threading
+
+YDL_POOL_IDLE = int(os.environ.get("YDL_POOL_IDLE", 4))
+
+def variant_key(opts):
+    """Stable key for a set of base options"""
+    return repr(sorted(opts.items()))
+
+def default_factory():
+    """The YoutubeDL class the pool builds by default (imports yt-dlp)"""
+    from segmented import SegmentedYoutubeDL
+    return SegmentedYoutubeDL
+
+class YoutubeDLPool:
+    """Checkout pool of YoutubeDL instances, keyed by base options"""
+
+    def __init__(self, max_idle=YDL_POOL_IDLE, factory=None):
+        self.max_idle = max_idle
+        # None builds SegmentedYoutubeDL, imported on first use
+        self.factory = factory
+        self._lock = threading.Lock()
+        # variant key -> idle instances, most recently used last
+        self._idle = {}
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, opts):
+        """Take an idle instance with these base options, or build a new one"""
+        key = variant_key(opts)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                ydl = idle.pop()
+                return ydl
+            self.created += 1
+        ydl = (self.factory or default_factory())(dict(opts))
+        ydl._pool_key = key
+        ydl._pool_base = {
+            "outtmpl": dict(ydl.params["outtmpl"]),
+            "format": ydl.params.get("format"),
+            "format_selector": ydl.format_selector,
+            "progress_hooks": list(ydl._progress_hooks),
+        }
+        return ydl
+
+    def release(self, ydl, discard=False):
+        """Return an instance to the pool (or close it if discarded or the pool is full)"""
+        base = ydl._pool_base
+        ydl.params["outtmpl"] = dict(base["outtmpl"])
+        ydl.params["format"] = base["format"]
+        ydl.format_selector = base["format_selector"]
+        ydl._progress_hooks = list(base["progress_hooks"])
+        if not discard:
+            with self._lock:
+                idle = self._idle.setdefault(ydl._pool_key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(ydl)
+                    return
+        ydl.close()
+
+    @staticmethod
+    def configure(ydl, outtmpl=None, format=None, progress_hooks=None):
+        """Apply per-job settings to a leased instance"""
+        if outtmpl is not None:
+            ydl.params["outtmpl"] = {**ydl._pool_base["outtmpl"], "default": outtmpl}
+        if format is not None:
+            ydl.params["format"] = format
+            ydl.format_selector = format if callable(format) else ydl.build_format_selector(format)
+        if progress_hooks is not None:
+            ydl._progress_hooks = [*ydl._pool_base["progress_hooks"], *progress_hooks]
+        return ydl
+
+    @contextlib.contextmanager
+    def lease(self, opts, **overrides):
+        """``with pool.lease(opts, outtmpl=..., format=..., progress_hooks=[...]) as ydl:``"""
+        ydl = self.configure(self.acquire(opts), **overrides)
+        try:
+            yield ydl
+        except BaseException:
+            self.release(ydl, discard=True)
+            raise
+        self.release(ydl)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for instances in idle.values():
+            for ydl in instances:
+                ydl.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "idle": sum(len(instances) for instances in self._idle.values()),
+            }
+
+# Process-wide pool shared by downloads, metadata probes and batch expansion
+ydl_pool = YoutubeDLPool()